@@ -11,14 +11,18 @@ National Survey of Victimization and Perception of Public Safety (INEGI, 2021) u
 """
 
 # Libraries importation
+import os
 import numpy as np
 import pandas as pd
 import json
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.compose import ColumnTransformer
 import streamlit as st
-from tensorflow.keras.models import model_from_json
-import plotly.express as px
+from encoding import FeatureLayout
+from registry import CatalogueRegistry
+from startup import load_artifact
+from prediction_cache import PredictionCache, profile_key
+import metrics
+from catalogues import (housing_class_dict, kinship_dict, education_dict, activity_dict, job_dict, sex_dict,
+                        state_dict, hour_dict, social_class_dict, crime_labels, default_labels)
 
 # Page configuration
 st.set_page_config(
@@ -33,207 +37,6 @@ st.set_page_config(
     }
 )
 
-# Attribute Dictionaries
-# Housing Class Attribute Dictionary
-housing_class_dict = {
-    1: "Stand-alone house",
-    2: "Apartment in building",
-    3: "Vecindad",
-    4: "Rooftop room housing",
-    5: "Premises not built for housing"
-}
-
-# Kinship Attribute Dictionary
-kinship_dict = {
-    1: "Household head",
-    2: "Spouse",
-    3: "Child",
-    4: "Parent",
-    5: "Other relationship",
-    6: "No relationship"
-}
-
-# Education Attribute Dictionary
-education_dict = {
-    0: "None",
-    1: "Preschool",
-    2: "Elementary",
-    3: "Secondary",
-    4: "Technical with secondary school",
-    5: "Basic normal",
-    6: "High School",
-    7: "Technical with high school",
-    8: "Bachelor or professional",
-    9: "Master's or PhD",
-    99: "Not specified"
-}
-
-# Activity Attribute Dictionary
-activity_dict = {
-    1: "Worker",
-    2: "Had a job but didn't work",
-    3: "Looking for a job",
-    4: "Student",
-    5: "Housekeeper",
-    6: "Retired or pensioner",
-    7: "Permanently disabled from working",
-    8: "Didn't work",
-    9: "Not specified",
-}
-
-# Job Attribute Dictionary
-job_dict = {
-    1: "Laborer or pawn",
-    2: "Employee or worker",
-    3: "Self-employed worker",
-    4: "Boss or employer",
-    5: "Unpaid worker",
-    9: "Not specified",
-}
-
-# Sex Attribute Dictionary
-sex_dict = {
-    1: "Male",
-    2: "Female"
-}
-
-# Metropolitan Area Dictionary
-metro_area_dict = {
-    0:"Not applicable",
-    1:"Ciudad de México",
-    2:"Guadalajara",
-    3:"Monterrey",
-    4:"Puebla",
-    5:"León",
-    6:"La Laguna",
-    7:"San Luis Potosí",
-    8:"Mérida",
-    9:"Chihuahua",
-    10:"Tampico",
-    12:"Veracruz",
-    13:"Acapulco",
-    14:"Aguascalientes",
-    15:"Morelia",
-    16:"Toluca",
-    17:"Saltillo",
-    18:"Villahermosa",
-    19:"Tuxtla Gutiérrez",
-    21:"Tijuana",
-    24:"Culiacán",
-    25:"Hermosillo",
-    26:"Durango",
-    27:"Tepic",
-    28:"Campeche",
-    29:"Cuernavaca",
-    31:"Oaxaca",
-    32:"Zacatecas",
-    33:"Colima",
-    36:"Querétaro",
-    39:"Tlaxcala",
-    40:"La Paz",
-    41:"Cancún",
-    43:"Pachuca"
-}
-
-# State Attribute Dictionary
-state_dict = {
-    1: "Aguascalientes",
-    2: "Baja California",
-    3: "Baja California Sur",
-    4: "Campeche",
-    5: "Coahuila",
-    6: "Colima",
-    7: "Chiapas",
-    8: "Chihuahua",
-    9: "Ciudad de México",
-    10: "Durango",
-    11: "Guanajuato",
-    12: "Guerrero",
-    13: "Hidalgo",
-    14: "Jalisco",
-    15: "Estado de México",
-    16: "Michoacán",
-    17: "Morelos",
-    18: "Nayarit",
-    19: "Nuevo León",
-    20: "Oaxaca",
-    21: "Puebla",
-    22: "Querétaro",
-    23: "Quintana Roo",
-    24: "San Luis Potosí",
-    25: "Sinaloa",
-    26: "Sonora",
-    27: "Tabasco",
-    28: "Tamaulipas",
-    29: "Tlaxcala",
-    30: "Veracruz",
-    31: "Yucatán",
-    32: "Zacatecas",
-    99: "Not specified"
-}
-
-# Month Attribute Dictionary
-month_dict = {
-    1: "January",
-    2: "February",
-    3: "March",
-    4: "April",
-    5: "May",
-    6: "June",
-    7: "July",
-    8: "August",
-    9: "September",
-    10: "Octocer",
-    11: "November",
-    12: "December",
-    99: "Not specified"
-}
-
-# Hour Attribute Dictionary
-hour_dict = {
-    1: "Morning",
-    2: "Afternoon",
-    3: "Night",
-    4: "Early morning",
-    9: "Not specified"
-}
-
-# Place Attribute Dictionary
-place_dict = {
-    1: "In the street",
-    2: "At home",
-    3: "In the workplace",
-    4: "In a business or establishment",
-    5: "In a public place",
-    6: "In the public transportation",
-    7: "In a highway",
-    8: "Other",
-    9: "Not specified",
-}
-
-# Category Attribute Dictionary
-category_dict = {
-    "U": "Urban",
-    "C": "Urban complement",
-    "R": "Rural"
-}
-
-# Social Class Atribute Dictionary
-social_class_dict = {
-    1: "Low income",
-    2: "Lower middle income",
-    3: "Higher middle income",
-    4: "High income"
-}
-
-# Other Attributes dictionary
-other_dict = {
-    1: "Yes",
-    2: "No",
-    3: "Not applicable",
-    9: "Not specified"
-}
-
 # Functions
 
 # Function to select metropolitan area
@@ -286,82 +89,97 @@ def select_metro_area(state):
 
     return metro_area
 
-# Function to load the municipalities from serialized file
-@st.cache_data
-def get_municipalities():
+# Function to load the prebuilt startup artifact (see startup.py)
+@st.cache_resource
+def get_startup_artifact():
     """
-    Function to load the Mexican municipalities catalogue from the JSON file.
+    Function to load the prebuilt artifact with the municipalities catalogue and the feature layout.
     :return:
+    artifact (Python dict): Startup artifact, or None if it has not been built or is out of date.
+    """
 
-    municipalities_df (Pandas dataframe): Dataframe with the Mexican municipalities and their IDs.
+    return load_artifact()
+
+# Function to build the per-state index of municipalities from the loose files
+@metrics.track_cache("get_municipality_index")
+@st.cache_resource
+@metrics.track_load("get_municipality_index")
+def get_file_municipality_index():
+    """
+    Function to build, once per process, the alphabetically sorted municipality labels and their IDs for each
+    Mexican state, keyed by the state names displayed in the app, from the startup artifact or the catalogue file.
+    :return:
+    municipality_index (Python dict): Dictionary with the sorted labels ("labels") and the label-to-ID mapping
+    ("codes") of the municipalities of each state.
     """
 
-    municipalities_df = (pd.read_json("MexicanMunicipalitiesCatalogue.json", orient='index', typ='frame',
-                                  convert_axes=False, convert_dates=False).
-                      reset_index().rename(columns={"index":"Key", 0:"MunState"}))
+    artifact = get_startup_artifact()
+    if artifact is not None:
+        return artifact["municipality_index"]
 
-    municipalities_df = (pd.concat([municipalities_df, municipalities_df.MunState.str.split(', ', expand=True)], axis=1).
-                         rename(columns={0: "Municipality", 1: "State"}).
-                         drop(columns=["MunState", 2]).set_index("Key"))
+    municipality_index = get_file_registry().municipality_index(state_dict)
 
-    return municipalities_df
+    return municipality_index
 
-# Function to select the municipality
-def select_mun(state):
+# Function to build the catalogue of a model bundle
+@st.cache_resource(max_entries=2)
+def get_bundle_catalogue(version, _bundle):
+    """
+    Function to build, once per version of the model bundle, the catalogue registry and the per-state index of
+    municipalities from the municipalities catalogue packed in the bundle.
+    :param:
+    version (String): Version of the bundle, which keys the cache.
+    _bundle (ModelBundle): Model bundle.
+    :return:
+    registry (CatalogueRegistry): Catalogue registry, or None if the bundle has no catalogue.
+    municipality_index (Python dict): Per-state index of municipalities, or None if the bundle has no catalogue.
     """
-    Function to return the appropriate municipality dictionary according to the input Mexican state.
-
-    :parameter:
-    state (String): Input Mexican State
 
-    :returns:
-    mun_dict (Python dictionary): Dictionary with the municipalities for the input Mexican state
-    """
-
-    exc_mun_catalogue_dict = {
-        "Ciudad de México":"Ciudad de Mexico",
-        "Coahuila":"Coahuila de Zaragoza",
-        "Estado de México":"Mexico",
-        "Michoacán":"Michoacan de Ocampo",
-        "Nuevo León":"Nuevo Leon",
-        "San Luis Potosí":"San Luis Potosi",
-        "Veracruz":"Veracruz de Ignacio de la Llave",
-        "Yucatán":"Yucatan"
-    }
+    registry = _bundle.registry()
+    if registry is None:
+        return None, None
 
-    try:
-        state = exc_mun_catalogue_dict[state]
-    except:
-        state = state
+    return registry, registry.municipality_index(state_dict)
 
-    mun_cat = get_municipalities()
+# Function to retrieve the per-state index of municipalities
+def get_municipality_index():
+    """
+    Function to return the per-state index of municipalities of the served model: the one of the bundle's catalogue
+    when a bundle is served, or the one of the loose files otherwise.
+    :return:
+    municipality_index (Python dict): Dictionary with the sorted labels ("labels") and the label-to-ID mapping
+    ("codes") of the municipalities of each state.
+    """
 
-    mun_dict = (mun_cat[mun_cat.State == state].
-                         drop(columns=['State']).
-                         to_dict(orient='dict')
-                         )
+    watcher = get_bundle_watcher()
+    if watcher is not None:
+        bundle = watcher.current()
+        _, municipality_index = get_bundle_catalogue(bundle.version, bundle)
+        if municipality_index is not None:
+            return municipality_index
 
-    return mun_dict['Municipality']
+    return get_file_municipality_index()
 
-def get_encoded_value(value, dictionary):
+# Function to select the municipality
+def select_mun(state):
     """
-    Function to return the encoded value of a selected variable according to a provided dictionary.
+    Function to return the appropriate municipality labels according to the input Mexican state.
 
-    :param:
-    value (String): Selected value.
-    dictionary (Python dictionary): Dictionary containing the selected value and its equivalent encoded value.
+    :parameter:
+    state (String): Input Mexican State
 
     :returns:
-    encoded_value (Number): Corresponding encoded value for the input variable.
+    mun_labels (List): Alphabetically sorted municipalities of the input Mexican state
     """
-    encoded_value = [k for k, v in dictionary.items() if v == value]
 
-    if encoded_value:
-        return encoded_value[0]
-    return None
+    mun_labels = get_municipality_index()[state]["labels"]
+
+    return mun_labels
 
 # Function to load the encoders states from serialized file
+@metrics.track_cache("get_encoders")
 @st.cache_data
+@metrics.track_load("get_encoders")
 def get_encoders():
     """
     Function to retrieve and load the encoders states into the app from the JSON file.
@@ -377,7 +195,9 @@ def get_encoders():
     return encoders
 
 # Function to load the scalers max values from serialized file
+@metrics.track_cache("get_scalers")
 @st.cache_data
+@metrics.track_load("get_scalers")
 def get_scalers():
     """
     Function to retrieve and load the scalers maximum values into the app from the JSON file.
@@ -390,129 +210,158 @@ def get_scalers():
 
     return scalers
 
+# Function to load the compiled feature layout of the input array from the loose files
+@st.cache_resource
+def get_file_layout():
+    """
+    Function to compile the feature layout of the model's input array from the encoders states and scalers max values.
+    :return:
+    layout (FeatureLayout): Object with the column offset of every category of the input array.
+    """
+
+    artifact = get_startup_artifact()
+    if artifact is not None:
+        return artifact["layout"]
+
+    layout = FeatureLayout(get_encoders(), get_scalers())
+
+    return layout
+
+# Function to retrieve the compiled feature layout of the input array
+def get_layout():
+    """
+    Function to return the feature layout of the served model: the one of the current bundle when a bundle is served,
+    or the one of the loose files otherwise.
+    :return:
+    layout (FeatureLayout): Object with the column offset of every category of the input array.
+    """
+
+    watcher = get_bundle_watcher()
+    if watcher is not None:
+        return watcher.current().layout
+
+    return get_file_layout()
+
+# Function to load the catalogue registry of the predictors' vocabularies from the loose files
+@st.cache_resource
+def get_file_registry():
+    """
+    Function to build the registry with the label-to-code and code-to-column lookups of every predictor.
+    :return:
+    registry (CatalogueRegistry): Catalogue registry.
+    """
+
+    artifact = get_startup_artifact()
+    if artifact is not None:
+        return artifact["registry"]
+
+    registry = CatalogueRegistry.from_files("MunicipalitiesCatalogue.csv", get_file_layout())
+
+    return registry
+
+# Function to retrieve the catalogue registry of the predictors' vocabularies
+def get_registry():
+    """
+    Function to return the catalogue registry of the served model: the one of the current bundle's catalogue when a
+    bundle with a catalogue is served, or the one of the loose files otherwise.
+    :return:
+    registry (CatalogueRegistry): Catalogue registry.
+    """
+
+    watcher = get_bundle_watcher()
+    if watcher is not None:
+        bundle = watcher.current()
+        registry, _ = get_bundle_catalogue(bundle.version, bundle)
+        if registry is not None:
+            return registry
+
+    return get_file_registry()
+
 # Function to craft the input array for the model
+@metrics.timed("encode")
 def get_input_array(sex, age, education, activity, job,
                     social_class, category, housing_class,
                     people_household, kinship, state, metro_area,
-                    municipality, month, hour, place):
+                    municipality, month, hour, place, layout=None):
     """
-    Function to transform the encoded values into the input array for the multi-label classification model.
+    Function to transform the selected values into the input array for the multi-label classification model.
 
     :param:
-    sex (Integer): Sex encoded value.
+    sex (String): Sex selected value.
     age (Integer): Age value.
-    education (Integer): Education encoded value.
-    activity (Integer): Activity encoded value.
-    social_class (Integer): Social class encoded value.
-    category (Integer): Category encoded value.
-    housing_class (Integer): Housing class encoded value.
+    education (String): Education selected value.
+    activity (String): Activity selected value.
+    job (String): Job selected value.
+    social_class (String): Social class selected value.
+    category (String): Category selected value.
+    housing_class (String): Housing class selected value.
     people_household (Integer): Number of persons in the household
-    kinship (Integer): Kinship encoded value.
-    state (Integer): State encoded value.
-    metro_area (Integer): Metropolitan area encoded value.
-    municipality (Float): Municipality encoded value.
-    month (Integer): Month encoded value.
-    hour (Integer): Hour encoded value.
-    place (Integer): Place encoded value.
+    kinship (String): Kinship selected value.
+    state (String): State selected value.
+    metro_area (String): Metropolitan area selected value.
+    municipality (String): Municipality selected value.
+    month (String): Month selected value.
+    hour (String): Hour selected value.
+    place (String): Place selected value.
+    layout (FeatureLayout): Feature layout of the model (the one of Encoders.json and Scalers.json if None).
 
     :returns:
     input_array (Numpy array): Input array for the multi-label classification model.
     """
 
-    # Get encoded values
-    sex_encoded = get_encoded_value(sex, sex_dict)
-    education_encoded = get_encoded_value(education, education_dict)
-    activity_encoded = get_encoded_value(activity, activity_dict)
-    job_encoded = get_encoded_value(job, job_dict)
-    social_class_encoded = get_encoded_value(social_class, social_class_dict)
-    category_encoded = get_encoded_value(category, category_dict)
-    housing_class_encoded = get_encoded_value(housing_class, housing_class_dict)
-    kinship_encoded = get_encoded_value(kinship, kinship_dict)
-    state_encoded = get_encoded_value(state, state_dict)
-    metro_area_encoded = get_encoded_value(metro_area, metro_area_dict)
-    municipality_encoded = get_encoded_value(municipality, municipality_dict)
-    month_encoded = get_encoded_value(month, month_dict)
-    hour_encoded = get_encoded_value(hour, hour_dict)
-    place_encoded = get_encoded_value(place, place_dict)
-
-    # Scaling of numerical predictors
-    scalers = get_scalers()
-
-    people_household_sc = people_household / scalers["people_housing"]
-    age_sc = age / scalers["age"]
-
-    # Encoded values list
-    new_row = np.array([people_household_sc,
-                       age_sc,
-                       housing_class_encoded,
-                       kinship_encoded,
-                       education_encoded,
-                       activity_encoded,
-                       job_encoded,
-                       sex_encoded,
-                       metro_area_encoded,
-                       month_encoded,
-                       state_encoded,
-                       municipality_encoded,
-                       hour_encoded,
-                       place_encoded,
-                       category_encoded,
-                       social_class_encoded,
-                       ]).reshape(1, 16)
-
-
-    encoders = get_encoders()
-
-    encoder_housing_class = OneHotEncoder(categories=encoders["housing_class"], handle_unknown="ignore", sparse_output=False)
-    encoder_kinship = OneHotEncoder(categories=encoders["kinship"], handle_unknown="ignore", sparse_output=False)
-    encoder_education = OneHotEncoder(categories=encoders["education"], handle_unknown="ignore", sparse_output=False)
-    encoder_activity = OneHotEncoder(categories=encoders["activity"], handle_unknown="ignore", sparse_output=False)
-    encoder_job = OneHotEncoder(categories=encoders["job"], handle_unknown="ignore", sparse_output=False)
-    encoder_sex = OneHotEncoder(categories=encoders["sex"], handle_unknown="ignore", sparse_output=False)
-    encoder_metro_area = OneHotEncoder(categories=encoders["metro_area"], handle_unknown="ignore", sparse_output=False)
-    encoder_month = OneHotEncoder(categories=encoders["month"], handle_unknown="ignore", sparse_output=False)
-    encoder_state = OneHotEncoder(categories=encoders["state"], handle_unknown="ignore", sparse_output=False)
-    encoder_municipality = OneHotEncoder(categories=encoders["municipality"], handle_unknown="ignore", sparse_output=False)
-    encoder_hour = OneHotEncoder(categories=encoders["hour"], handle_unknown="ignore", sparse_output=False)
-    encoder_category = OneHotEncoder(categories=encoders["place"], handle_unknown="ignore", sparse_output=False)
-    encoder_place = OneHotEncoder(categories=encoders["category"], handle_unknown="ignore", sparse_output=False)
-    encoder_social_class = OneHotEncoder(categories=encoders["social_class"], handle_unknown="ignore", sparse_output=False)
-
-    ct = ColumnTransformer(
-        [('pass0', 'passthrough', [0]),
-         ('pass1', 'passthrough', [1]),
-         ('encoder_housing_class', encoder_housing_class, [2]),
-         ('encoder_kinship', encoder_kinship, [3]),
-         ('encoder_education', encoder_education, [4]),
-         ('encoder_activity', encoder_activity, [5]),
-         ('encoder_job', encoder_job, [6]),
-         ('encoder_sex', encoder_sex, [7]),
-         ('encoder_metro_area', encoder_metro_area, [8]),
-         ('encoder_month', encoder_month, [9]),
-         ('encoder_state', encoder_state, [10]),
-         ('encoder_municipality', encoder_municipality, [11]),
-         ('encoder_hour', encoder_hour, [12]),
-         ('encoder_category', encoder_place, [13]),
-         ('encoder_place', encoder_category, [14]),
-         ('encoder_social_class', encoder_social_class, [15])
-         ],
-        remainder='passthrough'
-    )
-
-    input_array = ct.fit_transform(new_row).astype(np.float64)
+    # Encoded profile
+    profile = get_registry().profile({"housing_class": housing_class,
+                                      "kinship": kinship,
+                                      "education": education,
+                                      "activity": activity,
+                                      "job": job,
+                                      "sex": sex,
+                                      "metro_area": metro_area,
+                                      "month": month,
+                                      "state": state,
+                                      "municipality": municipality,
+                                      "hour": hour,
+                                      "place": place,
+                                      "category": category,
+                                      "social_class": social_class,
+                                      "people_household": people_household,
+                                      "age": age
+                                      })
+
+    input_array = (layout if layout is not None else get_layout()).encode(profile)
 
     return input_array
 
+# Backend used for making predictions: "keras" (TensorFlow), "numpy" (TensorFlow-free engine), or "float16"/"int8"
+# (TensorFlow-free engine on the quantized weights exported with inference.py --quantize)
+model_backend = os.environ.get("CRIME_PREDICTOR_BACKEND", "keras")
+
 # Function to load the model into the app from the serialized files
+@metrics.track_cache("get_model")
 @st.cache_resource
-def get_model():
+@metrics.track_load("get_model")
+def get_model(backend=model_backend):
     """
     Function to load the trained model from serialized files.
 
+    :parameter:
+    backend (String): "keras" to load the TensorFlow model, "numpy" to load the TensorFlow-free engine, or "float16"
+    or "int8" to load the TensorFlow-free engine on quantized weights.
+
     :return:
-    model (Keras object): Trained model ready for making predictions
+    model (Keras object, NumpyModel or QuantizedModel): Trained model ready for making predictions
     """
 
+    if backend in ("float16", "int8"):
+        from inference import QuantizedModel
+        return QuantizedModel.from_file(f'CrimePredictorWeights.{backend}.npz')
+
+    if backend == "numpy":
+        from inference import NumpyModel
+        return NumpyModel.from_files('CrimePredictorConfig.json', 'CrimePredictorWeights.h5')
+
+    from tensorflow.keras.models import model_from_json
+
     with open('CrimePredictorConfig.json') as json_file:
         json_config = json_file.read()
     model = model_from_json(json_config)
@@ -520,7 +369,118 @@ def get_model():
 
     return model
 
+# Versioned model bundle served instead of the loose files, reloaded when a new version is deployed (see bundle.py)
+model_bundle = os.environ.get("CRIME_PREDICTOR_BUNDLE")
+
+# Function to start watching the model bundle, if any
+@st.cache_resource
+def get_bundle_watcher():
+    """
+    Function to load the model bundle set in CRIME_PREDICTOR_BUNDLE and watch it for new versions, once per process.
+    :return:
+    watcher (BundleWatcher): Watcher of the bundle, or None if the loose files are served.
+    """
+
+    if not model_bundle:
+        return None
+
+    from bundle import BundleWatcher
+
+    watcher = BundleWatcher(model_bundle, backend=model_backend,
+                            interval=float(os.environ.get("CRIME_PREDICTOR_BUNDLE_INTERVAL", 2.0)))
+
+    return watcher
+
+# Function to retrieve the model to use for a prediction
+def get_serving():
+    """
+    Function to return the model, feature layout and version to use together for a prediction. With a bundle, the
+    current version is returned, and a request keeps it until it finishes even if a new one is swapped in meanwhile.
+    :return:
+    model (Keras object or NumpyModel): Trained model ready for making predictions.
+    layout (FeatureLayout): Compiled feature layout of the model.
+    version (String): Version of the bundle, or None if the loose files are served.
+    """
+
+    watcher = get_bundle_watcher()
+    if watcher is None:
+        return get_model(), get_layout(), None
+
+    bundle = watcher.current()
+
+    return bundle.model, bundle.layout, bundle.version
+
+# Function to load the prediction cache shared by all the sessions
+@st.cache_resource
+def get_prediction_cache():
+    """
+    Function to create the prediction cache. The disk tier is enabled by setting CRIME_PREDICTOR_CACHE to the path of
+    a SQLite database, which is then shared by every app process on the node and survives restarts.
+
+    :return:
+    cache (PredictionCache): Cache of predictions keyed by the encoded profile.
+    """
+
+    ttl = os.environ.get("CRIME_PREDICTOR_CACHE_TTL")
+    kwargs = {"paths": [model_bundle]} if model_bundle else {}
+
+    cache = PredictionCache(max_entries=int(os.environ.get("CRIME_PREDICTOR_CACHE_SIZE", 10000)),
+                            ttl=float(ttl) if ttl else None,
+                            path=os.environ.get("CRIME_PREDICTOR_CACHE"),
+                            **kwargs)
+
+    return cache
+
+# Function to start the local endpoint of the app's metrics, if enabled (see metrics.py)
+@st.cache_resource
+def get_metrics_server():
+    """
+    Function to serve the metrics of the app process on the port set in CRIME_PREDICTOR_METRICS_PORT, once per process.
+    :return:
+    server (ThreadingHTTPServer): Running server, or None if the instrumentation or the endpoint is disabled.
+    """
+
+    port = os.environ.get("CRIME_PREDICTOR_METRICS_PORT")
+    if not metrics.enabled or not port:
+        return None
+
+    server = metrics.serve(int(port))
+
+    return server
+
+# Function to open the precomputed municipality risk atlas (see atlas.py)
+@st.cache_resource(max_entries=2)
+def get_atlas_version(key):
+    """
+    Function to open the memory-mapped municipality risk atlas, once per served bundle and build of the atlas.
+    :param:
+    key (Tuple): Content hash of the served bundle (None for the loose files) and modification time of the atlas, which
+    keys the cache.
+    :return:
+    atlas (MunicipalityAtlas): Municipality risk atlas, or None if it has not been built or is out of date.
+    """
+    from atlas import load_atlas
+
+    atlas = load_atlas(get_registry(), bundle_hash=key[0])
+
+    return atlas
+
+# Function to load the precomputed municipality risk atlas of the served model
+def get_atlas():
+    """
+    Function to return the municipality risk atlas built from the served model: the bundle's current version when a
+    bundle is served, or the loose files otherwise.
+    :return:
+    atlas (MunicipalityAtlas): Municipality risk atlas, or None if it has not been built or is out of date.
+    """
+    from atlas import get_atlas_key
+
+    watcher = get_bundle_watcher()
+
+    return get_atlas_version(get_atlas_key(bundle_hash=watcher.current().hash if watcher is not None else None))
+
 # Function to convert the output array from the model into a pandas dataframe
+@metrics.timed("get_df")
 def get_df(array):
     """
     Function to cast the output array from the multi-layer perceptron model into a Pandas dataframe.
@@ -531,28 +491,7 @@ def get_df(array):
     :return:
     df (Pandas dataframe): Dataframe with the probabilities and complement of suffering a crime in Mexico.
     """
-    # Labels names
-    labels = ["Total Vehicle Theft",
-            "Partial Vehicle Theft",
-            "Vandalism",
-            "Burglary",
-            "Kidnapping",
-            "Enforced Disappearance",
-            "Murder",
-            "Theft",
-            "Other Theft",
-            "Bank Fraud",
-            "Consumer Fraud",
-            "Extortion",
-            "Threats",
-            "Injuries",
-            "Kidnapping",
-            "Assault",
-            "Rape",
-            "Other",
-            "Overall"]
-
-    df = pd.DataFrame(np.array(array).reshape(1, 19), columns=labels)
+    df = pd.DataFrame(np.array(array).reshape(1, 19), columns=crime_labels)
 
     df = pd.melt(df, var_name="Crime", value_name="Suffer a Crime")
 
@@ -563,6 +502,7 @@ def get_df(array):
     return df
 
 # Function to plot a donut chart
+@metrics.timed("plot_pie_chart")
 def plot_pie_chart(df):
     """
     Function to plot the overall probability of suffering any crime in Mexico.
@@ -573,6 +513,8 @@ def plot_pie_chart(df):
     :return:
     pie_chart (Plotly object): Plotly pie chart.
     """
+    import plotly.express as px
+
     font_size = 16
     title_font_size = 20
 
@@ -609,16 +551,20 @@ def plot_pie_chart(df):
     return pie_chart
 
 # Function to plot a bar chart
-def plot_bar_chart(df):
+@metrics.timed("plot_bar_chart")
+def plot_bar_chart(df, bands=None):
     """
     Function to plot the probabilities of suffering different crimes in Mexico.
 
     :parameter:
     df (Pandas dataframe): Dataframe with the probabilities and the complement of suffering crimes in Mexico.
+    bands (Tuple): Lower and upper bounds of the 19 probabilities, drawn as error bars (none if None).
 
     :return:
     bar_chart (Plotly object): Plotly bar chart.
     """
+    import plotly.express as px
+
     font_size = 15
     title_font_size = 20
 
@@ -627,6 +573,13 @@ def plot_bar_chart(df):
 
     df['Value'] = df['Value'] * 100
 
+    # Error bars from the uncertainty bands, in the order of the crime labels as the first rows of the dataframe
+    if bands is not None:
+        lower, upper = (np.asarray(band).reshape(-1) * 100 for band in bands)
+        suffer = df["Event"] == "Suffer a Crime"
+        df.loc[suffer, "Error Plus"] = np.clip(upper - df.loc[suffer, "Value"].to_numpy(), 0, None)
+        df.loc[suffer, "Error Minus"] = np.clip(df.loc[suffer, "Value"].to_numpy() - lower, 0, None)
+
     bar_chart = px.bar(df[(df['Crime'] != "Overall") & (df["Event"] == "Suffer a Crime")].sort_values(by = "Value", ascending=True),
                         x='Value', y='Crime',
                         height=450,
@@ -634,6 +587,8 @@ def plot_bar_chart(df):
                         color='Value', color_continuous_scale=bar_colors,
                         #title='Probability of Suffering Different Crimes',
                         opacity=0.9,
+                        error_x="Error Plus" if bands is not None else None,
+                        error_x_minus="Error Minus" if bands is not None else None,
                         )
     bar_chart.update_traces(marker_color=bar_colors, marker_line_color='#06477D', textfont_size=16, textangle=0,
                                     textposition="outside", cliponaxis=False, hovertemplate=None)
@@ -660,10 +615,228 @@ def plot_bar_chart(df):
 
     return bar_chart
 
+# Function to explain the prediction (see explain.py)
+@metrics.timed("explain")
+def get_effects(input_array, model, layout):
+    """
+    Function to compute the marginal effect of each field of the profile on the probabilities, by scoring every
+    alternative value of each field in a single batch.
+
+    :parameter:
+    input_array (Numpy array): Input array for the multi-label classification model.
+    model (Keras object or NumpyModel): Trained model.
+    layout (FeatureLayout): Compiled feature layout of the model.
+
+    :return:
+    effects (Pandas dataframe): Marginal effect of each field (rows) on each crime probability (columns).
+    """
+    from explain import explain
+
+    effects, _ = explain(model, layout, input_array, registry=get_registry())
+
+    return effects
+
+# Function to plot the marginal effects of the fields of the profile
+def plot_effects_chart(effects, crime="Overall"):
+    """
+    Function to plot the marginal effect of each field of the profile on the probability of a crime.
+
+    :parameter:
+    effects (Pandas dataframe): Marginal effect of each field (rows) on each crime probability (columns).
+    crime (String): Crime label.
+
+    :return:
+    effects_chart (Plotly object): Plotly bar chart.
+    """
+    import plotly.express as px
+    from explain import field_labels
+
+    font_size = 15
+
+    df = pd.DataFrame({"Field": [field_labels[field] for field in effects.index],
+                       "Value": effects.iloc[:, crime_labels.index(crime)].to_numpy() * 100})
+    df = df.reindex(df["Value"].abs().sort_values(ascending=True).index)
+
+    effects_chart = px.bar(df, x='Value', y='Field',
+                           height=450,
+                           opacity=0.9,
+                           )
+    effects_chart.update_traces(marker_color=np.where(df['Value'] > 0, '#5fbbff', 'silver'),
+                                marker_line_color='#06477D', hovertemplate=None)
+    effects_chart.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0},
+                                paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
+                                xaxis_ticksuffix="%", autosize=True,
+                                dragmode=False,
+                                yaxis=dict(tickfont=dict(size=font_size)),
+                                xaxis=dict(tickfont=dict(size=font_size),
+                                           showgrid=True),
+                                font=dict(size=font_size),
+                                yaxis_title=None,
+                                )
+    effects_chart.update_xaxes(title="Change in Probability", title_font_size=font_size+1)
+
+    return effects_chart
+
+# Function to load the cache of the sensitivity curves shared by all the sessions
+@st.cache_resource
+def get_sensitivity_cache():
+    """
+    Function to create the in-memory cache of the sensitivity curves, keyed by the encoded profile.
+    :return:
+    cache (PredictionCache): Cache of the sensitivity curves.
+    """
+
+    cache = PredictionCache(max_entries=int(os.environ.get("CRIME_PREDICTOR_CACHE_SIZE", 10000)))
+
+    return cache
+
+# Number of Monte Carlo dropout passes and latency budget in seconds of the uncertainty bands
+uncertainty_passes = int(os.environ.get("CRIME_PREDICTOR_MC_PASSES", 200))
+uncertainty_budget = float(os.environ.get("CRIME_PREDICTOR_MC_BUDGET", 0.25))
+
+# Function to read the dropout rates of the served model (see uncertainty.py)
+def get_dropout_rates():
+    """
+    Function to read the dropout rate after each Dense layer from the architecture of the served model, i.e., the
+    bundle's or the one of CrimePredictorConfig.json.
+    :return:
+    rates (List): Dropout rate after each Dense layer.
+    """
+    from uncertainty import read_dropout_rates
+
+    watcher = get_bundle_watcher()
+    if watcher is not None:
+        return read_dropout_rates(watcher.current().header["architecture"])
+
+    with open('CrimePredictorConfig.json') as json_file:
+        return read_dropout_rates(json_file.read())
+
+# Function to compute the uncertainty bands of the probabilities (see uncertainty.py)
+@metrics.timed("uncertainty")
+def get_bands(input_array, model, rates, level=0.9):
+    """
+    Function to compute a credible interval of every probability with Monte Carlo dropout, running all the passes as
+    a single batch, with as many passes as fit in the latency budget.
+
+    :parameter:
+    input_array (Numpy array): Input array for the multi-label classification model.
+    model (Keras object or NumpyModel): Trained model.
+    rates (List): Dropout rate after each Dense layer of the model.
+    level (Float): Probability mass of the intervals.
+
+    :return:
+    lower (Numpy array): Lower bounds of the 19 probabilities.
+    upper (Numpy array): Upper bounds of the 19 probabilities.
+    n_passes (Integer): Number of passes run.
+    """
+    from uncertainty import mc_predict
+
+    _, lower, upper, n_passes = mc_predict(model, input_array, uncertainty_passes, level, uncertainty_budget, rates)
 
-# Creating of the Municipality Dictionary
-mun_cat = get_municipalities()
-municipality_dict = mun_cat.drop(columns=['State']).to_dict(orient='dict')['Municipality']
+    return lower, upper, n_passes
+
+# Function to compute the sensitivity curves of the profile (see explain.py)
+@metrics.timed("sensitivity")
+def get_curves(input_array, model, layout, version=None):
+    """
+    Function to compute the probabilities as age, the number of persons in the household and the hour of the day sweep
+    their whole ranges, with the other fields held at the user's values. All the sweeps are scored in a single batch.
+
+    :parameter:
+    input_array (Numpy array): Input array for the multi-label classification model.
+    model (Keras object or NumpyModel): Trained model.
+    layout (FeatureLayout): Compiled feature layout of the model.
+    version (String): Version of the bundle, if any.
+
+    :return:
+    curves (Pandas dataframe): Field, value and the 19 probabilities of each point of the curves.
+    """
+    from explain import sensitivity
+
+    curves = sensitivity(model, layout, input_array, cache=get_sensitivity_cache(), version=version)
+
+    return curves
+
+# Function to plot a sensitivity curve
+def plot_sensitivity_chart(curves, field):
+    """
+    Function to plot how the probability of suffering each crime changes with the values of a field.
+
+    :parameter:
+    curves (Pandas dataframe): Field, value and the 19 probabilities of each point of the curves.
+    field (String): Swept field.
+
+    :return:
+    sensitivity_chart (Plotly object): Plotly line chart.
+    """
+    import plotly.express as px
+
+    font_size = 15
+
+    curve = curves[curves["field"] == field]
+    df = pd.DataFrame({"Value": np.tile(curve["value"].to_numpy(dtype=object), len(crime_labels)),
+                       "Crime": np.repeat(crime_labels, len(curve)),
+                       "Probability": curve.iloc[:, 3:].to_numpy().T.reshape(-1) * 100})
+
+    sensitivity_chart = px.line(df, x='Value', y='Probability', color='Crime',
+                                height=450,
+                                markers=field == "hour",
+                                )
+    sensitivity_chart.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0},
+                                    paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
+                                    yaxis_ticksuffix="%", autosize=True,
+                                    dragmode=False,
+                                    yaxis=dict(tickfont=dict(size=font_size),
+                                               showgrid=True),
+                                    xaxis=dict(tickfont=dict(size=font_size)),
+                                    font=dict(size=font_size),
+                                    xaxis_title=None,
+                                    )
+    sensitivity_chart.update_yaxes(title="Probability", title_font_size=font_size+1)
+
+    return sensitivity_chart
+
+# Function to plot the ranking of municipalities
+def plot_ranking_chart(ranking):
+    """
+    Function to plot the probability of suffering a crime in the top municipalities of the atlas.
+
+    :parameter:
+    ranking (Pandas dataframe): Municipalities ranked by decreasing probability, from MunicipalityAtlas.rank.
+
+    :return:
+    ranking_chart (Plotly object): Plotly bar chart.
+    """
+    import plotly.express as px
+
+    font_size = 15
+
+    df = ranking.assign(Value=ranking["probability"] * 100,
+                        Municipality=ranking["municipality"] + ", " + ranking["state"])
+
+    ranking_chart = px.bar(df.sort_values(by="Value", ascending=True),
+                           x='Value', y='Municipality',
+                           height=max(300, 30 * len(df)),
+                           opacity=0.9,
+                           )
+    ranking_chart.update_traces(marker_color='#5fbbff', marker_line_color='#06477D', hovertemplate=None)
+    ranking_chart.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0},
+                                paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
+                                xaxis_ticksuffix="%", autosize=True,
+                                dragmode=False,
+                                yaxis=dict(tickfont=dict(size=font_size)),
+                                xaxis=dict(tickfont=dict(size=font_size),
+                                           showgrid=True),
+                                font=dict(size=font_size),
+                                yaxis_title=None,
+                                )
+    ranking_chart.update_xaxes(title="Probability", title_font_size=font_size+1)
+
+    return ranking_chart
+
+
+# Local endpoint of the app's metrics
+get_metrics_server()
 
 
 # Disabling fullscreen view for images in app
@@ -752,6 +925,11 @@ if page == "Homepage":
             st.session_state["app_page"] = "Predict"
             st.experimental_rerun()
 
+    with bcol3:
+        if st.button('Go to Atlas Page'):
+            st.session_state["app_page"] = "Atlas"
+            st.experimental_rerun()
+
     st.markdown("")
 
     # References
@@ -783,6 +961,11 @@ elif page == "Predict":
             st.session_state["app_page"] = "Homepage"
             st.experimental_rerun()
 
+    with bcol3:
+        if st.button('Go to Atlas Page'):
+            st.session_state["app_page"] = "Atlas"
+            st.experimental_rerun()
+
     # Input data section
     st.markdown("")
     st.subheader(":blue[Socioeconomic & Demographic Profile]")
@@ -809,13 +992,14 @@ elif page == "Predict":
         kinship = st.selectbox("**Kinship Regarding the Head of the Household:**", list(kinship_dict.values()))
         state = st.selectbox("**Mexican State of Residence:**", list(state_dict.values()))
         metro_area = st.selectbox("**Metropolitan Area of Residence:**", sorted(select_metro_area(state)), help="If you don't live in any of the options, please select 'Not applicable'")
-        municipality = st.selectbox("**Municipality of Residence:**", sorted(list(select_mun(state).values())))
+        municipality = st.selectbox("**Municipality of Residence:**", select_mun(state))
         #month = st.selectbox("Month:", list(month_dict.values()))
         hour = st.selectbox("**Hour of the Day:**", list(hour_dict.values()))
         #place = st.selectbox("Place:", list(place_dict.values()))
-        month = 99
-        place = 9
+        month = default_labels["month"]
+        place = default_labels["place"]
 
+    show_uncertainty = st.checkbox("**Show Uncertainty Bands**", help="Ranges of the probabilities, estimated by running the model many times with some of its neurons randomly switched off.")
 
     st.markdown("")
     st.markdown("")
@@ -828,16 +1012,27 @@ elif page == "Predict":
 
     with bcol2:
         if st.button('Predict Probability :nerd_face:'):
+            # Model, layout and version used for the whole request
+            model, layout, version = get_serving()
+
             # Get input array from user's input
             input_array = get_input_array(sex, age, education, activity, job,
                                         social_class, category, housing_class,
                                         people_household, kinship, state, metro_area,
-                                        municipality, month, hour, place)
-            # Model
-            model = get_model()
+                                        municipality, month, hour, place, layout)
+            # Cached prediction for the same backend and encoded profile, if any
+            cache = get_prediction_cache()
+            key = ((model_backend,) if version is None else (version, model_backend)) + profile_key(input_array)
+            with metrics.timer(stage="prediction_cache"):
+                Y = cache.get(key)
+            metrics.increment("prediction_cache", result="miss" if Y is None else "hit")
+
+            if Y is None:
+                # Prediction
+                with metrics.timer(stage="predict"):
+                    Y = model.predict(input_array)
+                cache.put(key, Y)
 
-            # Prediction
-            Y = model.predict(input_array)
             st.success("Success! Please scroll down...")
             st.session_state["flag_charts"] = 2
 
@@ -850,12 +1045,19 @@ elif page == "Predict":
         # Charts sections
         st.subheader(":blue[Prediction Results]")
         st.markdown("According to the provided socioeconomic and demographic data, the probability of suffering different crimes in Mexico is as follows: :bar_chart:")
+        if version is not None:
+            st.caption(f"Model version: {version}")
         st.markdown("")
         st.markdown("")
 
         df = get_df(Y)
         pie_chart = plot_pie_chart(df)
-        bar_chart = plot_bar_chart(df)
+        bands = get_bands(input_array, model, get_dropout_rates()) if show_uncertainty else None
+        bar_chart = plot_bar_chart(df, bands[:2] if bands is not None else None)
+
+        # Metrics dump after every prediction, if enabled
+        if metrics.enabled and os.environ.get("CRIME_PREDICTOR_METRICS_FILE"):
+            metrics.collector.dump(os.environ["CRIME_PREDICTOR_METRICS_FILE"])
 
         # Pie chart
         bcol1, bcol2, bcol3 = st.columns([0.1, 0.8, 0.1])
@@ -873,6 +1075,27 @@ elif page == "Predict":
                 '<p style="font-size: 22px" align="center"><b>Probability of Suffering Different Crimes in Mexico</b></p>',
                 unsafe_allow_html=True)
             st.plotly_chart(bar_chart, config=config, use_container_width=True)
+        if bands is not None:
+            st.caption(f"Error bars: 90% range of the probabilities over {bands[2]} runs of the model with dropout.")
+
+        # Effects chart
+        bcol1, bcol2, bcol3 = st.columns([0.1, 0.8, 0.1])
+        with bcol2:
+            st.markdown(
+                '<p style="font-size: 22px" align="center"><b>What Drives the Probability of Suffering Any Crime</b></p>',
+                unsafe_allow_html=True)
+            st.plotly_chart(plot_effects_chart(get_effects(input_array, model, layout)), config=config, use_container_width=True)
+        st.markdown("Each bar compares your answer against the average of the other options of the same field. Positive values mean that your answer raises the probability.")
+        st.markdown("")
+
+        # Sensitivity charts
+        curves = get_curves(input_array, model, layout, version)
+        st.markdown('<p style="font-size: 22px" align="center"><b>Sensitivity of the Probabilities</b></p>', unsafe_allow_html=True)
+        st.markdown("How the probabilities would change with a different age, household size or hour of the day, keeping the rest of your answers:")
+        for tab, field in zip(st.tabs(["Age", "Persons in the Household", "Hour of the Day"]), ["age", "people_household", "hour"]):
+            with tab:
+                st.plotly_chart(plot_sensitivity_chart(curves, field), config=config, use_container_width=True)
+        st.markdown("")
 
         # Crimes description
         st.markdown("#### **Crimes Description**")
@@ -895,3 +1118,54 @@ elif page == "Predict":
         st.markdown(":blue[**- Vandalism**:] Deliberate destruction of or damage to the household.")
         st.markdown(":blue[**- Vehicle Theft**:] Criminal act of stealing a complete motor vehicle.")
         st.session_state["flag_charts"] = 1
+
+# Atlas Page
+elif page == "Atlas":
+
+    # Brief description of the page
+    st.write('Compares the probability of suffering crimes across the municipalities of Mexico for a few reference profiles. The probabilities were precomputed for every municipality and hour of the day, so no prediction is made here. For your own profile, please go to the <h style="color:orange;"><i><b>Predict</b></i></h> page.', unsafe_allow_html=True)
+
+    bcol1, bcol2, bcol3 = st.columns([1, 1, 1])
+
+    with bcol1:
+        if st.button('Go to Homepage'):
+            st.session_state["app_page"] = "Homepage"
+            st.experimental_rerun()
+
+    with bcol3:
+        if st.button('Go to Predict Page'):
+            st.session_state["app_page"] = "Predict"
+            st.experimental_rerun()
+
+    atlas = get_atlas()
+
+    if atlas is None:
+        st.warning("The municipality atlas has not been built for the served model yet. Please run 'python atlas.py build' (with '--bundle' when a model bundle is served).")
+
+    else:
+        st.markdown("")
+        st.subheader(":blue[Municipality Risk Atlas]")
+
+        col1, col2 = st.columns(2, gap="medium")
+
+        with col1:
+            atlas_state = st.selectbox("**Mexican State:**", ["All"] + [label for code, label in state_dict.items() if code != 99])
+            atlas_profile = st.selectbox("**Reference Profile:**", atlas.profiles)
+            top = st.selectbox("**Number of Municipalities:**", [10, 20, 50])
+
+        with col2:
+            atlas_crime = st.selectbox("**Crime:**", list(dict.fromkeys(atlas.crimes)), index=len(dict.fromkeys(atlas.crimes)) - 1)
+            atlas_hour = st.selectbox("**Hour of the Day:**", atlas.hours, index=len(atlas.hours) - 1)
+
+        state_code = None if atlas_state == "All" else get_registry().encode("state", atlas_state)
+        ranking = atlas.rank(atlas_profile, atlas_hour, atlas_crime, state_code, top)
+
+        st.markdown("")
+        crime_title = "Suffering Any Crime" if atlas_crime == "Overall" else atlas_crime
+        st.markdown(f'<p style="font-size: 22px" align="center"><b>Municipalities with the Highest Probability of {crime_title}</b></p>', unsafe_allow_html=True)
+        st.plotly_chart(plot_ranking_chart(ranking), config=config, use_container_width=True)
+
+        st.dataframe(ranking.assign(probability=(ranking["probability"] * 100).round(1))
+                            .rename(columns={"id": "ID", "state": "State", "municipality": "Municipality",
+                                             "probability": "Probability (%)"}),
+                     hide_index=True, use_container_width=True)
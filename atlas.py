@@ -0,0 +1,378 @@
+# Municipality Risk Atlas of the Crime Predictor
+
+"""
+Module Brief Description:
+Precomputed atlas of the crime probabilities of every municipality, for comparing places instead of scoring a single
+profile. An offline job batch-scores every municipality of the INEGI catalogue crossed with every hour of the day, for a
+set of reference socioeconomic and demographic profiles, and stores the 19 probabilities as a compact float16 array
+(municipality x profile x hour x crime) that is memory-mapped when read. The app's Atlas page and the service's /atlas
+endpoint then read slices of it, e.g., the ranking of the municipalities of a state, with no inference at request time.
+
+The atlas records a fingerprint of the model and catalogue files, or the content hash of the model bundle it was built
+from, and is ignored whenever they change, e.g., when another bundle is served or swapped in.
+
+Usage:
+python atlas.py build                                   # Builds MunicipalityAtlas/ with the default model
+python atlas.py build --bundle CrimePredictor.bundle    # Builds MunicipalityAtlas/ with the model of a bundle
+python atlas.py rank --state "Jalisco" --crime Overall  # Ranks the municipalities of a state
+"""
+
+# Libraries importation
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from catalogues import crime_labels, default_labels, hour_dict, state_dict
+from encoding import categorical_fields, numerical_fields
+
+# Default directory of the atlas
+atlas_dir = "MunicipalityAtlas"
+
+# Files whose changes make the atlas out of date
+atlas_sources = {"catalogue": "MunicipalitiesCatalogue.csv",
+                 "encoders": "Encoders.json",
+                 "scalers": "Scalers.json",
+                 "config": "CrimePredictorConfig.json",
+                 "weights": "CrimePredictorWeights.h5"}
+
+# Reference profiles, with the labels of the app's select boxes (the location and hour are set by the atlas)
+reference_profiles = {"Working man": {"sex": "Male",
+                                      "age": 35,
+                                      "education": "High School",
+                                      "activity": "Worker",
+                                      "job": "Employee or worker",
+                                      "social_class": "Lower middle income",
+                                      "category": "Urban",
+                                      "housing_class": "Stand-alone house",
+                                      "people_household": 4,
+                                      "kinship": "Household head",
+                                      "metro_area": "Not applicable",
+                                      **default_labels},
+                      "Working woman": {"sex": "Female",
+                                        "age": 35,
+                                        "education": "High School",
+                                        "activity": "Worker",
+                                        "job": "Employee or worker",
+                                        "social_class": "Lower middle income",
+                                        "category": "Urban",
+                                        "housing_class": "Stand-alone house",
+                                        "people_household": 4,
+                                        "kinship": "Spouse",
+                                        "metro_area": "Not applicable",
+                                        **default_labels},
+                      "Student": {"sex": "Female",
+                                  "age": 20,
+                                  "education": "High School",
+                                  "activity": "Student",
+                                  "job": "Not specified",
+                                  "social_class": "Lower middle income",
+                                  "category": "Urban",
+                                  "housing_class": "Apartment in building",
+                                  "people_household": 4,
+                                  "kinship": "Child",
+                                  "metro_area": "Not applicable",
+                                  **default_labels},
+                      "Retired person": {"sex": "Male",
+                                         "age": 70,
+                                         "education": "Elementary",
+                                         "activity": "Retired or pensioner",
+                                         "job": "Not specified",
+                                         "social_class": "Low income",
+                                         "category": "Urban",
+                                         "housing_class": "Stand-alone house",
+                                         "people_household": 2,
+                                         "kinship": "Household head",
+                                         "metro_area": "Not applicable",
+                                         **default_labels}}
+
+
+# Function to build the encoded profiles of the atlas
+def get_atlas_profiles(registry, profiles=reference_profiles, hours=hour_dict):
+    """
+    Function to build the encoded profiles of every municipality crossed with every reference profile and hour, in
+    the (municipality, profile, hour) order of the atlas.
+
+    :parameter:
+    registry (CatalogueRegistry): Catalogue registry of the predictors' vocabularies.
+    profiles (Python dict): Reference profiles with the labels of the app's select boxes, keyed by name.
+    hours (Python dict): Hour labels keyed by hour code.
+
+    :returns:
+    encoded (Python dict): Encoded values of every predictor, keyed by predictor name.
+    """
+
+    municipalities = registry.municipalities.sort_index()
+    n_municipalities, n_profiles, n_hours = len(municipalities), len(profiles), len(hours)
+    shape = (n_municipalities, n_profiles, n_hours)
+
+    encoded = {}
+    for field in categorical_fields:
+        if field == "state":
+            values = municipalities["state"].to_numpy()[:, None, None]
+        elif field == "municipality":
+            values = municipalities["key"].to_numpy()[:, None, None]
+        elif field == "hour":
+            values = np.array(list(hours))[None, None, :]
+        else:
+            values = np.array([registry.encode(field, profile[field]) for profile in profiles.values()],
+                              dtype=object)[None, :, None]
+        encoded[field] = np.broadcast_to(values, shape).reshape(-1)
+
+    for field in numerical_fields:
+        values = np.array([profile[field] for profile in profiles.values()], dtype=np.float64)[None, :, None]
+        encoded[field] = np.broadcast_to(values, shape).reshape(-1)
+
+    return encoded
+
+
+# Function to build the atlas
+def build_atlas(model, registry, directory=atlas_dir, profiles=reference_profiles, hours=hour_dict,
+                paths=atlas_sources, batch_size=8192, bundle_hash=None):
+    """
+    Function to batch-score every municipality crossed with every reference profile and hour, and store the
+    probabilities. The atlas is written into a temporary directory that is renamed once complete.
+
+    :parameter:
+    model (NumpyModel or Keras object): Trained model.
+    registry (CatalogueRegistry): Catalogue registry of the predictors' vocabularies.
+    directory (String): Directory of the atlas.
+    profiles (Python dict): Reference profiles with the labels of the app's select boxes, keyed by name.
+    hours (Python dict): Hour labels keyed by hour code.
+    paths (Python dict): Paths to the files whose changes make the atlas out of date.
+    batch_size (Integer): Number of rows per forward pass.
+    bundle_hash (String): Content hash of the model bundle of the model and registry (None for the loose files).
+
+    :returns:
+    meta (Python dict): Metadata of the atlas.
+    """
+
+    from batch_scoring import predict
+    from startup import get_fingerprint
+
+    start = time.perf_counter()
+    X = registry.layout.encode_batch(get_atlas_profiles(registry, profiles, hours), sparse=True, dtype=np.float32)
+    Y = np.vstack([predict(model, X[start:start + batch_size], batch_size)
+                   for start in range(0, X.shape[0], batch_size)])
+
+    municipalities = registry.municipalities.sort_index()
+    probabilities = np.asarray(Y, dtype=np.float16).reshape(len(municipalities), len(profiles), len(hours),
+                                                            len(crime_labels))
+
+    tmp_path = directory + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "probabilities.npy"), probabilities)
+    np.save(os.path.join(tmp_path, "ids.npy"), municipalities.index.to_numpy(dtype=np.int64))
+
+    meta = {"fingerprint": None if bundle_hash is not None else get_fingerprint(paths),
+            "bundle": bundle_hash,
+            "profiles": list(profiles),
+            "hours": list(hours.values()),
+            "crimes": crime_labels,
+            "shape": list(probabilities.shape),
+            "seconds": time.perf_counter() - start}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+        json.dump(meta, file, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_path, directory)
+
+    return meta
+
+
+# Class to read slices of the atlas
+class MunicipalityAtlas:
+    """
+    Class reading the memory-mapped probabilities of the atlas.
+
+    :attributes:
+    probabilities (Numpy array): Memory-mapped float16 array of shape (municipalities, profiles, hours, crimes).
+    ids (Numpy array): Sorted municipality IDs of the first axis.
+    profiles (List): Names of the reference profiles.
+    hours (List): Hour labels.
+    crimes (List): Crime labels.
+    """
+
+    def __init__(self, directory, registry):
+        """
+        :parameter:
+        directory (String): Directory of the atlas.
+        registry (CatalogueRegistry): Catalogue registry, used for the municipality labels.
+        """
+
+        with open(os.path.join(directory, "meta.json")) as file:
+            self.meta = json.load(file)
+
+        self.probabilities = np.load(os.path.join(directory, "probabilities.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(directory, "ids.npy"))
+        self.profiles = self.meta["profiles"]
+        self.hours = self.meta["hours"]
+        self.crimes = self.meta["crimes"]
+
+        municipalities = registry.municipalities.loc[self.ids]
+        self._states = municipalities["state"].to_numpy()
+        self._labels = municipalities["municipality"].to_numpy(dtype=object)
+
+        # Municipalities of each state, as positions of the first axis
+        self._state_rows = {int(code): np.flatnonzero(self._states == code) for code in np.unique(self._states)}
+
+    def _position(self, values, value, name):
+        """
+        Function to return the position of a profile, hour or crime label.
+        """
+
+        try:
+            return values.index(value)
+        except ValueError:
+            raise KeyError(f"Unknown {name}: {value}") from None
+
+    def probability(self, municipality_id, profile, hour):
+        """
+        Function to return the 19 probabilities of a municipality for a reference profile and hour.
+
+        :parameter:
+        municipality_id (Integer): Municipality ID (state * 1000 + municipality).
+        profile (String): Name of the reference profile.
+        hour (String): Hour label.
+
+        :returns:
+        probabilities (Numpy array): Probability of each crime.
+        """
+
+        row = np.searchsorted(self.ids, municipality_id)
+        if row >= len(self.ids) or self.ids[row] != municipality_id:
+            raise KeyError(f"Unknown municipality: {municipality_id}")
+
+        return np.asarray(self.probabilities[row, self._position(self.profiles, profile, "profile"),
+                                             self._position(self.hours, hour, "hour")], dtype=np.float32)
+
+    def rank(self, profile, hour, crime="Overall", state=None, top=None):
+        """
+        Function to rank the municipalities of a state (or of the whole country) by the probability of a crime.
+
+        :parameter:
+        profile (String): Name of the reference profile.
+        hour (String): Hour label.
+        crime (String): Crime label.
+        state (Integer): State code (the whole country if None).
+        top (Integer): Number of municipalities to return (all if None).
+
+        :returns:
+        ranking (Pandas dataframe): Municipalities sorted by decreasing probability, with their ID, state and label.
+        """
+
+        rows = self._state_rows.get(state, np.empty(0, dtype=np.int64)) if state is not None else \
+            np.arange(len(self.ids))
+        values = np.asarray(self.probabilities[rows, self._position(self.profiles, profile, "profile"),
+                                               self._position(self.hours, hour, "hour"),
+                                               self._position(self.crimes, crime, "crime")], dtype=np.float32)
+
+        order = np.argsort(-values, kind="stable")[:top]
+        rows = rows[order]
+
+        return pd.DataFrame({"id": self.ids[rows],
+                             "state": [state_dict.get(code) for code in self._states[rows]],
+                             "municipality": self._labels[rows],
+                             "probability": values[order]})
+
+
+# Function to identify the atlas to serve
+def get_atlas_key(directory=atlas_dir, bundle_hash=None):
+    """
+    Function to identify the atlas to serve with the current model, so that a process caching the atlas reopens it
+    once another bundle is swapped in or the atlas is rebuilt.
+
+    :parameter:
+    directory (String): Directory of the atlas.
+    bundle_hash (String): Content hash of the served model bundle (None for the loose files).
+
+    :returns:
+    key (Tuple): Bundle hash and modification time of the atlas metadata (None if the atlas has not been built).
+    """
+
+    meta_path = os.path.join(directory, "meta.json")
+
+    return bundle_hash, os.path.getmtime(meta_path) if os.path.exists(meta_path) else None
+
+
+# Function to load the atlas if it is up to date
+def load_atlas(registry, directory=atlas_dir, paths=atlas_sources, bundle_hash=None):
+    """
+    Function to open the atlas, provided it was built from the served model bundle, or from the current model and
+    catalogue files when no bundle is served.
+
+    :parameter:
+    registry (CatalogueRegistry): Catalogue registry, used for the municipality labels.
+    directory (String): Directory of the atlas.
+    paths (Python dict): Paths to the files whose changes make the atlas out of date.
+    bundle_hash (String): Content hash of the served model bundle (None for the loose files).
+
+    :returns:
+    atlas (MunicipalityAtlas): Atlas, or None if it has not been built or is out of date.
+    """
+
+    from startup import get_fingerprint
+
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as file:
+        meta = json.load(file)
+
+    if meta.get("bundle") != bundle_hash:
+        return None
+
+    if bundle_hash is None:
+        try:
+            if meta.get("fingerprint") != get_fingerprint(paths):
+                return None
+        except OSError:
+            return None
+
+    return MunicipalityAtlas(directory, registry)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Municipality risk atlas of the crime predictor.")
+    parser.add_argument("command", choices=["build", "rank"], help="Build the atlas or rank municipalities.")
+    parser.add_argument("--directory", default=atlas_dir, help="Directory of the atlas.")
+    parser.add_argument("--backend", choices=["numpy", "keras"], default="numpy", help="Inference backend.")
+    parser.add_argument("--bundle", default=None, help="Model bundle (see bundle.py), instead of the loose files.")
+    parser.add_argument("--state", default=None, help="State label (the whole country if omitted).")
+    parser.add_argument("--profile", default=list(reference_profiles)[0], help="Reference profile.")
+    parser.add_argument("--hour", default="Not specified", help="Hour label.")
+    parser.add_argument("--crime", default="Overall", help="Crime label.")
+    parser.add_argument("--top", type=int, default=20, help="Number of municipalities to list.")
+    args = parser.parse_args()
+
+    from registry import CatalogueRegistry
+
+    bundle = None
+    registry = None
+    if args.bundle:
+        from bundle import ModelBundle
+        bundle = ModelBundle(args.bundle, args.backend)
+        registry = bundle.registry()
+    if registry is None:
+        registry = CatalogueRegistry.from_files(layout=bundle.layout if bundle is not None else None)
+    bundle_hash = bundle.hash if bundle is not None else None
+
+    if args.command == "build":
+        if bundle is not None:
+            model = bundle.model
+        else:
+            from batch_scoring import load_model
+            model = load_model(args.backend, atlas_sources["config"], atlas_sources["weights"])
+        meta = build_atlas(model, registry, args.directory, bundle_hash=bundle_hash)
+        print(f"Atlas of shape {tuple(meta['shape'])} built in {meta['seconds']:.1f} s.")
+    else:
+        atlas = load_atlas(registry, args.directory, bundle_hash=bundle_hash)
+        if atlas is None:
+            parser.error("the atlas has not been built or is out of date; run 'python atlas.py build'")
+        state = registry.encode("state", args.state) if args.state else None
+        print(atlas.rank(args.profile, args.hour, args.crime, state, args.top).to_string(index=False))
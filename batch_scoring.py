@@ -0,0 +1,495 @@
+# Batch Scoring of Socioeconomic & Demographic Profiles
+
+"""
+Module Brief Description:
+Command-line entry point for scoring large CSV or Parquet files of profiles offline. The input file is streamed in
+fixed-size chunks, the human labels are mapped to their encoded values with the same catalogue registry as the app, each
+chunk is encoded in vectorized form with the compiled feature layout and scored in a single batched call, and the 19
+crime probabilities are written incrementally. Chunks can be fanned out across CPU cores with a process pool, keeping a
+bounded number of chunks in flight, so memory stays bounded regardless of the input size.
+
+Rows with an unknown label or a missing or non-numeric number are not scored: their probabilities are left empty, the
+reason is written in the "error" column, and their count is reported at the end. Parquet outputs keep the schema of the
+first chunk, with the numbers as doubles and the labels as strings, so chunks whose inferred dtypes differ still match.
+
+Input columns (human labels, as in the app's select boxes):
+sex, age, education, activity, job, social_class, category, housing_class, people_household, kinship, state,
+metro_area, municipality, hour, and optionally month and place (which default to "Not specified", as in the app).
+
+Usage:
+python batch_scoring.py profiles.csv scores.csv --chunksize 100000 --workers 4
+"""
+
+# Libraries importation
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import numpy as np
+import pandas as pd
+from catalogues import default_labels, label_columns
+from encoding import categorical_fields, numerical_fields
+from registry import CatalogueRegistry
+from startup import load_artifact
+
+# Model and layout of the current process (loaded once per worker)
+_scorer = None
+
+# Arrow types of the columns of the Parquet output whose pandas dtype may change from one chunk to another
+parquet_types = {**{field: "double" for field in numerical_fields},
+                 **{field: "string" for field in categorical_fields},
+                 "error": "string"}
+
+
+# Function to describe an invalid value of a profile
+def get_error(field, label):
+    """
+    Function to describe why the value of a predictor of a profile cannot be encoded.
+
+    :parameter:
+    field (String): Name of the predictor.
+    label (Object): Label or value of the predictor.
+
+    :returns:
+    error (String): Error message.
+    """
+
+    if field in categorical_fields:
+        return f"Unknown {field} label: {label}"
+
+    return f"Missing or invalid {field}: {label}"
+
+
+# Class to map labels to codes and score chunks of profiles
+class Scorer:
+    """
+    Class holding the catalogue registry, the feature layout and the model used for scoring.
+
+    :attributes:
+    registry (CatalogueRegistry): Catalogue registry of the predictors' vocabularies.
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    model (NumpyModel or Keras object): Trained model.
+    version (String): Version of the model (the content hash prefix of the loose files, or the bundle's version).
+    watcher (BundleWatcher): Watcher of the model bundle, if the model is served from one (see bundle.py).
+    """
+
+    def __init__(self, backend="numpy", config_path="CrimePredictorConfig.json",
+                 weights_path="CrimePredictorWeights.h5", bundle_path=None):
+        """
+        :parameter:
+        backend (String): "numpy" for the TensorFlow-free engine, or "keras" for the TensorFlow model.
+        config_path (String): Path to the model's architecture JSON file.
+        weights_path (String): Path to the model's weights HDF5 file.
+        bundle_path (String): Path to a model bundle, reloaded when it changes (the loose files are used if None).
+        """
+
+        self.watcher = None
+        self.registry = None
+        if bundle_path is not None:
+            from bundle import BundleWatcher
+            self.watcher = BundleWatcher(bundle_path, backend)
+            # A bundle with the catalogue is enough on its own, e.g., when attached from shared memory
+            self.registry = self.watcher.current().registry()
+
+        if self.registry is None:
+            artifact = load_artifact()
+            if artifact is not None:
+                self.registry = artifact["registry"]
+            else:
+                self.registry = CatalogueRegistry.from_files()
+
+        if self.watcher is None:
+            from prediction_cache import get_fingerprint
+            self._config_path = config_path
+            self._layout = self.registry.layout
+            self._model = load_model(backend, config_path, weights_path)
+            self._version = get_fingerprint([config_path, weights_path, "Encoders.json", "Scalers.json"])[:12]
+
+    def snapshot(self):
+        """
+        Function to return the model, feature layout and version to use together for a prediction, so that a new
+        bundle swapped in meanwhile does not mix versions.
+
+        :returns:
+        model (NumpyModel or Keras object): Trained model.
+        layout (FeatureLayout): Compiled feature layout of the input array.
+        version (String): Version of the model.
+        """
+
+        if self.watcher is not None:
+            bundle = self.watcher.current()
+            return bundle.model, bundle.layout, bundle.version
+
+        return self._model, self._layout, self._version
+
+    def dropout_rates(self):
+        """
+        Function to read the dropout rate after each Dense layer from the architecture of the current model, i.e., the
+        bundle's or the one of the loose config file.
+
+        :returns:
+        rates (List): Dropout rate after each Dense layer (see uncertainty.py).
+        """
+
+        from uncertainty import read_dropout_rates
+
+        if self.watcher is not None:
+            return read_dropout_rates(self.watcher.current().header["architecture"])
+
+        with open(self._config_path) as json_file:
+            return read_dropout_rates(json_file.read())
+
+    @property
+    def model(self):
+        """
+        Function to return the current model.
+        """
+
+        return self.snapshot()[0]
+
+    @property
+    def layout(self):
+        """
+        Function to return the current feature layout.
+        """
+
+        return self.snapshot()[1]
+
+    @property
+    def version(self):
+        """
+        Function to return the current version of the model.
+        """
+
+        return self.snapshot()[2]
+
+    def encode_rows(self, chunk):
+        """
+        Function to map the human labels of a chunk of profiles to their encoded values, reporting the rows that
+        cannot be encoded. Their unknown categories are left empty and their invalid numbers as NaN.
+
+        :parameter:
+        chunk (Pandas dataframe): Chunk of profiles with human labels.
+
+        :returns:
+        profiles (Python dict): Encoded values of every predictor, keyed by predictor name.
+        errors (Numpy array): Error message of each row, or None if the row is valid.
+        """
+
+        labels = {}
+        for field in list(categorical_fields) + list(numerical_fields):
+            if field in chunk:
+                labels[field] = chunk[field].to_numpy()
+            elif field in default_labels:
+                labels[field] = np.full(len(chunk), default_labels[field], dtype=object)
+            else:
+                raise KeyError(f"Missing column: {field}")
+
+        # Non-numeric values become NaN, so that they are reported as the missing ones
+        numbers = {field: pd.to_numeric(pd.Series(labels[field]), errors="coerce").to_numpy()
+                   for field in numerical_fields}
+        profiles = self.registry.profiles({**labels, **numbers})
+
+        errors = np.full(len(chunk), None, dtype=object)
+        for field in list(categorical_fields) + list(numerical_fields):
+            invalid = pd.isna(profiles[field]) & pd.isna(errors)
+            if invalid.any():
+                errors[invalid] = [get_error(field, label) for label in labels[field][invalid]]
+
+        return profiles, errors
+
+    def encode(self, chunk, strict=False):
+        """
+        Function to map the human labels of a chunk of profiles to their encoded values.
+
+        :parameter:
+        chunk (Pandas dataframe): Chunk of profiles with human labels.
+        strict (Boolean): Whether to raise an error for an unknown label or a missing number, instead of leaving the
+        category block empty or the value as NaN.
+
+        :returns:
+        profiles (Python dict): Encoded values of every predictor, keyed by predictor name.
+        """
+
+        profiles, errors = self.encode_rows(chunk)
+
+        if strict:
+            invalid = np.flatnonzero(pd.notna(errors))
+            if len(invalid):
+                raise ValueError(errors[invalid[0]])
+
+        return profiles
+
+    def score(self, chunk):
+        """
+        Function to predict the probabilities of suffering each crime for a chunk of profiles. The rows that cannot
+        be encoded are not scored: their probabilities are NaN and the reason is given in the "error" column.
+
+        :parameter:
+        chunk (Pandas dataframe): Chunk of profiles with human labels.
+
+        :returns:
+        scores (Pandas dataframe): Input chunk with the 19 probabilities and the "error" column appended.
+        """
+
+        model, layout, _ = self.snapshot()
+        profiles, errors = self.encode_rows(chunk)
+        valid = pd.isna(errors)
+
+        Y = np.full((len(chunk), len(label_columns)), np.nan, dtype=np.float32)
+        if valid.any():
+            X = layout.encode_batch(profiles, sparse=True, dtype=np.float32)
+            Y[valid] = predict(model, X[valid])
+
+        scores = pd.DataFrame(Y, columns=label_columns, index=chunk.index)
+        scores["error"] = errors
+
+        return pd.concat([chunk, scores], axis=1)
+
+
+# Function to load the model with the selected backend
+def load_model(backend="numpy", config_path="CrimePredictorConfig.json", weights_path="CrimePredictorWeights.h5"):
+    """
+    Function to load the trained model from serialized files.
+
+    :parameter:
+    backend (String): "numpy" for the TensorFlow-free engine, or "keras" for the TensorFlow model.
+    config_path (String): Path to the model's architecture JSON file.
+    weights_path (String): Path to the model's weights HDF5 file.
+
+    :returns:
+    model (NumpyModel or Keras object): Trained model ready for making predictions.
+    """
+
+    if backend == "numpy":
+        from inference import NumpyModel
+        return NumpyModel.from_files(config_path, weights_path)
+
+    from tensorflow.keras.models import model_from_json
+
+    with open(config_path) as json_file:
+        model = model_from_json(json_file.read())
+    model.load_weights(weights_path)
+
+    return model
+
+
+# Function to run a large-batch prediction
+def predict(model, X, batch_size=8192):
+    """
+    Function to predict the probabilities for an input matrix with either backend.
+
+    :parameter:
+    model (NumpyModel or Keras object): Trained model.
+    X (CSR matrix): Input matrix.
+    batch_size (Integer): Number of rows per forward pass.
+
+    :returns:
+    Y (Numpy array): Output probabilities.
+    """
+
+    if hasattr(model, "first_layer"):
+        return model.predict(X, batch_size=batch_size)
+
+    return model.predict(X.toarray(), batch_size=batch_size, verbose=0)
+
+
+# Functions run in the worker processes
+def _init_worker(backend, config_path, weights_path):
+    """
+    Function to load the scorer once per worker process.
+    """
+
+    global _scorer
+    _scorer = Scorer(backend, config_path, weights_path)
+
+
+def _score_chunk(chunk):
+    """
+    Function to score a chunk with the scorer of the worker process.
+    """
+
+    return _scorer.score(chunk)
+
+
+# Function to stream the input file in chunks
+def read_chunks(path, chunksize):
+    """
+    Function to read a CSV or Parquet file in fixed-size chunks.
+
+    :parameter:
+    path (String): Path to the input file.
+    chunksize (Integer): Number of rows per chunk.
+
+    :returns:
+    chunks (Generator): Generator of Pandas dataframes.
+    """
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        # "None" is a valid education label, so only empty fields are read as missing values
+        yield from pd.read_csv(path, chunksize=chunksize, keep_default_na=False, na_values=[""])
+
+
+# Class to write the scores incrementally
+class ChunkWriter:
+    """
+    Class to append scored chunks to a CSV or Parquet file.
+    """
+
+    def __init__(self, path):
+        """
+        :parameter:
+        path (String): Path to the output file.
+        """
+
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self.writer = None
+        self.schema = None
+        self.header = True
+
+    def get_schema(self, chunk):
+        """
+        Function to build the schema of the Parquet output from the first chunk, with fixed types for the columns
+        whose inferred type may change between chunks (e.g., integer ages becoming doubles with a missing age, or an
+        error column without any error).
+
+        :parameter:
+        chunk (Pandas dataframe): First scored chunk.
+
+        :returns:
+        schema (Arrow schema): Schema of every chunk.
+        """
+
+        import pyarrow as pa
+
+        fields = []
+        for field in pa.Schema.from_pandas(chunk, preserve_index=False):
+            if field.name in parquet_types:
+                field = pa.field(field.name, pa.type_for_alias(parquet_types[field.name]))
+            elif pa.types.is_null(field.type):
+                field = pa.field(field.name, pa.string())
+            fields.append(field)
+
+        return pa.schema(fields)
+
+    def write(self, chunk):
+        """
+        Function to append a scored chunk to the output file.
+
+        :parameter:
+        chunk (Pandas dataframe): Scored chunk.
+        """
+
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self.writer is None:
+                self.schema = self.get_schema(chunk)
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+
+            # Labels given as numbers are written as text, as the labels of the other chunks
+            chunk = chunk.copy()
+            for field in self.schema:
+                if pa.types.is_string(field.type) and not pd.api.types.is_string_dtype(chunk[field.name]):
+                    chunk[field.name] = chunk[field.name].map(lambda value: None if pd.isna(value) else str(value))
+            self.writer.write_table(pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+        else:
+            chunk.to_csv(self.path, mode="w" if self.header else "a", header=self.header, index=False,
+                         float_format="%.6f")
+            self.header = False
+
+    def close(self):
+        """
+        Function to close the output file.
+        """
+
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Function to score a whole file
+def score_file(input_path, output_path, chunksize=100000, workers=1, backend="numpy",
+               config_path="CrimePredictorConfig.json", weights_path="CrimePredictorWeights.h5", verbose=True):
+    """
+    Function to stream a file of profiles through the model and write the probabilities incrementally.
+
+    :parameter:
+    input_path (String): Path to the CSV or Parquet file with the profiles.
+    output_path (String): Path to the CSV or Parquet file for the scores.
+    chunksize (Integer): Number of rows per chunk.
+    workers (Integer): Number of worker processes (1 scores in the current process).
+    backend (String): "numpy" for the TensorFlow-free engine, or "keras" for the TensorFlow model.
+    config_path (String): Path to the model's architecture JSON file.
+    weights_path (String): Path to the model's weights HDF5 file.
+    verbose (Boolean): Whether to report the progress on stderr.
+
+    :returns:
+    stats (Python dict): Number of rows, number of invalid (unscored) rows, elapsed seconds and throughput in rows per
+    second.
+    """
+
+    start = time.perf_counter()
+    n_rows = 0
+    n_invalid = 0
+    writer = ChunkWriter(output_path)
+
+    def write(scored):
+        nonlocal n_rows, n_invalid
+        writer.write(scored)
+        n_rows += len(scored)
+        n_invalid += int(scored["error"].notna().sum())
+        elapsed = time.perf_counter() - start
+        if verbose:
+            print(f"{n_rows:,} rows scored in {elapsed:.1f} s ({n_rows / elapsed:,.0f} rows/s)", file=sys.stderr)
+
+    try:
+        if workers <= 1:
+            scorer = Scorer(backend, config_path, weights_path)
+            for chunk in read_chunks(input_path, chunksize):
+                write(scorer.score(chunk))
+        else:
+            # At most two chunks per worker are in flight, and results are written in input order
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(backend, config_path, weights_path)) as executor:
+                pending = deque()
+                for chunk in read_chunks(input_path, chunksize):
+                    pending.append(executor.submit(_score_chunk, chunk))
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    if n_invalid:
+        print(f"{n_invalid:,} invalid rows were not scored (see the error column).", file=sys.stderr)
+
+    return {"rows": n_rows, "invalid": n_invalid, "seconds": elapsed,
+            "rows_per_second": n_rows / elapsed if elapsed else 0.0}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Batch scoring of profiles with the crime predictor.")
+    parser.add_argument("input", help="CSV or Parquet file with the profiles (human labels).")
+    parser.add_argument("output", help="CSV or Parquet file for the scores.")
+    parser.add_argument("--chunksize", type=int, default=100000, help="Number of rows per chunk.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"Number of worker processes (up to {os.cpu_count()} on this machine).")
+    parser.add_argument("--backend", choices=["numpy", "keras"], default="numpy", help="Inference backend.")
+    parser.add_argument("--config", default="CrimePredictorConfig.json", help="Model's architecture JSON file.")
+    parser.add_argument("--weights", default="CrimePredictorWeights.h5", help="Model's weights HDF5 file.")
+    parser.add_argument("--quiet", action="store_true", help="Do not report the progress.")
+    args = parser.parse_args()
+
+    stats = score_file(args.input, args.output, args.chunksize, args.workers, args.backend,
+                       args.config, args.weights, verbose=not args.quiet)
+    print(f"Scored {stats['rows']:,} rows in {stats['seconds']:.2f} s ({stats['rows_per_second']:,.0f} rows/s).")
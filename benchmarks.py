@@ -0,0 +1,395 @@
+# Benchmarks for the Crime Predictor
+
+"""
+Module Brief Description:
+Microbenchmark suite of every stage of the prediction path of the Streamlit app, timed in isolation and end-to-end.
+The functions of app.py are loaded headless, i.e., its imports, functions and constants are executed without the page
+code, so nothing is rendered. For each stage, the suite reports the mean and the 50th, 90th and 99th percentiles of the
+latency and the peak memory allocated by Python (tracemalloc), as JSON. Results can be stored as a baseline and later
+runs compared against it, failing when the median latency of any stage regresses beyond a threshold.
+
+Usage:
+python benchmarks.py suite --output results.json                    # Runs the suite
+python benchmarks.py suite --save-baseline                          # Stores the results as the baseline
+python benchmarks.py suite --baseline BenchmarkBaseline.json        # Fails if a stage is over the threshold
+python benchmarks.py select_mun                                     # select_mun before/after the per-state index
+"""
+
+# Libraries importation
+import argparse
+import ast
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import pandas as pd
+from catalogues import default_labels, state_dict
+from registry import CatalogueRegistry
+
+# Default path of the stored baseline
+baseline_path = "BenchmarkBaseline.json"
+
+# Default regression threshold over the baseline median (0.25 means 25% slower)
+regression_threshold = 0.25
+
+# Batch sizes benchmarked for model.predict
+batch_sizes = [1, 32, 1024]
+
+
+# Function to load the functions of the app without rendering it
+def load_app(path="app.py"):
+    """
+    Function to execute the imports, functions and constants of the Streamlit app, skipping the page code and every
+    other module-level statement that renders elements.
+
+    :parameter:
+    path (String): Path to the Streamlit app.
+
+    :returns:
+    app (Python dict): Namespace with the functions of the app.
+    """
+
+    import streamlit.logger
+
+    # Cached functions warn about the missing script run context in bare mode
+    streamlit.logger.set_log_level("error")
+
+    with open(path, encoding="utf8") as file:
+        tree = ast.parse(file.read(), filename=path)
+
+    def renders(node):
+        return any(isinstance(child, ast.Name) and child.id == "st" for child in ast.walk(node))
+
+    body = [node for node in tree.body
+            if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef))
+            or (isinstance(node, ast.Assign) and not renders(node))]
+
+    app = {"__name__": "app_headless", "__file__": os.path.abspath(path)}
+    exec(compile(ast.Module(body=body, type_ignores=[]), path, "exec"), app)
+
+    return app
+
+
+# Function to time a stage
+def measure(function, samples=50, min_sample_time=1e-3, max_inner=10000, setup=None):
+    """
+    Function to measure the latency distribution and peak memory of a stage.
+
+    :parameter:
+    function (Callable): Stage to measure, without arguments.
+    samples (Integer): Number of timed samples.
+    min_sample_time (Float): Minimum duration of a sample in seconds; fast stages are called several times per sample.
+    max_inner (Integer): Maximum number of calls per sample.
+    setup (Callable): Function called before each call that must not be timed (e.g., clearing a cache), which also
+    forces one call per sample.
+
+    :returns:
+    result (Python dict): Mean and percentiles of the latency in milliseconds, number of samples and calls per sample,
+    and peak memory in kilobytes.
+    """
+
+    # Warm-up and calibration of the calls per sample
+    for _ in range(2):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+    inner = 1 if setup is not None else int(min(max_inner, max(1, min_sample_time / max(elapsed, 1e-9))))
+
+    times = np.empty(samples)
+    for i in range(samples):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(inner):
+            function()
+        times[i] = (time.perf_counter() - start) / inner
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times *= 1000
+
+    return {"mean_ms": float(times.mean()),
+            "p50_ms": float(np.percentile(times, 50)),
+            "p90_ms": float(np.percentile(times, 90)),
+            "p99_ms": float(np.percentile(times, 99)),
+            "samples": samples,
+            "calls_per_sample": inner,
+            "peak_memory_kb": peak / 1024}
+
+
+# Function to draw random profiles with the labels of the app's select boxes
+def sample_labels(app, n_profiles, seed=0):
+    """
+    Function to draw random profiles as selected in the app.
+
+    :parameter:
+    app (Python dict): Namespace with the functions of the app.
+    n_profiles (Integer): Number of profiles.
+    seed (Integer): Seed of the random number generator.
+
+    :returns:
+    profiles (List): List of dictionaries with the arguments of get_input_array.
+    """
+
+    rng = np.random.default_rng(seed)
+    states = [state for state in state_dict.values() if app["select_mun"](state)]
+
+    def choice(values):
+        return values[rng.integers(len(values))]
+
+    profiles = []
+    for _ in range(n_profiles):
+        state = choice(states)
+        profiles.append({"sex": choice(list(app["sex_dict"].values())),
+                         "age": int(rng.integers(15, 100)),
+                         "education": choice(list(app["education_dict"].values())),
+                         "activity": choice(list(app["activity_dict"].values())),
+                         "job": choice(list(app["job_dict"].values())),
+                         "social_class": choice(list(app["social_class_dict"].values())),
+                         "category": choice(["Urban", "Rural"]),
+                         "housing_class": choice(list(app["housing_class_dict"].values())),
+                         "people_household": int(rng.integers(1, 31)),
+                         "kinship": choice(list(app["kinship_dict"].values())),
+                         "state": state,
+                         "metro_area": choice(app["select_metro_area"](state)),
+                         "municipality": choice(app["select_mun"](state)),
+                         "hour": choice(list(app["hour_dict"].values())),
+                         **default_labels})
+
+    return profiles
+
+
+# Function to run the benchmark suite
+def run_suite(backend=None, samples=50, app_path="app.py"):
+    """
+    Function to benchmark every stage of the prediction path of the app, in isolation and end-to-end.
+
+    :parameter:
+    backend (String): Backend of get_model (the app's default if None).
+    samples (Integer): Number of timed samples per stage.
+    app_path (String): Path to the Streamlit app.
+
+    :returns:
+    results (Python dict): Environment of the run and results of each stage.
+    """
+
+    app = load_app(app_path)
+    backend = backend or app["model_backend"]
+
+    profiles = sample_labels(app, 256)
+    inputs = np.vstack([app["get_input_array"](**profile) for profile in profiles])
+    cycle = {"i": 0}
+
+    def next_profile():
+        cycle["i"] = (cycle["i"] + 1) % len(profiles)
+        return profiles[cycle["i"]]
+
+    def get_model():
+        return app["get_model"](backend)
+
+    registry = app["get_registry"]()
+    model = get_model()
+    Y = np.asarray(model.predict(inputs[:1]))
+    df = app["get_df"](Y)
+
+    def end_to_end():
+        input_array = app["get_input_array"](**next_profile())
+        output = model.predict(input_array)
+        output_df = app["get_df"](output)
+        app["plot_pie_chart"](output_df)
+        app["plot_bar_chart"](output_df)
+
+    stages = {"get_municipality_index": (app["get_municipality_index"], app["get_file_municipality_index"].clear),
+              "select_mun": (lambda: app["select_mun"](next_profile()["state"]), None),
+              "encode_labels": (lambda: registry.profile(next_profile()), None),
+              "get_input_array": (lambda: app["get_input_array"](**next_profile()), None),
+              "get_model_cold": (get_model, app["get_model"].clear)}
+    for batch_size in batch_sizes:
+        X = np.resize(inputs, (batch_size, inputs.shape[1]))
+        stages[f"predict_{batch_size}"] = ((lambda X=X: model.predict(X)), None)
+    stages.update({"get_df": (lambda: app["get_df"](Y), None),
+                   "plot_pie_chart": (lambda: app["plot_pie_chart"](df), None),
+                   "plot_bar_chart": (lambda: app["plot_bar_chart"](df), None),
+                   "end_to_end": (end_to_end, None)})
+
+    results = {"environment": {"python": platform.python_version(),
+                               "machine": platform.machine(),
+                               "backend": backend,
+                               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "stages": {}}
+    for name, (function, setup) in stages.items():
+        stage_samples = min(samples, 5) if name == "get_model_cold" else samples
+        results["stages"][name] = measure(function, stage_samples, setup=setup)
+
+    app["get_model"].clear()
+
+    return results
+
+
+# Function to compare the results against the baseline
+def compare(results, baseline, threshold=regression_threshold):
+    """
+    Function to compare the median latency of every stage against a stored baseline.
+
+    :parameter:
+    results (Python dict): Results of the suite.
+    baseline (Python dict): Stored results of the suite.
+    threshold (Float): Maximum relative increase of the median latency (0.25 means 25% slower).
+
+    :returns:
+    regressions (Python dict): Ratio of the median latency over the baseline of the stages over the threshold.
+    """
+
+    regressions = {}
+    for name, result in results["stages"].items():
+        reference = baseline["stages"].get(name)
+        if reference is None or reference["p50_ms"] <= 0:
+            continue
+        ratio = result["p50_ms"] / reference["p50_ms"]
+        result["baseline_ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions[name] = ratio
+
+    return regressions
+
+
+# Function to load the municipalities catalogue as the app did before the per-state index
+def read_legacy_municipalities(path="MexicanMunicipalitiesCatalogue.json"):
+    """
+    Function to load the Mexican municipalities catalogue from the JSON file, as cached by the former app.
+
+    :parameter:
+    path (String): Path to the municipalities catalogue JSON file.
+
+    :returns:
+    municipalities_df (Pandas dataframe): Dataframe with the Mexican municipalities and their IDs.
+    """
+
+    municipalities_df = (pd.read_json(path, orient='index', typ='frame',
+                                      convert_axes=False, convert_dates=False).
+                         reset_index().rename(columns={"index": "Key", 0: "MunState"}))
+
+    municipalities_df = (pd.concat([municipalities_df, municipalities_df.MunState.str.split(', ', expand=True)], axis=1).
+                         rename(columns={0: "Municipality", 1: "State"}).
+                         drop(columns=["MunState", 2]).set_index("Key"))
+
+    return municipalities_df
+
+
+# Function replicating the former select_mun of the app, plus the sorting done by the page
+def legacy_select_mun(state, mun_cat):
+    """
+    Function to return the sorted municipalities of a state by scanning the whole catalogue, as the former app did on
+    every rerun.
+
+    :parameter:
+    state (String): Input Mexican State.
+    mun_cat (Pandas dataframe): Municipalities catalogue (see read_legacy_municipalities).
+
+    :returns:
+    mun_labels (List): Alphabetically sorted municipalities of the input Mexican state.
+    """
+
+    exc_mun_catalogue_dict = {
+        "Ciudad de México": "Ciudad de Mexico",
+        "Coahuila": "Coahuila de Zaragoza",
+        "Estado de México": "Mexico",
+        "Michoacán": "Michoacan de Ocampo",
+        "Nuevo León": "Nuevo Leon",
+        "San Luis Potosí": "San Luis Potosi",
+        "Veracruz": "Veracruz de Ignacio de la Llave",
+        "Yucatán": "Yucatan"
+    }
+
+    state = exc_mun_catalogue_dict.get(state, state)
+    mun_dict = mun_cat[mun_cat.State == state].drop(columns=['State']).to_dict(orient='dict')
+
+    return sorted(list(mun_dict['Municipality'].values()))
+
+
+# Function to benchmark the municipality select box
+def benchmark_select_mun(repeat=5, number=20):
+    """
+    Function to measure the cost of listing the municipalities of every state, as done on each rerun of the app, with
+    the former DataFrame scan and with the per-state index.
+
+    :parameter:
+    repeat (Integer): Number of repetitions (the best one is reported).
+    number (Integer): Number of sweeps over all the states per repetition.
+
+    :returns:
+    results (Python dict): Mean time per rerun in microseconds for each approach, and the speedup.
+    """
+
+    states = list(state_dict.values())
+    mun_cat = read_legacy_municipalities()
+    municipality_index = CatalogueRegistry.from_files().municipality_index(state_dict)
+
+    def legacy():
+        for state in states:
+            legacy_select_mun(state, mun_cat)
+
+    def indexed():
+        for state in states:
+            municipality_index[state]["labels"]
+
+    n_calls = number * len(states)
+    before = min(timeit.repeat(legacy, repeat=repeat, number=number)) / n_calls * 1e6
+    after = min(timeit.repeat(indexed, repeat=repeat, number=number)) / n_calls * 1e6
+
+    return {"before_us": before, "after_us": after, "speedup": before / after}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the crime predictor app.")
+    parser.add_argument("benchmark", choices=["suite", "select_mun"])
+    parser.add_argument("--backend", choices=["keras", "numpy", "float16", "int8"],
+                        help="Backend of get_model (the app's default if omitted).")
+    parser.add_argument("--samples", type=int, default=50, help="Number of timed samples per stage.")
+    parser.add_argument("--output", help="Path of the JSON results (printed if omitted).")
+    parser.add_argument("--baseline", help="Path of the baseline to compare against.")
+    parser.add_argument("--threshold", type=float, default=regression_threshold,
+                        help="Maximum relative increase of the median latency over the baseline.")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Store the results in {baseline_path}.")
+    args = parser.parse_args()
+
+    if args.benchmark == "select_mun":
+        results = benchmark_select_mun()
+        print(f"select_mun per rerun: before {results['before_us']:,.1f} us, after {results['after_us']:,.3f} us "
+              f"({results['speedup']:,.0f}x faster).")
+        sys.exit(0)
+
+    results = run_suite(args.backend, args.samples)
+
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(baseline_path, "w") as file:
+            file.write(output)
+
+    for name, ratio in regressions.items():
+        print(f"Regression: {name} is {ratio:.2f}x its baseline median.", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
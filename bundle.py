@@ -0,0 +1,523 @@
+# Versioned Model Bundle of the Crime Predictor
+
+"""
+Module Brief Description:
+Single-file bundle with everything the predictions depend on, which otherwise lives in four loose files that must be
+kept in sync (CrimePredictorConfig.json, CrimePredictorWeights.h5, Encoders.json and Scalers.json): the model's
+architecture, the kernels and biases of its Dense layers, the encoders' categories, the scalers' maximum values, the
+output labels and a SHA-256 content hash, which is also the default version of the bundle.
+
+The file holds a JSON header followed by the raw weight arrays, aligned to 64 bytes, so it is opened with a single
+memory map and the arrays are zero-copy views of it. Bundles are written into a temporary file that is renamed once
+complete, so a running server never reads a partial bundle, and the old version stays readable by the predictions in
+flight after the new one replaces it.
+
+BundleWatcher polls the bundle of a running server and, when it changes, loads and verifies the new version and swaps
+it in atomically, so retrained models are deployed without restarting the workers.
+
+The bundle can also carry the municipalities catalogue, and be published into OS shared memory (/dev/shm) by a loader
+step. Every app or service worker on the node then maps the same read-only pages of the weights and catalogue arrays
+with the TensorFlow-free engine, instead of holding a private copy of them and of a TensorFlow runtime, so an extra
+worker only costs its interpreter.
+
+Usage:
+python bundle.py build CrimePredictor.bundle                     # From the four loose files and the catalogue
+python bundle.py build CrimePredictor.bundle --version 2023.06   # With an explicit version label
+python bundle.py info CrimePredictor.bundle                      # Verifies the hash and reports the bundle
+python bundle.py share CrimePredictor.bundle                     # Publishes it into /dev/shm for the workers
+python bundle.py memory /dev/shm/CrimePredictor.bundle --workers 4   # Reports the memory of workers attached to it
+"""
+
+# Libraries importation
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+import numpy as np
+from catalogues import crime_labels, label_columns
+from encoding import FeatureLayout
+
+# Default path of the bundle
+bundle_path = "CrimePredictor.bundle"
+
+# Magic bytes and version of the format
+bundle_magic = b"CPBUNDLE"
+bundle_format = 1
+
+# Alignment of the arrays in bytes
+alignment = 64
+
+# Directory of the OS shared memory
+shm_dir = "/dev/shm"
+
+
+# Function to compute the content hash of a bundle
+def get_hash(header, arrays):
+    """
+    Function to compute the SHA-256 digest of the contents of a bundle: its header (without the hash, version and
+    creation date) and the bytes of its arrays.
+
+    :parameter:
+    header (Python dict): Header of the bundle.
+    arrays (Python dict): Weight arrays, keyed by name.
+
+    :returns:
+    hash (String): Hexadecimal digest.
+    """
+
+    contents = {key: value for key, value in header.items() if key not in ("hash", "version", "created", "arrays")}
+    contents["arrays"] = [{key: value for key, value in entry.items() if key != "offset"}
+                          for entry in header["arrays"]]
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps(contents, sort_keys=True).encode("utf8"))
+    for entry in header["arrays"]:
+        digest.update(memoryview(np.ascontiguousarray(arrays[entry["name"]])).cast("B"))
+
+    return digest.hexdigest()
+
+
+# Function to build a bundle from the loose files
+def build_bundle(path=bundle_path, config_path="CrimePredictorConfig.json", weights_path="CrimePredictorWeights.h5",
+                 encoders_path="Encoders.json", scalers_path="Scalers.json", version=None,
+                 catalogue_path="MunicipalitiesCatalogue.csv"):
+    """
+    Function to pack the model's architecture and weights, the encoders, the scalers and the municipalities catalogue
+    into a bundle.
+
+    :parameter:
+    path (String): Path to the bundle.
+    config_path (String): Path to the model's architecture JSON file.
+    weights_path (String): Path to the model's weights HDF5 file.
+    encoders_path (String): Path to the encoders states JSON file.
+    scalers_path (String): Path to the scalers maximum values JSON file.
+    version (String): Version label (the first 12 characters of the content hash if None).
+    catalogue_path (String): Path to the INEGI municipalities catalogue CSV file (left out if None or missing).
+
+    :returns:
+    header (Python dict): Header of the bundle.
+    """
+
+    import pandas as pd
+    from inference import read_architecture, read_weights
+
+    with open(config_path) as file:
+        architecture = file.read()
+    with open(encoders_path) as file:
+        encoders = json.load(file)
+    with open(scalers_path) as file:
+        scalers = json.load(file)
+
+    dense_layers = read_architecture(config_path)
+    weights = read_weights(weights_path)
+
+    arrays = {}
+    for i, layer in enumerate(dense_layers):
+        kernel, bias = weights[layer["name"]][:2]
+        arrays[f"kernel_{i}"] = np.ascontiguousarray(kernel, dtype=np.float32)
+        arrays[f"bias_{i}"] = np.ascontiguousarray(bias, dtype=np.float32)
+
+    header = {"format": bundle_format,
+              "architecture": architecture,
+              "layers": dense_layers,
+              "encoders": encoders,
+              "scalers": scalers,
+              "labels": crime_labels,
+              "label_columns": label_columns,
+              "arrays": []}
+
+    if catalogue_path is not None and os.path.exists(catalogue_path):
+        catalogue_df = pd.read_csv(catalogue_path, usecols=["CVE_ENT", "CVE_MUN", "NOM_MUN"])
+        arrays["catalogue_state"] = catalogue_df["CVE_ENT"].to_numpy(dtype=np.int64)
+        arrays["catalogue_municipality"] = catalogue_df["CVE_MUN"].to_numpy(dtype=np.int64)
+        header["catalogue_names"] = catalogue_df["NOM_MUN"].astype(str).tolist()
+
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"].append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape),
+                                 "offset": offset})
+        offset += -(-array.nbytes // alignment) * alignment
+
+    header["hash"] = get_hash(header, arrays)
+    header["version"] = version or header["hash"][:12]
+    header["created"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+
+    # The arrays start at the first aligned position after the magic bytes, header length and header
+    encoded = json.dumps(header).encode("utf8")
+    start = -(-(len(bundle_magic) + 8 + len(encoded)) // alignment) * alignment
+    encoded = encoded.ljust(start - len(bundle_magic) - 8)
+
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            file.write(bundle_magic)
+            file.write(struct.pack("<Q", len(encoded)))
+            file.write(encoded)
+            for entry in header["arrays"]:
+                array = arrays[entry["name"]]
+                file.seek(start + entry["offset"])
+                file.write(memoryview(array).cast("B"))
+            file.truncate(start + offset)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return header
+
+
+# Class to serve a bundle
+class ModelBundle:
+    """
+    Class opening a bundle with a single memory map, with the model and the feature layout it contains.
+
+    :attributes:
+    path (String): Path to the bundle.
+    header (Python dict): Header of the bundle.
+    version (String): Version label of the bundle.
+    hash (String): SHA-256 content hash of the bundle.
+    arrays (Python dict): Zero-copy views of the weight arrays, keyed by name.
+    layout (FeatureLayout): Compiled feature layout of the bundle's encoders and scalers.
+    model (NumpyModel or Keras object): Trained model ready for making predictions.
+    """
+
+    def __init__(self, path=bundle_path, backend="numpy", verify=True):
+        """
+        :parameter:
+        path (String): Path to the bundle.
+        backend (String): "numpy" for the TensorFlow-free engine, or "keras" for the TensorFlow model.
+        verify (Boolean): Whether to check the content hash of the bundle.
+        """
+
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+        if bytes(self._buffer[:len(bundle_magic)]) != bundle_magic:
+            raise ValueError(f"Not a model bundle: {path}")
+        length = struct.unpack("<Q", bytes(self._buffer[len(bundle_magic):len(bundle_magic) + 8]))[0]
+        start = len(bundle_magic) + 8
+        self.header = json.loads(bytes(self._buffer[start:start + length]))
+        if self.header["format"] != bundle_format:
+            raise ValueError(f"Unsupported bundle format: {self.header['format']}")
+
+        start += length
+        self.arrays = {}
+        for entry in self.header["arrays"]:
+            dtype = np.dtype(entry["dtype"])
+            begin = start + entry["offset"]
+            end = begin + dtype.itemsize * int(np.prod(entry["shape"]))
+            if end > len(self._buffer):
+                raise ValueError(f"Truncated model bundle: {path}")
+            self.arrays[entry["name"]] = self._buffer[begin:end].view(dtype).reshape(entry["shape"])
+
+        self.version = self.header["version"]
+        self.hash = self.header["hash"]
+        if verify and get_hash(self.header, self.arrays) != self.hash:
+            raise ValueError(f"Corrupted model bundle (hash mismatch): {path}")
+
+        self.layout = FeatureLayout(self.header["encoders"], self.header["scalers"])
+        self.model = self.load_model(backend)
+
+    def load_model(self, backend="numpy"):
+        """
+        Function to build the model of the bundle with the selected backend.
+
+        :parameter:
+        backend (String): "numpy" for the TensorFlow-free engine, or "keras" for the TensorFlow model.
+
+        :returns:
+        model (NumpyModel or Keras object): Trained model ready for making predictions.
+        """
+
+        n_layers = len(self.header["layers"])
+        kernels = [self.arrays[f"kernel_{i}"] for i in range(n_layers)]
+        biases = [self.arrays[f"bias_{i}"] for i in range(n_layers)]
+
+        if backend == "numpy":
+            from inference import NumpyModel
+            return NumpyModel(kernels, biases, [layer["activation"] for layer in self.header["layers"]])
+        if backend != "keras":
+            raise ValueError(f"Unsupported backend for a model bundle: {backend}")
+
+        from tensorflow.keras.models import model_from_json
+
+        model = model_from_json(self.header["architecture"])
+        model.set_weights([np.asarray(array) for pair in zip(kernels, biases) for array in pair])
+
+        return model
+
+    def registry(self):
+        """
+        Function to build the catalogue registry from the municipalities catalogue of the bundle.
+
+        :returns:
+        registry (CatalogueRegistry): Catalogue registry, or None if the bundle has no catalogue.
+        """
+
+        if "catalogue_names" not in self.header:
+            return None
+
+        import pandas as pd
+        from registry import CatalogueRegistry
+
+        catalogue_df = pd.DataFrame({"CVE_ENT": self.arrays["catalogue_state"],
+                                     "CVE_MUN": self.arrays["catalogue_municipality"],
+                                     "NOM_MUN": self.header["catalogue_names"]})
+
+        return CatalogueRegistry(self.layout, catalogue_df)
+
+
+# Class to reload a bundle when it changes
+class BundleWatcher:
+    """
+    Class polling a bundle and swapping in its new versions. A new version is fully loaded and verified before it
+    replaces the current one, and the predictions in flight keep their reference to the bundle they started with.
+
+    :attributes:
+    path (String): Path to the bundle.
+    backend (String): Backend of the models.
+    interval (Float): Minimum number of seconds between checks of the bundle.
+    reloads (Integer): Number of new versions swapped in.
+    errors (Integer): Number of new versions that failed to load.
+    """
+
+    def __init__(self, path=bundle_path, backend="numpy", interval=2.0):
+        """
+        :parameter:
+        path (String): Path to the bundle.
+        backend (String): "numpy" for the TensorFlow-free engine, or "keras" for the TensorFlow model.
+        interval (Float): Minimum number of seconds between checks of the bundle.
+        """
+
+        self.path = path
+        self.backend = backend
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._stat = self._stat_file()
+        self._bundle = ModelBundle(path, backend)
+        self._last_check = time.monotonic()
+
+    def _stat_file(self):
+        """
+        Function to return the inode, size and modification time of the bundle.
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def current(self):
+        """
+        Function to return the current bundle, checking first for a new version if the interval has elapsed.
+
+        :returns:
+        bundle (ModelBundle): Current bundle.
+        """
+
+        if time.monotonic() - self._last_check >= self.interval:
+            self.check()
+
+        return self._bundle
+
+    def check(self):
+        """
+        Function to load the bundle if it has changed. Only one thread loads it, while the others keep serving the
+        current version; a bundle that fails to load is ignored until it changes again.
+
+        :returns:
+        reloaded (Boolean): Whether a new version was swapped in.
+        """
+
+        if not self._lock.acquire(blocking=False):
+            return False
+
+        try:
+            self._last_check = time.monotonic()
+            stat = self._stat_file()
+            if stat is None or stat == self._stat:
+                return False
+            self._stat = stat
+
+            try:
+                bundle = ModelBundle(self.path, self.backend)
+            except (OSError, ValueError, KeyError):
+                self.errors += 1
+                return False
+
+            self._bundle = bundle
+            self.reloads += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """
+        Function to report the state of the watcher.
+
+        :returns:
+        stats (Python dict): Current version, content hash, reloads and failed reloads.
+        """
+
+        return {"version": self._bundle.version,
+                "hash": self._bundle.hash,
+                "reloads": self.reloads,
+                "reload_errors": self.errors}
+
+
+# Function to publish a bundle into shared memory
+def share_bundle(path=bundle_path, directory=shm_dir):
+    """
+    Function to copy a bundle into the OS shared memory, where the workers of the node map the same pages of it. The
+    copy is renamed once complete, so the watchers of the workers swap it in as a new version.
+
+    :parameter:
+    path (String): Path to the bundle.
+    directory (String): Directory of the OS shared memory.
+
+    :returns:
+    shared_path (String): Path to the shared bundle.
+    """
+
+    ModelBundle(path)
+
+    shared_path = os.path.join(directory, os.path.basename(path))
+    tmp_path = shared_path + ".tmp"
+    try:
+        shutil.copyfile(path, tmp_path)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, shared_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return shared_path
+
+
+# Function to read the memory usage of the current process
+def get_memory():
+    """
+    Function to read the resident and proportional set sizes of the current process (Linux only). The proportional
+    set size splits every shared page among the processes that map it.
+
+    :returns:
+    memory (Python dict): Rss, Pss, Shared and Private sizes in bytes.
+    """
+
+    memory = {"Rss": 0, "Pss": 0, "Shared": 0, "Private": 0}
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            name, _, value = line.partition(":")
+            size = int(value.split()[0]) * 1024 if value.strip() else 0
+            if name in ("Rss", "Pss"):
+                memory[name] = size
+            elif name.startswith("Shared_"):
+                memory["Shared"] += size
+            elif name.startswith("Private_"):
+                memory["Private"] += size
+
+    return memory
+
+
+# Function run by each worker of the memory report
+def _attach_worker(path, n_rows, queue, release):
+    """
+    Function to attach to a bundle, run a batch of predictions, report the memory of the worker and stay alive until
+    all the workers have reported.
+    """
+
+    from inference import sample_input
+
+    bundle = ModelBundle(path)
+    bundle.model.predict(sample_input(bundle.layout, n_rows))
+    shared = bool(np.shares_memory(bundle.model.kernels[0], bundle.arrays["kernel_0"]))
+    queue.put((os.getpid(), shared, get_memory()))
+    release.wait()
+
+
+# Function to report the memory of workers attached to a bundle
+def memory_report(path, workers=4, n_rows=1000):
+    """
+    Function to start several worker processes that attach to the same bundle and run predictions, and report their
+    memory usage while all of them are alive.
+
+    :parameter:
+    path (String): Path to the bundle.
+    workers (Integer): Number of worker processes.
+    n_rows (Integer): Number of random profiles predicted by each worker.
+
+    :returns:
+    report (List): Process ID, whether the weights are zero-copy views of the bundle, and memory usage of each worker.
+    """
+
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    release = context.Event()
+    processes = [context.Process(target=_attach_worker, args=(path, n_rows, queue, release))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    try:
+        report = [queue.get(timeout=120) for _ in processes]
+    finally:
+        release.set()
+        for process in processes:
+            process.join()
+
+    return report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Versioned single-file bundle of the crime predictor.")
+    parser.add_argument("command", choices=["build", "info", "share", "memory"],
+                        help="Build a bundle, verify and report it, publish it into shared memory, or report the "
+                             "memory of workers attached to it.")
+    parser.add_argument("path", nargs="?", default=bundle_path, help="Path to the bundle.")
+    parser.add_argument("--version", default=None, help="Version label (the content hash prefix by default).")
+    parser.add_argument("--config", default="CrimePredictorConfig.json", help="Model's architecture JSON file.")
+    parser.add_argument("--weights", default="CrimePredictorWeights.h5", help="Model's weights HDF5 file.")
+    parser.add_argument("--encoders", default="Encoders.json", help="Encoders states JSON file.")
+    parser.add_argument("--scalers", default="Scalers.json", help="Scalers maximum values JSON file.")
+    parser.add_argument("--catalogue", default="MunicipalitiesCatalogue.csv", help="Municipalities catalogue CSV file.")
+    parser.add_argument("--directory", default=shm_dir, help="Shared memory directory of the share command.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes of the memory command.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        header = build_bundle(args.path, args.config, args.weights, args.encoders, args.scalers, args.version,
+                              args.catalogue)
+        print(f"Bundle {args.path} version {header['version']} ({os.path.getsize(args.path):,} bytes) built.")
+    elif args.command == "share":
+        shared_path = share_bundle(args.path, args.directory)
+        print(f"Bundle {args.path} published into {shared_path}; point CRIME_PREDICTOR_BUNDLE or --bundle to it.")
+    elif args.command == "memory":
+        size = os.path.getsize(args.path)
+        report = memory_report(args.path, args.workers)
+        for pid, shared, memory in report:
+            print(f"Worker {pid}: Rss {memory['Rss'] / 2 ** 20:,.1f} MiB, Pss {memory['Pss'] / 2 ** 20:,.1f} MiB, "
+                  f"Shared {memory['Shared'] / 2 ** 20:,.1f} MiB, Private {memory['Private'] / 2 ** 20:,.1f} MiB, "
+                  f"zero-copy weights: {shared}.")
+        total = sum(memory["Pss"] for _, _, memory in report)
+        print(f"{len(report)} workers attached to a {size / 2 ** 20:,.1f} MiB bundle use {total / 2 ** 20:,.1f} MiB "
+              f"of proportional memory in total.")
+    else:
+        start = time.perf_counter()
+        bundle = ModelBundle(args.path)
+        print(f"Bundle {args.path}: version {bundle.version}, hash {bundle.hash}, created {bundle.header['created']}, "
+              f"{len(bundle.arrays)} arrays, {bundle.layout.n_features} inputs, verified and loaded in "
+              f"{time.perf_counter() - start:.3f} s.")
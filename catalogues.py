@@ -0,0 +1,270 @@
+# Attribute Dictionaries and Labels for the Crime Predictor
+
+"""
+Module Brief Description:
+Attribute dictionaries mapping the encoded values of the ENVIPE predictors to their labels, and the names of the
+model's output labels. They are shared by the Streamlit app and the offline tools, so that every entry point maps
+labels to codes in the same way.
+"""
+
+# Attribute Dictionaries
+# Housing Class Attribute Dictionary
+housing_class_dict = {
+    1: "Stand-alone house",
+    2: "Apartment in building",
+    3: "Vecindad",
+    4: "Rooftop room housing",
+    5: "Premises not built for housing"
+}
+
+# Kinship Attribute Dictionary
+kinship_dict = {
+    1: "Household head",
+    2: "Spouse",
+    3: "Child",
+    4: "Parent",
+    5: "Other relationship",
+    6: "No relationship"
+}
+
+# Education Attribute Dictionary
+education_dict = {
+    0: "None",
+    1: "Preschool",
+    2: "Elementary",
+    3: "Secondary",
+    4: "Technical with secondary school",
+    5: "Basic normal",
+    6: "High School",
+    7: "Technical with high school",
+    8: "Bachelor or professional",
+    9: "Master's or PhD",
+    99: "Not specified"
+}
+
+# Activity Attribute Dictionary
+activity_dict = {
+    1: "Worker",
+    2: "Had a job but didn't work",
+    3: "Looking for a job",
+    4: "Student",
+    5: "Housekeeper",
+    6: "Retired or pensioner",
+    7: "Permanently disabled from working",
+    8: "Didn't work",
+    9: "Not specified",
+}
+
+# Job Attribute Dictionary
+job_dict = {
+    1: "Laborer or pawn",
+    2: "Employee or worker",
+    3: "Self-employed worker",
+    4: "Boss or employer",
+    5: "Unpaid worker",
+    9: "Not specified",
+}
+
+# Sex Attribute Dictionary
+sex_dict = {
+    1: "Male",
+    2: "Female"
+}
+
+# Metropolitan Area Dictionary
+metro_area_dict = {
+    0:"Not applicable",
+    1:"Ciudad de México",
+    2:"Guadalajara",
+    3:"Monterrey",
+    4:"Puebla",
+    5:"León",
+    6:"La Laguna",
+    7:"San Luis Potosí",
+    8:"Mérida",
+    9:"Chihuahua",
+    10:"Tampico",
+    12:"Veracruz",
+    13:"Acapulco",
+    14:"Aguascalientes",
+    15:"Morelia",
+    16:"Toluca",
+    17:"Saltillo",
+    18:"Villahermosa",
+    19:"Tuxtla Gutiérrez",
+    21:"Tijuana",
+    24:"Culiacán",
+    25:"Hermosillo",
+    26:"Durango",
+    27:"Tepic",
+    28:"Campeche",
+    29:"Cuernavaca",
+    31:"Oaxaca",
+    32:"Zacatecas",
+    33:"Colima",
+    36:"Querétaro",
+    39:"Tlaxcala",
+    40:"La Paz",
+    41:"Cancún",
+    43:"Pachuca"
+}
+
+# State Attribute Dictionary
+state_dict = {
+    1: "Aguascalientes",
+    2: "Baja California",
+    3: "Baja California Sur",
+    4: "Campeche",
+    5: "Coahuila",
+    6: "Colima",
+    7: "Chiapas",
+    8: "Chihuahua",
+    9: "Ciudad de México",
+    10: "Durango",
+    11: "Guanajuato",
+    12: "Guerrero",
+    13: "Hidalgo",
+    14: "Jalisco",
+    15: "Estado de México",
+    16: "Michoacán",
+    17: "Morelos",
+    18: "Nayarit",
+    19: "Nuevo León",
+    20: "Oaxaca",
+    21: "Puebla",
+    22: "Querétaro",
+    23: "Quintana Roo",
+    24: "San Luis Potosí",
+    25: "Sinaloa",
+    26: "Sonora",
+    27: "Tabasco",
+    28: "Tamaulipas",
+    29: "Tlaxcala",
+    30: "Veracruz",
+    31: "Yucatán",
+    32: "Zacatecas",
+    99: "Not specified"
+}
+
+# Month Attribute Dictionary
+month_dict = {
+    1: "January",
+    2: "February",
+    3: "March",
+    4: "April",
+    5: "May",
+    6: "June",
+    7: "July",
+    8: "August",
+    9: "September",
+    10: "Octocer",
+    11: "November",
+    12: "December",
+    99: "Not specified"
+}
+
+# Hour Attribute Dictionary
+hour_dict = {
+    1: "Morning",
+    2: "Afternoon",
+    3: "Night",
+    4: "Early morning",
+    9: "Not specified"
+}
+
+# Place Attribute Dictionary
+place_dict = {
+    1: "In the street",
+    2: "At home",
+    3: "In the workplace",
+    4: "In a business or establishment",
+    5: "In a public place",
+    6: "In the public transportation",
+    7: "In a highway",
+    8: "Other",
+    9: "Not specified",
+}
+
+# Category Attribute Dictionary
+category_dict = {
+    "U": "Urban",
+    "C": "Urban complement",
+    "R": "Rural"
+}
+
+# Social Class Atribute Dictionary
+social_class_dict = {
+    1: "Low income",
+    2: "Lower middle income",
+    3: "Higher middle income",
+    4: "High income"
+}
+
+# Other Attributes dictionary
+other_dict = {
+    1: "Yes",
+    2: "No",
+    3: "Not applicable",
+    9: "Not specified"
+}
+
+# Labels of the predictors that the app does not ask for, used by every entry point
+default_labels = {"month": month_dict[99],
+                  "place": place_dict[9]}
+
+# Output labels of the model, as displayed in the app
+crime_labels = ["Total Vehicle Theft",
+                "Partial Vehicle Theft",
+                "Vandalism",
+                "Burglary",
+                "Kidnapping",
+                "Enforced Disappearance",
+                "Murder",
+                "Theft",
+                "Other Theft",
+                "Bank Fraud",
+                "Consumer Fraud",
+                "Extortion",
+                "Threats",
+                "Injuries",
+                "Kidnapping",
+                "Assault",
+                "Rape",
+                "Other",
+                "Overall"]
+
+# Output labels of the model, as named in the training dataset
+label_columns = ["CrimeVehicleTheft",
+                 "CrimePartialVehicleTheft",
+                 "CrimeVandalism",
+                 "CrimeBurglary",
+                 "CrimeHouseholdKidnapping",
+                 "CrimeHouseholdEnforcedDisappearance",
+                 "CrimeHouseholdMurder",
+                 "CrimeTheft",
+                 "CrimeOtherTheft",
+                 "CrimeBankFraud",
+                 "CrimeFraud",
+                 "CrimeExtortion",
+                 "CrimeThreats",
+                 "CrimeInjuries",
+                 "CrimeKidnapping",
+                 "CrimeAssault",
+                 "CrimeRape",
+                 "CrimeOther",
+                 "CrimeOverall"]
+
+# Attribute dictionary of each categorical predictor (the municipality dictionary is loaded from its catalogue)
+field_dicts = {"housing_class": housing_class_dict,
+               "kinship": kinship_dict,
+               "education": education_dict,
+               "activity": activity_dict,
+               "job": job_dict,
+               "sex": sex_dict,
+               "metro_area": metro_area_dict,
+               "month": month_dict,
+               "state": state_dict,
+               "hour": hour_dict,
+               "place": place_dict,
+               "category": category_dict,
+               "social_class": social_class_dict}
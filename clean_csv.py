@@ -0,0 +1,312 @@
+# Encoding Normalization of the ENVIPE Raw CSV Files
+
+"""
+Module Brief Description:
+Command-line version of CleanCSV.ipynb for transcoding the original CSV files from INEGI into UTF-8 before loading
+them into the database. Instead of running chardet over the entire raw file and loading the whole table in memory, the
+encoding is detected from a bounded sample of bytes, and each table is streamed in chunks with every column read as
+text, so no dtype is inferred (no mixed-type warnings on columns 14 and 124 of THogar, and IDs and codes are written
+exactly as in the source). A sample that decodes as UTF-8 (e.g., pure ASCII) is not conclusive for the rest of the file,
+so a table detected as UTF-8 that fails to decode later is transcoded again from the single-byte encoding of the
+notebook. As in the notebook, undesired '\\r' characters are removed from the values.
+
+The survey tables are processed concurrently across CPU cores. The size and SHA-256 hash of every source file and of its
+output are recorded in a manifest, so tables whose output is already up to date are skipped on later runs.
+
+Usage:
+python clean_csv.py --input-dir raw --output-dir . --workers 6
+python clean_csv.py conjunto_de_datos_THogar_ENVIPE_2022.csv --force
+"""
+
+# Libraries importation
+import argparse
+import codecs
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+# Original CSV files from INEGI
+datasets = ["conjunto_de_datos_THogar_ENVIPE_2022.csv",
+            "conjunto_de_datos_TMod_Vic_ENVIPE_2022.csv",
+            "conjunto_de_datos_TPer_Vic1_ENVIPE_2022.csv",
+            "conjunto_de_datos_TPer_Vic2_ENVIPE_2022.csv",
+            "conjunto_de_datos_TSDem_ENVIPE_2022.csv",
+            "conjunto_de_datos_TVivienda_ENVIPE_2022.csv"]
+
+# Prefix of the cleaned files, as expected by sql_script.sql
+output_prefix = "adj_"
+
+# Name of the manifest with the sizes and hashes of the processed files
+manifest_name = "CleanCSV.manifest.json"
+
+# Encoding detected by the notebook for the 2022 files, used when chardet is not installed
+fallback_encoding = "ISO-8859-1"
+
+
+# Function to detect the encoding of a file
+def detect_encoding(path, sample_size=1024 * 1024):
+    """
+    Function to detect the encoding of a file from a bounded sample of its first bytes.
+
+    :parameter:
+    path (String): Path to the file.
+    sample_size (Integer): Number of bytes of the sample.
+
+    :returns:
+    encoding (String): Name of the encoding.
+    """
+
+    with open(path, "rb") as file:
+        sample = file.read(sample_size)
+
+    # Valid UTF-8 (with a multibyte character possibly cut at the end of the sample) needs no detector, but it may
+    # still be followed by single-byte characters, which clean_file handles
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        import chardet
+    except ImportError:
+        return fallback_encoding
+
+    return chardet.detect(sample)["encoding"] or fallback_encoding
+
+
+# Function to hash a file
+def hash_file(path, block_size=4 * 1024 * 1024):
+    """
+    Function to compute the SHA-256 hash of a file, reading it in blocks.
+
+    :parameter:
+    path (String): Path to the file.
+    block_size (Integer): Number of bytes read at a time.
+
+    :returns:
+    digest (String): Hexadecimal SHA-256 hash.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+# Function to read the manifest of processed files
+def read_manifest(output_dir):
+    """
+    Function to read the manifest of the processed files of an output directory.
+
+    :parameter:
+    output_dir (String): Directory of the cleaned files.
+
+    :returns:
+    manifest (Python dict): Sizes and hashes of the source and output files, keyed by output file name.
+    """
+
+    path = os.path.join(output_dir, manifest_name)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as file:
+        return json.load(file)
+
+
+# Function to write the manifest of processed files
+def write_manifest(output_dir, manifest):
+    """
+    Function to write the manifest of the processed files of an output directory. The file is replaced atomically.
+
+    :parameter:
+    output_dir (String): Directory of the cleaned files.
+    manifest (Python dict): Sizes and hashes of the source and output files, keyed by output file name.
+    """
+
+    path = os.path.join(output_dir, manifest_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# Function to check whether an output file is up to date
+def is_up_to_date(source_path, output_path, entry):
+    """
+    Function to check whether an output file was built from the current source file and has not changed since. Sizes
+    are compared first, so the hashes are only computed when the sizes match.
+
+    :parameter:
+    source_path (String): Path to the original CSV file.
+    output_path (String): Path to the cleaned CSV file.
+    entry (Python dict): Manifest entry of the output file (None if it has not been processed).
+
+    :returns:
+    up_to_date (Boolean): Whether the table can be skipped.
+    """
+
+    if not entry or not os.path.exists(output_path):
+        return False
+
+    if (os.path.getsize(source_path) != entry["source_size"]
+            or os.path.getsize(output_path) != entry["output_size"]):
+        return False
+
+    return hash_file(source_path) == entry["source_sha256"] and hash_file(output_path) == entry["output_sha256"]
+
+
+# Function to stream a file into a UTF-8 file
+def transcode(source_path, output_path, encoding, chunksize=100000):
+    """
+    Function to stream a CSV file in chunks with every column read as text, remove the '\\r' characters from its
+    values and write it in UTF-8.
+
+    :parameter:
+    source_path (String): Path to the original CSV file.
+    output_path (String): Path to the output file, which is overwritten.
+    encoding (String): Encoding of the original file.
+    chunksize (Integer): Number of rows per chunk.
+
+    :returns:
+    rows (Integer): Number of rows written.
+    """
+
+    rows = 0
+    with open(output_path, "w", encoding="utf-8", newline="") as file:
+        # Every column is read as text, so values are written back exactly and no dtype is inferred
+        reader = pd.read_csv(source_path, encoding=encoding, dtype=str, keep_default_na=False, na_filter=False,
+                             chunksize=chunksize)
+        for chunk in reader:
+            chunk = chunk.replace("\r", "", regex=True)
+            chunk.to_csv(file, header=rows == 0, index=False, lineterminator="\n")
+            rows += len(chunk)
+
+    return rows
+
+
+# Function to transcode a file into UTF-8
+def clean_file(source_path, output_path, encoding=None, chunksize=100000):
+    """
+    Function to stream a CSV file in chunks, remove the '\\r' characters from its values and write it in UTF-8. The
+    output is written into a temporary file that replaces the output file once complete.
+
+    :parameter:
+    source_path (String): Path to the original CSV file.
+    output_path (String): Path to the cleaned CSV file.
+    encoding (String): Encoding of the original file (detected from a sample if None).
+    chunksize (Integer): Number of rows per chunk.
+
+    :returns:
+    entry (Python dict): Manifest entry of the output file, with the encoding, rows and elapsed seconds.
+    """
+
+    start = time.perf_counter()
+    detected = encoding is None
+    encoding = encoding or detect_encoding(source_path)
+
+    tmp_path = output_path + ".tmp"
+    try:
+        try:
+            rows = transcode(source_path, tmp_path, encoding, chunksize)
+        except UnicodeDecodeError:
+            # The sample was valid UTF-8, but a later byte is not: the file is in the single-byte encoding
+            if not detected or encoding == fallback_encoding:
+                raise
+            encoding = fallback_encoding
+            rows = transcode(source_path, tmp_path, encoding, chunksize)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {"source_size": os.path.getsize(source_path),
+            "source_sha256": hash_file(source_path),
+            "output_size": os.path.getsize(output_path),
+            "output_sha256": hash_file(output_path),
+            "encoding": encoding,
+            "rows": rows,
+            "seconds": time.perf_counter() - start}
+
+
+# Function to clean several files concurrently
+def clean_files(paths, output_dir=".", workers=None, chunksize=100000, encoding=None, force=False, verbose=True):
+    """
+    Function to transcode several CSV files into UTF-8 concurrently, skipping those whose output is up to date.
+
+    :parameter:
+    paths (List): Paths to the original CSV files.
+    output_dir (String): Directory of the cleaned files.
+    workers (Integer): Number of worker processes (the number of CPU cores if None).
+    chunksize (Integer): Number of rows per chunk.
+    encoding (String): Encoding of the original files (detected from a sample of each file if None).
+    force (Boolean): Whether to process every file even if its output is up to date.
+    verbose (Boolean): Whether to report the progress on stderr.
+
+    :returns:
+    results (Python dict): Manifest entry of each output file, with "skipped" set for the files not processed.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = read_manifest(output_dir)
+
+    jobs = {}
+    results = {}
+    for path in paths:
+        name = output_prefix + os.path.basename(path)
+        output_path = os.path.join(output_dir, name)
+        if not force and is_up_to_date(path, output_path, manifest.get(name)):
+            results[name] = dict(manifest[name], skipped=True)
+            if verbose:
+                print(f"{name} is up to date", file=sys.stderr)
+        else:
+            jobs[name] = (path, output_path)
+
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(clean_file, path, output_path, encoding, chunksize): name
+                       for name, (path, output_path) in jobs.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                entry = future.result()
+                manifest[name] = {key: entry[key] for key in ("source_size", "source_sha256", "output_size",
+                                                              "output_sha256", "encoding")}
+                write_manifest(output_dir, manifest)
+                results[name] = dict(entry, skipped=False)
+                if verbose:
+                    print(f"{name}: {entry['rows']:,} rows from {entry['encoding']} in {entry['seconds']:.1f} s",
+                          file=sys.stderr)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Transcoding of the ENVIPE raw CSV files into UTF-8.")
+    parser.add_argument("files", nargs="*", help="Original CSV files (the six ENVIPE 2022 tables if omitted).")
+    parser.add_argument("--input-dir", default=".", help="Directory of the original CSV files.")
+    parser.add_argument("--output-dir", default=".", help="Directory of the cleaned CSV files.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--chunksize", type=int, default=100000, help="Number of rows per chunk.")
+    parser.add_argument("--encoding", default=None, help="Encoding of the original files (detected if omitted).")
+    parser.add_argument("--force", action="store_true", help="Process the files even if their output is up to date.")
+    parser.add_argument("--quiet", action="store_true", help="Do not report the progress.")
+    args = parser.parse_args()
+
+    paths = args.files or [os.path.join(args.input_dir, dataset) for dataset in datasets]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        parser.error(f"missing input files: {', '.join(missing)}")
+
+    start = time.perf_counter()
+    results = clean_files(paths, args.output_dir, args.workers, args.chunksize, args.encoding, args.force,
+                          not args.quiet)
+    processed = sum(not result["skipped"] for result in results.values())
+    print(f"Processed {processed} of {len(results)} files in {time.perf_counter() - start:.1f} s.")
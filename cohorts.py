@@ -0,0 +1,175 @@
+# Cohort Analytics of the Crime Predictor
+
+"""
+Module Brief Description:
+Vectorized replacement of the social class breakdowns of the CrimePredictionMX notebook (get_social_class,
+get_overall_proba and get_proba_by_social_class). A dataset is scored once, the category of every row is read from the
+one-hot block of each predictor in the sparse input matrix (with the column positions taken from the compiled feature
+layout instead of hard-coded indices), and the mean and quantiles of the 19 crime probabilities are computed for every
+group of any categorical predictor or combination of them (e.g., state x social class) with grouped reductions.
+
+Usage:
+python cohorts.py dataset.csv --by social_class                  # Testing set of the feature store
+python cohorts.py dataset.csv --by state social_class --split all --output cohorts.csv
+"""
+
+# Libraries importation
+import argparse
+import numpy as np
+import pandas as pd
+from catalogues import crime_labels, field_dicts, state_dict
+from encoding import categorical_fields
+
+
+# Function to retrieve the category of every row for a predictor
+def get_positions(X, layout, field):
+    """
+    Function to return the position of the active category of a predictor in each row of a sparse input matrix, by
+    slicing the columns of its one-hot block.
+
+    :parameter:
+    X (CSR matrix): Input matrix.
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    field (String): Name of the categorical predictor.
+
+    :returns:
+    positions (Numpy array): Position of the category in layout.categories[field], with -1 for inactive rows.
+    """
+
+    start = layout.offsets[field]
+    block = X[:, start:start + len(layout.categories[field])].tocsr()
+
+    positions = np.full(X.shape[0], -1, dtype=np.int64)
+    active = np.diff(block.indptr) > 0
+    positions[active] = block.indices[block.indptr[:-1][active]]
+
+    return positions
+
+
+# Function to retrieve the labels of the categories of a predictor
+def get_category_labels(layout, field, registry=None, positions=None):
+    """
+    Function to return the human label of every category of a predictor, in the order of the feature layout.
+
+    :parameter:
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    field (String): Name of the categorical predictor.
+    registry (CatalogueRegistry): Catalogue registry, used for the municipality labels (codes are kept if None).
+    positions (Array-like): Positions of the categories to label (all of them if None).
+
+    :returns:
+    labels (List): Label of each category.
+    """
+
+    categories = layout.categories[field]
+    if positions is not None:
+        categories = [categories[position] for position in positions]
+
+    if field == "municipality":
+        if registry is None:
+            return [str(category) for category in categories]
+        municipalities = registry.municipalities.drop_duplicates("key").set_index("key")
+        return [f"{municipalities.at[category, 'municipality']}, {state_dict[municipalities.at[category, 'state']]}"
+                if category in municipalities.index else str(category) for category in categories]
+
+    return [field_dicts[field].get(category, str(category)) for category in categories]
+
+
+# Function to score a dataset
+def score(model, X, chunksize=65536):
+    """
+    Function to predict the probabilities of a whole input matrix once, in chunks of rows.
+
+    :parameter:
+    model (NumpyModel or Keras object): Trained model.
+    X (CSR matrix): Input matrix.
+    chunksize (Integer): Number of rows per chunk.
+
+    :returns:
+    Y_probs (Numpy array): Probabilities of shape (n_rows, 19).
+    """
+
+    from batch_scoring import predict
+
+    return np.vstack([predict(model, X[start:start + chunksize]) for start in range(0, X.shape[0], chunksize)])
+
+
+# Function to compute the probabilities by cohort
+def cohort_probabilities(X, Y_probs, layout, by=("social_class",), quantiles=(0.25, 0.5, 0.75), registry=None,
+                         dropna=True):
+    """
+    Function to compute the number of rows and the mean and quantiles of every crime probability for each group of
+    one or several categorical predictors.
+
+    :parameter:
+    X (CSR matrix): Input matrix.
+    Y_probs (Numpy array): Probabilities of shape (n_rows, 19), e.g., from score().
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    by (List): Names of the categorical predictors defining the groups.
+    quantiles (List): Quantiles to compute.
+    registry (CatalogueRegistry): Catalogue registry, used for the municipality labels.
+    dropna (Boolean): Whether to leave out the rows with an inactive predictor.
+
+    :returns:
+    cohorts (Pandas dataframe): One row per group (indexed by the labels of the predictors), with the "count" column
+    and a ("mean" or quantile, crime label) column for every statistic and crime.
+    """
+
+    by = [by] if isinstance(by, str) else list(by)
+    unknown = [field for field in by if field not in categorical_fields]
+    if unknown:
+        raise KeyError(f"Unknown categorical predictors: {', '.join(unknown)}")
+
+    keys = {}
+    for field in by:
+        labels = np.array(get_category_labels(layout, field, registry) + [None], dtype=object)
+        keys[field] = pd.Categorical(labels[get_positions(X, layout, field)],
+                                     categories=list(dict.fromkeys(labels[:-1])))
+
+    probabilities = pd.DataFrame(np.asarray(Y_probs), columns=crime_labels)
+    groups = probabilities.groupby([keys[field] for field in by], observed=True, dropna=dropna, sort=True)
+
+    statistics = {"mean": groups.mean()}
+    quantile_frame = groups.quantile(list(quantiles))
+    for q in quantiles:
+        statistics[f"q{q:g}"] = quantile_frame.xs(q, level=-1)
+
+    cohorts = pd.concat(statistics, axis=1)
+    cohorts.insert(0, ("count", ""), groups.size())
+    cohorts.index.names = by
+
+    return cohorts
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Crime probabilities by cohort of the crime predictor.")
+    parser.add_argument("source", nargs="?", default="dataset.csv", help="Output of sql_query.sql (CSV or Parquet).")
+    parser.add_argument("--store", default="FeatureStore", help="Directory of the feature store.")
+    parser.add_argument("--split", choices=["train", "validation", "test", "all"], default="test",
+                        help="Rows of the feature store to score.")
+    parser.add_argument("--by", nargs="+", default=["social_class"], help="Categorical predictors of the groups.")
+    parser.add_argument("--quantiles", nargs="*", type=float, default=[0.25, 0.5, 0.75], help="Quantiles.")
+    parser.add_argument("--crime", default="Overall", help="Crime displayed when no output file is given.")
+    parser.add_argument("--output", default=None, help="CSV file for the whole table.")
+    parser.add_argument("--backend", choices=["numpy", "keras"], default="numpy", help="Inference backend.")
+    parser.add_argument("--config", default="CrimePredictorConfig.json", help="Model's architecture JSON file.")
+    parser.add_argument("--weights", default="CrimePredictorWeights.h5", help="Model's weights HDF5 file.")
+    args = parser.parse_args()
+
+    from batch_scoring import load_model
+    from feature_store import get_split, get_store
+    from registry import CatalogueRegistry
+
+    store = get_store(args.source, args.store)
+    X = store["X"] if args.split == "all" else get_split(store, args.split)[0]
+    registry = CatalogueRegistry.from_files()
+
+    Y_probs = score(load_model(args.backend, args.config, args.weights), X)
+    cohorts = cohort_probabilities(X, Y_probs, registry.layout, args.by, args.quantiles, registry)
+
+    if args.output:
+        cohorts.to_csv(args.output)
+    else:
+        columns = [("count", "")] + [column for column in cohorts.columns if column[-1] == args.crime]
+        print(cohorts[columns].to_string(float_format=lambda value: f"{value:.3%}"))
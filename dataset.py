@@ -0,0 +1,335 @@
+# Dataset Builder for the Crime Predictor
+
+"""
+Module Brief Description:
+Reusable and vectorized version of the dataset preparation of the CrimePredictionMX notebook. The output of
+sql_query.sql (dataset.csv) is read in bounded-memory chunks with only the needed columns, and each chunk is
+transformed with column operations into the 16 predictors and 19 labels the model expects:
+
+1. CrimeOverall is 1 when any of the household or personal crime columns is 1, and 2 otherwise. As in the notebook,
+   CrimeKidnapping is not part of that condition.
+2. MunicipalityUniqueID is float(str(State) + "." + str(Municipality)), computed once per distinct pair.
+3. The labels are mapped with {0: 0, 1: 1, 2: 0, 3: 0, 9: 0}; any other code becomes missing.
+4. The predictors are ordered as in the training matrix (see encoding.py).
+
+Usage:
+python dataset.py dataset.csv prepared.parquet --chunksize 200000    # Builds the prepared dataset
+python dataset.py dataset.csv --verify --rows 20000                  # Compares against the notebook's code
+"""
+
+# Libraries importation
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+from catalogues import label_columns
+from registry import model_keys, municipality_ids
+
+# Predictors in the order of the training matrix
+feature_columns = ["HousingClass",
+                   "Kinship",
+                   "Education",
+                   "Activity",
+                   "Job",
+                   "Sex",
+                   "MetroArea",
+                   "Month",
+                   "State",
+                   "MunicipalityUniqueID",
+                   "Hour",
+                   "Place",
+                   "Category",
+                   "SocialClass",
+                   "PeopleHousehold",
+                   "Age"]
+
+# Crime columns retrieved by sql_query.sql
+crime_columns = label_columns[:-1]
+
+# Crime columns whose victimization sets CrimeOverall (CrimeKidnapping is left out, as in the notebook)
+overall_columns = [column for column in crime_columns if column != "CrimeKidnapping"]
+
+# Columns of dataset.csv needed to build the predictors and labels
+source_columns = [column for column in feature_columns if column != "MunicipalityUniqueID"] + \
+                 ["Municipality"] + crime_columns
+
+# Mapping of the survey answers into binary labels
+labels_dict = {0: 0,
+               1: 1,
+               2: 0,
+               3: 0,
+               9: 0}
+
+
+# Function to compute the municipality unique IDs
+def get_municipality_unique_ids(states, municipalities):
+    """
+    Function to compute float(str(State) + "." + str(Municipality)) for whole columns, once per distinct pair.
+
+    :parameter:
+    states (Array-like): State codes.
+    municipalities (Array-like): Municipality codes within the state.
+
+    :returns:
+    unique_ids (Numpy array): Municipality unique IDs as in the training matrix.
+    """
+
+    ids = municipality_ids(states, municipalities)
+    uniques, inverse = np.unique(ids, return_inverse=True)
+
+    return np.asarray(model_keys(uniques), dtype=np.float64)[inverse.reshape(-1)]
+
+
+# Function to map the survey answers into binary labels
+def map_labels(values):
+    """
+    Function to map a column of survey answers into binary labels with a lookup table.
+
+    :parameter:
+    values (Array-like): Survey answers (codes 0, 1, 2, 3 or 9; missing values are allowed).
+
+    :returns:
+    labels (Numpy array): Binary labels, with NaN for missing values and unknown codes.
+    """
+
+    values = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=np.float64)
+
+    table = np.full(max(labels_dict) + 1, np.nan)
+    for code, label in labels_dict.items():
+        table[code] = label
+
+    codes = np.where(np.isfinite(values), values, -1)
+    valid = (codes >= 0) & (codes < len(table)) & (codes == np.floor(codes))
+
+    return np.where(valid, table[np.where(valid, codes, 0).astype(np.int64)], np.nan)
+
+
+# Function to prepare a chunk of the dataset
+def prepare_chunk(chunk):
+    """
+    Function to transform a chunk of the output of sql_query.sql into the predictors and labels of the model.
+
+    :parameter:
+    chunk (Pandas dataframe): Chunk of dataset.csv with at least the source columns.
+
+    :returns:
+    prepared (Pandas dataframe): Chunk with the 16 predictors followed by the 19 labels.
+    """
+
+    prepared = {}
+    for column in feature_columns:
+        if column == "MunicipalityUniqueID":
+            prepared[column] = get_municipality_unique_ids(chunk["State"], chunk["Municipality"])
+        else:
+            prepared[column] = chunk[column].to_numpy()
+
+    for column in crime_columns:
+        prepared[column] = map_labels(chunk[column])
+
+    any_crime = (chunk[overall_columns].to_numpy(dtype=np.float64) == 1).any(axis=1)
+    prepared["CrimeOverall"] = np.where(any_crime, 1.0, 0.0)
+
+    return pd.DataFrame(prepared, index=chunk.index)
+
+
+# Function to stream the prepared dataset
+def read_dataset(path="dataset.csv", chunksize=200000):
+    """
+    Function to read the output of sql_query.sql in chunks and prepare each of them.
+
+    :parameter:
+    path (String): Path to the CSV file (or Parquet file) with the output of sql_query.sql.
+    chunksize (Integer): Number of rows per chunk.
+
+    :returns:
+    chunks (Generator): Generator of prepared Pandas dataframes.
+    """
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=source_columns):
+            yield prepare_chunk(batch.to_pandas())
+    else:
+        for chunk in pd.read_csv(path, usecols=source_columns, chunksize=chunksize):
+            yield prepare_chunk(chunk)
+
+
+# Function to load the whole prepared dataset
+def load_dataset(path="dataset.csv", chunksize=200000):
+    """
+    Function to build the predictors and labels of the model from the output of sql_query.sql.
+
+    :parameter:
+    path (String): Path to the CSV or Parquet file with the output of sql_query.sql (or with an already prepared
+    dataset).
+    chunksize (Integer): Number of rows per chunk.
+
+    :returns:
+    X (Pandas dataframe): Predictors in the order of the training matrix.
+    Y (Pandas dataframe): Labels.
+    """
+
+    prepared = pd.concat(read_dataset(path, chunksize), ignore_index=True)
+
+    return prepared[feature_columns], prepared[label_columns]
+
+
+# Function to build the prepared dataset file
+def build_dataset(input_path, output_path, chunksize=200000, verbose=True):
+    """
+    Function to stream the output of sql_query.sql through the preparation and write it incrementally.
+
+    :parameter:
+    input_path (String): Path to the CSV or Parquet file with the output of sql_query.sql.
+    output_path (String): Path to the CSV or Parquet file for the prepared dataset.
+    chunksize (Integer): Number of rows per chunk.
+    verbose (Boolean): Whether to report the progress on stderr.
+
+    :returns:
+    stats (Python dict): Number of rows and elapsed seconds.
+    """
+
+    from batch_scoring import ChunkWriter
+
+    start = time.perf_counter()
+    n_rows = 0
+    writer = ChunkWriter(output_path)
+    try:
+        for chunk in read_dataset(input_path, chunksize):
+            writer.write(chunk)
+            n_rows += len(chunk)
+            if verbose:
+                print(f"{n_rows:,} rows prepared in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    finally:
+        writer.close()
+
+    return {"rows": n_rows, "seconds": time.perf_counter() - start}
+
+
+# Function replicating the notebook's preparation
+def notebook_reference(df):
+    """
+    Function with the row-by-row preparation of the CrimePredictionMX notebook, kept as the reference for verify.
+
+    :parameter:
+    df (Pandas dataframe): Output of sql_query.sql.
+
+    :returns:
+    X (Pandas dataframe): Predictors in the order of the training matrix.
+    Y (Pandas dataframe): Labels.
+    """
+
+    dataset = df[source_columns].reset_index(drop=True)
+
+    CrimeOverall_list = []
+    for index in range(0, len(dataset)):
+        if any(dataset[column][index] == 1 for column in overall_columns):
+            CrimeOverall_list.append(1)
+        else:
+            CrimeOverall_list.append(2)
+    dataset['CrimeOverall'] = pd.Series(CrimeOverall_list, dtype='Int64')
+
+    dataset["MunicipalityUniqueID"] = dataset["State"].astype(str) + "." + dataset["Municipality"].astype(str)
+    dataset["MunicipalityUniqueID"] = dataset["MunicipalityUniqueID"].astype("Float64")
+    dataset = dataset.drop(columns="Municipality")
+
+    for attribute in label_columns:
+        dataset[attribute] = dataset[attribute].map(labels_dict)
+
+    return dataset[feature_columns], dataset[label_columns]
+
+
+# Function to draw a synthetic sample of the output of sql_query.sql
+def sample_source(n_rows=10000, seed=0):
+    """
+    Function to draw a synthetic output of sql_query.sql with the codes found in the ENVIPE tables, including missing
+    and unexpected answers.
+
+    :parameter:
+    n_rows (Integer): Number of rows.
+    seed (Integer): Seed of the random number generator.
+
+    :returns:
+    df (Pandas dataframe): Synthetic output of sql_query.sql.
+    """
+
+    from catalogues import field_dicts
+
+    rng = np.random.default_rng(seed)
+    catalogue = pd.read_csv("MunicipalitiesCatalogue.csv", usecols=["CVE_ENT", "CVE_MUN"])
+    places = catalogue.sample(n_rows, replace=True, random_state=seed)
+
+    fields = {"HousingClass": "housing_class", "Kinship": "kinship", "Education": "education",
+              "Activity": "activity", "Job": "job", "Sex": "sex", "MetroArea": "metro_area", "Month": "month",
+              "Hour": "hour", "Place": "place", "Category": "category", "SocialClass": "social_class"}
+    df = pd.DataFrame({column: rng.choice(list(field_dicts[field]), n_rows) for column, field in fields.items()})
+    df["State"] = places["CVE_ENT"].to_numpy()
+    df["Municipality"] = places["CVE_MUN"].to_numpy()
+    df["PeopleHousehold"] = rng.integers(1, 20, n_rows)
+    df["Age"] = rng.integers(15, 99, n_rows)
+    for column in crime_columns:
+        answers = rng.choice([1, 2, 3, 9, 0, 5, np.nan], n_rows, p=[0.05, 0.8, 0.05, 0.04, 0.02, 0.02, 0.02])
+        df[column] = answers
+
+    return df
+
+
+# Function to verify the vectorized preparation against the notebook's code
+def verify(path=None, n_rows=10000, chunksize=None):
+    """
+    Function to assert that the vectorized and chunked preparation gives the same predictors and labels as the
+    notebook's row-by-row code, on the first rows of a file or on a synthetic sample.
+
+    :parameter:
+    path (String): Path to the CSV file with the output of sql_query.sql (a synthetic sample is used if None).
+    n_rows (Integer): Number of rows to compare.
+    chunksize (Integer): Number of rows per chunk of the vectorized preparation (a few chunks if None).
+
+    :returns:
+    seconds (Python dict): Elapsed seconds of the notebook's code and of the vectorized preparation.
+    """
+
+    df = sample_source(n_rows) if path is None else pd.read_csv(path, usecols=source_columns, nrows=n_rows)
+    chunksize = chunksize or max(1, len(df) // 3)
+
+    start = time.perf_counter()
+    X_reference, Y_reference = notebook_reference(df)
+    reference_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prepared = pd.concat([prepare_chunk(df.iloc[i:i + chunksize]) for i in range(0, len(df), chunksize)],
+                         ignore_index=True)
+    vectorized_seconds = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(prepared[feature_columns].astype(object).where(prepared[feature_columns].notna()),
+                                  X_reference.astype(object).where(X_reference.notna()),
+                                  check_dtype=False, check_exact=True)
+    pd.testing.assert_frame_equal(prepared[label_columns],
+                                  Y_reference.astype("Float64").astype(np.float64),
+                                  check_dtype=False, check_exact=True)
+
+    return {"reference": reference_seconds, "vectorized": vectorized_seconds}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Dataset builder of the crime predictor.")
+    parser.add_argument("input", nargs="?", default="dataset.csv", help="Output of sql_query.sql (CSV or Parquet).")
+    parser.add_argument("output", nargs="?", help="CSV or Parquet file for the prepared dataset.")
+    parser.add_argument("--chunksize", type=int, default=200000, help="Number of rows per chunk.")
+    parser.add_argument("--verify", action="store_true", help="Compare against the notebook's row-by-row code.")
+    parser.add_argument("--synthetic", action="store_true", help="Verify on a synthetic sample instead of the input.")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of rows to verify.")
+    parser.add_argument("--quiet", action="store_true", help="Do not report the progress.")
+    args = parser.parse_args()
+
+    if args.verify:
+        seconds = verify(None if args.synthetic else args.input, args.rows)
+        print(f"Vectorized preparation matches the notebook on {args.rows:,} rows "
+              f"({seconds['reference']:.2f} s -> {seconds['vectorized']:.3f} s).")
+    elif args.output:
+        stats = build_dataset(args.input, args.output, args.chunksize, verbose=not args.quiet)
+        print(f"Prepared {stats['rows']:,} rows in {stats['seconds']:.2f} s.")
+    else:
+        parser.error("an output file or --verify is required")
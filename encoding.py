@@ -0,0 +1,285 @@
+# Compiled Feature Layout for the Crime Predictor
+
+"""
+Module Brief Description:
+Precompiled replacement of the OneHotEncoder/ColumnTransformer pipeline used to craft the model's input array.
+The layout is built once from the serialized encoders and scalers states and maps an encoded profile (or a batch of
+profiles) straight to the active column indices and values of the 2383-wide input vector.
+
+The column order follows the training matrix of the CrimePredictionMX notebook (X_sc): its second ColumnTransformer puts
+the outputs of the MaxAbs scalers first, so the scaled number of persons in the household and age are the columns 0 and
+1, followed by the one-hot blocks in the order of Encoders.json.
+"""
+
+# Libraries importation
+import json
+import numpy as np
+import pandas as pd
+
+# Categorical predictors in the same order as the one-hot blocks of the training matrix
+categorical_fields = ["housing_class",
+                      "kinship",
+                      "education",
+                      "activity",
+                      "job",
+                      "sex",
+                      "metro_area",
+                      "month",
+                      "state",
+                      "municipality",
+                      "hour",
+                      "place",
+                      "category",
+                      "social_class"]
+
+# Numerical predictors and their corresponding keys in Scalers.json, in the order of the first columns
+numerical_fields = {"people_household": "people_housing",
+                    "age": "age"}
+
+# Version of the column order, part of the keys of the artifacts built from a layout
+layout_version = 2
+
+
+# Function to normalize a category value
+def normalize_value(value):
+    """
+    Function to cast a category value into a canonical form, so that 1, 1.0, "1" and "1.0" are looked up alike.
+
+    :parameter:
+    value (Number or String): Encoded value of a predictor.
+
+    :returns:
+    normalized_value (Float or String): Canonical value, or None if the value is missing.
+    """
+
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return value
+    if np.isnan(value):
+        return None
+    return value
+
+
+# Class to encode profiles into the model's input array
+class FeatureLayout:
+    """
+    Class holding the column offset of every category of the model's input array.
+
+    :attributes:
+    categories (Python dict): Ordered categories for each categorical predictor.
+    scalers (Python dict): Maximum value for each numerical predictor.
+    offsets (Python dict): Column of the first category (or of the value) of each predictor.
+    n_features (Integer): Width of the input array.
+    """
+
+    def __init__(self, encoders, scalers):
+        """
+        :parameter:
+        encoders (Python dict): Dictionary with the ordered categories arrays for each predictor (Encoders.json).
+        scalers (Python dict): Dictionary with the maximum values for each predictor (Scalers.json).
+        """
+
+        self.categories = {}
+        self.scalers = {}
+        self.offsets = {}
+        self._columns = {}
+        self._numeric_keys = {}
+
+        offset = 0
+        for field, scaler_key in numerical_fields.items():
+            self.scalers[field] = float(np.asarray(scalers[scaler_key]).reshape(-1)[0])
+            self.offsets[field] = offset
+            offset += 1
+
+        for field in categorical_fields:
+            categories = list(encoders[field][0])
+            self.categories[field] = categories
+            self.offsets[field] = offset
+            self._columns[field] = {normalize_value(category): offset + i for i, category in enumerate(categories)}
+
+            # Sorted numerical categories for vectorized lookups
+            numeric = sorted((k, v) for k, v in self._columns[field].items() if isinstance(k, float))
+            self._numeric_keys[field] = (np.array([k for k, _ in numeric], dtype=np.float64),
+                                         np.array([v for _, v in numeric], dtype=np.int64))
+            offset += len(categories)
+
+        self.n_features = offset
+
+    @classmethod
+    def from_files(cls, encoders_path="Encoders.json", scalers_path="Scalers.json"):
+        """
+        Function to build the layout from the serialized encoders states and scalers maximum values.
+
+        :parameter:
+        encoders_path (String): Path to the encoders states JSON file.
+        scalers_path (String): Path to the scalers maximum values JSON file.
+
+        :returns:
+        layout (FeatureLayout): Compiled feature layout.
+        """
+
+        with open(encoders_path, "r") as read_file:
+            encoders = json.load(read_file)
+        with open(scalers_path, "r") as read_file:
+            scalers = json.load(read_file)
+
+        return cls(encoders, scalers)
+
+    def column(self, field, value):
+        """
+        Function to return the input array column of a category of a categorical predictor.
+
+        :parameter:
+        field (String): Name of the categorical predictor.
+        value (Number or String): Encoded value of the predictor.
+
+        :returns:
+        column (Integer): Column index, or None if the value is not a known category.
+        """
+
+        return self._columns[field].get(normalize_value(value))
+
+    def active(self, profile):
+        """
+        Function to return the active columns of the input array for a single profile.
+        Unknown categories are ignored, as with handle_unknown="ignore" in the OneHotEncoder.
+
+        :parameter:
+        profile (Python dict): Encoded value of every predictor, keyed by predictor name.
+
+        :returns:
+        indices (Numpy array): Sorted indices of the non-zero columns.
+        values (Numpy array): Values of the non-zero columns.
+        """
+
+        indices = []
+        values = []
+        for field in numerical_fields:
+            value = float(profile[field]) / self.scalers[field]
+            if value != 0:
+                indices.append(self.offsets[field])
+                values.append(value)
+        for field in categorical_fields:
+            column = self.column(field, profile.get(field))
+            if column is not None:
+                indices.append(column)
+                values.append(1.0)
+
+        return np.array(indices, dtype=np.int64), np.array(values, dtype=np.float64)
+
+    def encode(self, profile, sparse=False):
+        """
+        Function to transform a single encoded profile into the input array for the model.
+
+        :parameter:
+        profile (Python dict): Encoded value of every predictor, keyed by predictor name.
+        sparse (Boolean): Whether to return a CSR matrix instead of a dense array.
+
+        :returns:
+        input_array (Numpy array or CSR matrix): Input array of shape (1, n_features).
+        """
+
+        indices, values = self.active(profile)
+
+        if sparse:
+            from scipy.sparse import csr_matrix
+            return csr_matrix((values, indices, np.array([0, len(indices)])), shape=(1, self.n_features))
+
+        input_array = np.zeros((1, self.n_features), dtype=np.float64)
+        input_array[0, indices] = values
+
+        return input_array
+
+    def columns(self, field, values):
+        """
+        Function to map a whole column of encoded values of a categorical predictor to input array columns.
+
+        :parameter:
+        field (String): Name of the categorical predictor.
+        values (Array-like): Encoded values of the predictor.
+
+        :returns:
+        columns (Numpy array): Column index for each value, with -1 for unknown categories.
+        """
+
+        values = np.asarray(values)
+
+        if values.dtype.kind in "iuf":
+            keys, columns = self._numeric_keys[field]
+            values = values.astype(np.float64, copy=False)
+            if len(keys) == 0:
+                return np.full(len(values), -1, dtype=np.int64)
+            position = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+            return np.where(keys[position] == values, columns[position], -1)
+
+        # Mixed or string values are looked up once per distinct value
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        lookup = self._columns[field]
+        mapped = np.array([lookup.get(normalize_value(unique), -1) for unique in uniques] + [-1], dtype=np.int64)
+
+        return mapped[codes]
+
+    def active_batch(self, profiles):
+        """
+        Function to return the active columns of the input array for a batch of profiles.
+
+        :parameter:
+        profiles (Pandas dataframe or Python dict): Encoded values of every predictor, keyed by predictor name.
+
+        :returns:
+        indices (Numpy array): Matrix of shape (n_rows, 16) with the column of each predictor, -1 when inactive.
+        values (Numpy array): Matrix of shape (n_rows, 16) with the value of each predictor.
+        """
+
+        n_rows = len(profiles[categorical_fields[0]])
+        n_fields = len(numerical_fields) + len(categorical_fields)
+
+        indices = np.empty((n_rows, n_fields), dtype=np.int64)
+        values = np.ones((n_rows, n_fields), dtype=np.float64)
+
+        for i, field in enumerate(numerical_fields):
+            values[:, i] = np.asarray(profiles[field], dtype=np.float64) / self.scalers[field]
+            indices[:, i] = np.where(values[:, i] != 0, self.offsets[field], -1)
+
+        for i, field in enumerate(categorical_fields, start=len(numerical_fields)):
+            indices[:, i] = self.columns(field, profiles[field])
+
+        return indices, values
+
+    def encode_batch(self, profiles, sparse=True, dtype=np.float64):
+        """
+        Function to transform a batch of encoded profiles into the input matrix for the model.
+
+        :parameter:
+        profiles (Pandas dataframe or Python dict): Encoded values of every predictor, keyed by predictor name.
+        sparse (Boolean): Whether to return a CSR matrix instead of a dense array.
+        dtype (Numpy dtype): Data type of the input matrix.
+
+        :returns:
+        input_matrix (CSR matrix or Numpy array): Input matrix of shape (n_rows, n_features).
+        """
+
+        indices, values = self.active_batch(profiles)
+        n_rows = indices.shape[0]
+        mask = indices >= 0
+
+        if sparse:
+            from scipy.sparse import csr_matrix
+            indptr = np.zeros(n_rows + 1, dtype=np.int64)
+            np.cumsum(mask.sum(axis=1), out=indptr[1:])
+            return csr_matrix((values[mask].astype(dtype, copy=False), indices[mask], indptr),
+                              shape=(n_rows, self.n_features))
+
+        input_matrix = np.zeros((n_rows, self.n_features), dtype=dtype)
+        rows = np.nonzero(mask)[0]
+        input_matrix[rows, indices[mask]] = values[mask]
+
+        return input_matrix
@@ -0,0 +1,288 @@
+# What-If Explanations of the Crime Predictor
+
+"""
+Module Brief Description:
+Explanations of a prediction of the crime predictor, i.e., which inputs of a profile drive its crime probabilities.
+For each of the 14 categorical predictors and the two numerical ones (age and number of persons in the household), every
+alternative value is put into the profile, all the variants are scored as a single batch, and the marginal effect of the
+predictor on each of the 19 crimes is the probability of the profile minus the mean probability of its alternatives.
+
+A variant differs from the profile in a single predictor, so its first-layer pre-activation is that of the profile plus
+the kernel row of the new column minus the one of the replaced column. The pre-activation of the profile is computed
+once and shared by all the variants, and only the remaining layers run for the whole batch.
+
+The sensitivity curves of a profile (its probabilities as age, the number of persons in the household and the hour of
+the day sweep their whole ranges, with the other inputs held) are scored in the same way, and can be cached per profile.
+
+Usage:
+python explain.py --profile profile.json --crime Overall    # Profile with the human labels of the app's select boxes
+python explain.py --profile profile.json --sensitivity      # Sensitivity curves of the profile
+"""
+
+# Libraries importation
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from catalogues import crime_labels, default_labels
+from encoding import categorical_fields, numerical_fields
+
+# Display names of the predictors, as in the app's select boxes
+field_labels = {"housing_class": "Housing Type",
+                "kinship": "Kinship",
+                "education": "Education Level",
+                "activity": "Employment Status",
+                "job": "Job Position",
+                "sex": "Gender",
+                "metro_area": "Metropolitan Area",
+                "month": "Month",
+                "state": "State",
+                "municipality": "Municipality",
+                "hour": "Hour of the Day",
+                "place": "Place",
+                "category": "Type of Populated Area",
+                "social_class": "Social Class",
+                "people_household": "Persons in the Household",
+                "age": "Age"}
+
+# Alternative values of the numerical predictors, as offered by the app
+numerical_values = {"people_household": range(1, 31),
+                    "age": range(15, 100)}
+
+# Predictors swept by the sensitivity curves
+sweep_fields = ["age", "people_household", "hour"]
+
+
+# Function to build the variants of a profile
+def get_variants(layout, input_array, fields=None, values=numerical_values, registry=None):
+    """
+    Function to build every single-predictor variant of a profile, as the changes of its input array.
+
+    :parameter:
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    input_array (Numpy array or CSR matrix): Input array of the profile, of shape (1, n_features).
+    fields (List): Predictors to vary (all of them if None).
+    values (Python dict): Alternative values of the numerical predictors.
+    registry (CatalogueRegistry): Catalogue registry, used for the municipality labels (codes are kept if None).
+
+    :returns:
+    variants (Pandas dataframe): Predictor, label and whether it is the current value, for each variant.
+    changes (CSR matrix): Change of the input array of each variant, of shape (n_variants, n_features).
+    """
+
+    from scipy.sparse import csr_matrix, issparse
+    from cohorts import get_category_labels
+
+    x = np.asarray(input_array.toarray() if issparse(input_array) else input_array, dtype=np.float64).reshape(-1)
+    fields = list(categorical_fields) + list(numerical_fields) if fields is None else list(fields)
+
+    names, labels, current, rows, columns, data = [], [], [], [], [], []
+    for field in fields:
+        start = layout.offsets[field]
+
+        if field in numerical_fields:
+            old = x[start]
+            new = np.asarray(values[field], dtype=np.float64) / layout.scalers[field]
+            block_labels = list(values[field])
+            block_rows = np.arange(len(new)) + len(names)
+            rows.append(block_rows)
+            columns.append(np.full(len(new), start))
+            data.append(new - old)
+            is_current = np.isclose(new, old)
+        else:
+            categories = np.arange(len(layout.categories[field]))
+            active = np.flatnonzero(x[start:start + len(categories)])
+            old = active[0] if len(active) else None
+
+            # Municipalities are only varied within the state of the profile
+            if field == "municipality":
+                state = np.flatnonzero(x[layout.offsets["state"]:layout.offsets["state"] +
+                                         len(layout.categories["state"])])
+                if len(state):
+                    state_code = int(float(layout.categories["state"][state[0]]))
+                    keys = np.asarray(layout.categories[field], dtype=np.float64)
+                    categories = categories[np.floor(keys).astype(np.int64) == state_code]
+
+            block_labels = get_category_labels(layout, field, registry, categories)
+
+            block_rows = np.arange(len(categories)) + len(names)
+            rows.append(block_rows)
+            columns.append(start + categories)
+            data.append(np.ones(len(categories)))
+            if old is not None:
+                rows.append(block_rows)
+                columns.append(np.full(len(categories), start + old))
+                data.append(-np.ones(len(categories)))
+            is_current = categories == old
+
+        names.extend([field] * len(block_rows))
+        labels.extend(block_labels)
+        current.extend(is_current)
+
+    changes = csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(columns))),
+                         shape=(len(names), layout.n_features), dtype=np.float32)
+    changes.eliminate_zeros()
+    variants = pd.DataFrame({"field": names, "value": labels, "current": current})
+
+    return variants, changes
+
+
+# Function to score the variants of a profile
+def score_variants(model, input_array, changes):
+    """
+    Function to predict the probabilities of the profile and of all its variants in a single batch. With the NumPy
+    engines, the first-layer pre-activation of the profile is shared by the variants, which only add the kernel rows
+    of their changes.
+
+    :parameter:
+    model (NumpyModel, QuantizedModel or Keras object): Trained model.
+    input_array (Numpy array or CSR matrix): Input array of the profile, of shape (1, n_features).
+    changes (CSR matrix): Change of the input array of each variant.
+
+    :returns:
+    y (Numpy array): Probabilities of the profile, of shape (19,).
+    Y (Numpy array): Probabilities of the variants, of shape (n_variants, 19).
+    """
+
+    from scipy.sparse import csr_matrix, issparse, vstack
+    from batch_scoring import predict
+
+    x = csr_matrix(input_array, dtype=np.float32) if not issparse(input_array) else input_array.tocsr()
+
+    if hasattr(model, "first_layer"):
+        z = model.first_layer(x)
+        Z = model.first_layer(changes) - model.biases[0]
+        Z += z
+        Y = model.forward(np.vstack([z, Z]))
+    else:
+        X = changes + x[np.zeros(changes.shape[0], dtype=np.int64)]
+        X.eliminate_zeros()
+        Y = predict(model, vstack([x, X]).tocsr())
+
+    Y = np.asarray(Y)
+
+    return Y[0], Y[1:]
+
+
+# Function to explain a prediction
+def explain(model, layout, input_array, fields=None, values=numerical_values, registry=None):
+    """
+    Function to compute the marginal effect of each predictor of a profile on each crime probability.
+
+    :parameter:
+    model (NumpyModel, QuantizedModel or Keras object): Trained model.
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    input_array (Numpy array or CSR matrix): Input array of the profile, of shape (1, n_features).
+    fields (List): Predictors to vary (all of them if None).
+    values (Python dict): Alternative values of the numerical predictors.
+    registry (CatalogueRegistry): Catalogue registry, used for the municipality labels.
+
+    :returns:
+    effects (Pandas dataframe): Probability of the profile minus the mean probability of the alternatives, with one
+    row per predictor and one column per crime.
+    variants (Pandas dataframe): Predictor, label, whether it is the current value, and the 19 probabilities of each
+    variant.
+    """
+
+    variants, changes = get_variants(layout, input_array, fields, values, registry)
+    y, Y = score_variants(model, input_array, changes)
+
+    probabilities = pd.DataFrame(Y, columns=crime_labels, index=variants.index)
+    alternatives = probabilities[~variants["current"].to_numpy()]
+    means = alternatives.groupby(variants.loc[alternatives.index, "field"].to_numpy(), sort=False).mean()
+
+    effects = pd.DataFrame(y - means.to_numpy(), index=means.index, columns=crime_labels)
+    effects = effects.reindex([field for field in dict.fromkeys(variants["field"]) if field in effects.index])
+    effects.index.name = "field"
+
+    return effects, pd.concat([variants, probabilities], axis=1)
+
+
+# Function to compute the sensitivity curves of a profile
+def sensitivity(model, layout, input_array, fields=sweep_fields, values=numerical_values, cache=None, version=None):
+    """
+    Function to compute how each crime probability changes as some predictors sweep all their values, with the other
+    inputs held at those of the profile. The sweeps of all the predictors are scored as a single batch.
+
+    :parameter:
+    model (NumpyModel, QuantizedModel or Keras object): Trained model.
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    input_array (Numpy array or CSR matrix): Input array of the profile, of shape (1, n_features).
+    fields (List): Predictors to sweep.
+    values (Python dict): Values of the numerical predictors.
+    cache (PredictionCache): Cache of the curves keyed by the encoded profile (see prediction_cache.py), if any.
+    version (String): Version of the model, which is part of the cache keys.
+
+    :returns:
+    curves (Pandas dataframe): Predictor, value, whether it is the value of the profile, and the 19 probabilities of
+    each point of the curves.
+    """
+
+    from scipy.sparse import issparse
+    from prediction_cache import profile_key
+
+    variants, changes = get_variants(layout, input_array, fields, values)
+
+    key = None
+    Y = None
+    if cache is not None:
+        key = ("sensitivity", version, tuple(fields)) + profile_key(input_array.toarray() if issparse(input_array)
+                                                          else input_array)
+        Y = cache.get(key)
+
+    if Y is None:
+        _, Y = score_variants(model, input_array, changes)
+        if cache is not None:
+            cache.put(key, Y)
+
+    probabilities = pd.DataFrame(np.asarray(Y).reshape(len(variants), -1), columns=crime_labels,
+                                 index=variants.index)
+
+    return pd.concat([variants, probabilities], axis=1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="What-if explanations of a prediction of the crime predictor.")
+    parser.add_argument("--profile", required=True, help="JSON file with the human labels of a profile.")
+    parser.add_argument("--crime", default="Overall", help="Crime whose effects are displayed.")
+    parser.add_argument("--sensitivity", action="store_true", help="Report the sensitivity curves instead.")
+    parser.add_argument("--backend", choices=["numpy", "keras", "float16", "int8"], default="numpy",
+                        help="Inference backend.")
+    parser.add_argument("--config", default="CrimePredictorConfig.json", help="Model's architecture JSON file.")
+    parser.add_argument("--weights", default="CrimePredictorWeights.h5", help="Model's weights HDF5 file.")
+    args = parser.parse_args()
+
+    from registry import CatalogueRegistry
+
+    registry = CatalogueRegistry.from_files()
+    with open(args.profile) as file:
+        labels = json.load(file)
+    labels = {**default_labels, **labels}
+
+    if args.backend in ("float16", "int8"):
+        from inference import QuantizedModel
+        model = QuantizedModel.from_file(f"CrimePredictorWeights.{args.backend}.npz")
+    else:
+        from batch_scoring import load_model
+        model = load_model(args.backend, args.config, args.weights)
+
+    start = time.perf_counter()
+    input_array = registry.layout.encode(registry.profile(labels), sparse=True)
+
+    if args.sensitivity:
+        curves = sensitivity(model, registry.layout, input_array)
+        seconds = time.perf_counter() - start
+        for field in sweep_fields:
+            curve = curves[curves["field"] == field].set_index("value").iloc[:, crime_labels.index(args.crime) + 2]
+            print(f"{field_labels[field]}: " + ", ".join(f"{value} {probability:.1%}"
+                                                          for value, probability in curve.items()))
+        print(f"{len(curves):,} points computed in {seconds:.3f} s.")
+    else:
+        effects, variants = explain(model, registry.layout, input_array, registry=registry)
+        seconds = time.perf_counter() - start
+        column = crime_labels.index(args.crime)
+        ranking = effects.iloc[:, column].sort_values(key=np.abs, ascending=False)
+        print(ranking.rename(index=field_labels).to_string(float_format=lambda value: f"{value:+.2%}"))
+        print(f"{len(variants):,} variants explained in {seconds:.3f} s.")
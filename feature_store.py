@@ -0,0 +1,326 @@
+# Feature Store for Training the Crime Predictor
+
+"""
+Module Brief Description:
+On-disk cache of the training matrices, so that retraining or evaluating the model does not re-run the one-hot encoding
+and MaxAbs scaling of the whole dataset. The prepared dataset (see dataset.py) is encoded chunk by chunk with the
+compiled feature layout into the 2383-wide CSR matrix of the CrimePredictionMX notebook (X_sc): the two scaled numerical
+columns first and then the one-hot blocks. It is stored with the label matrix and the train/validation/test split indices
+as uncompressed .npy arrays, which are memory-mapped when opened. Rows with a missing label (a survey answer outside the
+mapping of dataset.py) are dropped and counted, instead of training on NaN targets.
+
+Each entry of the store is a directory named after the SHA-256 key of the source data, Encoders.json, Scalers.json, the
+version of the feature layout and the split settings, so any change of them builds a new entry instead of reusing a
+stale one. The split indices are also
+cached under splits/, keyed by the label matrix, so an entry rebuilt for new encoders or scalers keeps the same split.
+
+Usage:
+python feature_store.py build dataset.csv              # Builds (or reuses) the entry of dataset.csv
+python feature_store.py info dataset.csv               # Reports the entry of dataset.csv
+"""
+
+# Libraries importation
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from catalogues import label_columns
+from encoding import FeatureLayout, layout_version
+
+# Default directory of the store
+store_dir = "FeatureStore"
+
+# Version of the layout of the entries (part of their key)
+store_version = 2
+
+# Predictor of the encoded profiles for each column of the prepared dataset
+field_columns = {"housing_class": "HousingClass",
+                 "kinship": "Kinship",
+                 "education": "Education",
+                 "activity": "Activity",
+                 "job": "Job",
+                 "sex": "Sex",
+                 "metro_area": "MetroArea",
+                 "month": "Month",
+                 "state": "State",
+                 "municipality": "MunicipalityUniqueID",
+                 "hour": "Hour",
+                 "place": "Place",
+                 "category": "Category",
+                 "social_class": "SocialClass",
+                 "people_household": "PeopleHousehold",
+                 "age": "Age"}
+
+# Arrays of an entry
+array_names = ["data", "indices", "indptr", "Y", "train", "validation", "test"]
+
+
+# Function to compute the key of an entry
+def get_key(source_path, encoders_path="Encoders.json", scalers_path="Scalers.json", test_size=0.15,
+            validation_size=0.20, block_size=4 * 1024 * 1024, seed=0):
+    """
+    Function to compute the SHA-256 key of the source data, the encoders and scalers states, the versions of the store
+    and of the feature layout, and the split settings.
+
+    :parameter:
+    source_path (String): Path to the output of sql_query.sql (CSV or Parquet).
+    encoders_path (String): Path to the encoders states JSON file.
+    scalers_path (String): Path to the scalers maximum values JSON file.
+    test_size (Float): Fraction of the rows for testing.
+    validation_size (Float): Fraction of the training rows for validation.
+    block_size (Integer): Number of bytes read at a time.
+    seed (Integer): Seed of the split.
+
+    :returns:
+    key (String): Hexadecimal digest.
+    """
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"version": store_version, "layout_version": layout_version, "test_size": test_size,
+                              "validation_size": validation_size, "seed": seed}).encode("utf8"))
+    for path in (source_path, encoders_path, scalers_path):
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(block_size), b""):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+
+# Function to split the rows into the training, validation and testing sets
+def split_indices(Y, test_size=0.15, validation_size=0.20, seed=0, directory=store_dir):
+    """
+    Function to split the rows with the second-order iterative stratification for multi-label data used in the
+    notebook (see stratification.py): first the testing set, and then the validation set out of the remaining rows.
+    Missing labels count as negative. The indices are cached per label matrix, so an entry rebuilt for new encoders
+    or scalers keeps the same split.
+
+    :parameter:
+    Y (Numpy array): Label matrix.
+    test_size (Float): Fraction of the rows for testing.
+    validation_size (Float): Fraction of the training rows for validation.
+    seed (Integer): Seed of the split.
+    directory (String): Directory of the store, where the indices are cached.
+
+    :returns:
+    train (Numpy array): Row indices of the training set.
+    validation (Numpy array): Row indices of the validation set.
+    test (Numpy array): Row indices of the testing set.
+    """
+
+    from stratification import get_split_indices
+
+    return get_split_indices(Y, test_size, validation_size, seed=seed, directory=os.path.join(directory, "splits"))
+
+
+# Function to encode the dataset into the training matrices
+def encode_dataset(source_path, layout, chunksize=200000):
+    """
+    Function to stream the dataset and encode each chunk into CSR arrays, so the dense matrix is never built. Rows with
+    a missing label are dropped.
+
+    :parameter:
+    source_path (String): Path to the output of sql_query.sql (CSV or Parquet).
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    chunksize (Integer): Number of rows per chunk.
+
+    :returns:
+    arrays (Python dict): CSR arrays ("data", "indices", "indptr") of the input matrix and label matrix ("Y").
+    dropped (Integer): Number of rows dropped for a missing label.
+    """
+
+    from dataset import read_dataset
+
+    data, indices, indptr, Y = [], [], [np.zeros(1, dtype=np.int64)], []
+    nnz = dropped = 0
+    for chunk in read_dataset(source_path, chunksize):
+        missing = chunk[label_columns].isna().any(axis=1).to_numpy()
+        if missing.any():
+            dropped += int(missing.sum())
+            chunk = chunk[~missing]
+        profiles = {field: chunk[column].to_numpy() for field, column in field_columns.items()}
+        X = layout.encode_batch(profiles, sparse=True, dtype=np.float32)
+        data.append(X.data)
+        indices.append(X.indices)
+        indptr.append(X.indptr[1:].astype(np.int64) + nnz)
+        Y.append(chunk[label_columns].to_numpy(dtype=np.float32))
+        nnz += X.nnz
+
+    # Indices and pointers share the same integer type, so scipy memory-maps them without converting them
+    index_dtype = np.int32 if nnz < np.iinfo(np.int32).max else np.int64
+
+    return {"data": np.concatenate(data),
+            "indices": np.concatenate(indices).astype(index_dtype, copy=False),
+            "indptr": np.concatenate(indptr).astype(index_dtype, copy=False),
+            "Y": np.concatenate(Y) if Y else np.empty((0, len(label_columns)), dtype=np.float32)}, dropped
+
+
+# Function to build an entry of the store
+def build_store(source_path="dataset.csv", directory=store_dir, encoders_path="Encoders.json",
+                scalers_path="Scalers.json", test_size=0.15, validation_size=0.20, chunksize=200000, force=False,
+                seed=0):
+    """
+    Function to build the entry of a dataset, unless it already exists. The entry is written into a temporary
+    directory that is renamed once complete.
+
+    :parameter:
+    source_path (String): Path to the output of sql_query.sql (CSV or Parquet).
+    directory (String): Directory of the store.
+    encoders_path (String): Path to the encoders states JSON file.
+    scalers_path (String): Path to the scalers maximum values JSON file.
+    test_size (Float): Fraction of the rows for testing.
+    validation_size (Float): Fraction of the training rows for validation.
+    chunksize (Integer): Number of rows per chunk.
+    force (Boolean): Whether to rebuild the entry even if it exists.
+    seed (Integer): Seed of the split.
+
+    :returns:
+    path (String): Path to the entry.
+    """
+
+    key = get_key(source_path, encoders_path, scalers_path, test_size, validation_size, seed=seed)
+    path = os.path.join(directory, key)
+    if os.path.exists(os.path.join(path, "meta.json")) and not force:
+        return path
+
+    start = time.perf_counter()
+    layout = FeatureLayout.from_files(encoders_path, scalers_path)
+    arrays, dropped = encode_dataset(source_path, layout, chunksize)
+    if dropped:
+        print(f"{dropped:,} rows with a missing label dropped from {source_path}.", file=sys.stderr)
+    arrays["train"], arrays["validation"], arrays["test"] = split_indices(arrays["Y"], test_size, validation_size, seed,
+                                                                         directory)
+
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name in array_names:
+        np.save(os.path.join(tmp_path, name + ".npy"), arrays[name])
+
+    meta = {"key": key,
+            "version": store_version,
+            "layout_version": layout_version,
+            "source": os.path.abspath(source_path),
+            "shape": [len(arrays["indptr"]) - 1, layout.n_features],
+            "nnz": int(len(arrays["data"])),
+            "dropped": dropped,
+            "labels": label_columns,
+            "sizes": {name: int(len(arrays[name])) for name in ("train", "validation", "test")},
+            "test_size": test_size,
+            "validation_size": validation_size,
+            "seed": seed,
+            "seconds": time.perf_counter() - start}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+        json.dump(meta, file, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+# Function to open an entry of the store
+def open_store(path):
+    """
+    Function to open an entry of the store with its arrays memory-mapped, so it starts without reading them.
+
+    :parameter:
+    path (String): Path to the entry.
+
+    :returns:
+    store (Python dict): Input matrix ("X", CSR matrix), label matrix ("Y"), split indices ("train", "validation",
+    "test") and metadata ("meta").
+    """
+
+    from scipy.sparse import csr_matrix
+
+    with open(os.path.join(path, "meta.json")) as file:
+        meta = json.load(file)
+
+    arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in array_names}
+
+    return {"X": csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(meta["shape"])),
+            "Y": arrays["Y"],
+            "train": arrays["train"],
+            "validation": arrays["validation"],
+            "test": arrays["test"],
+            "meta": meta}
+
+
+# Function to retrieve the training matrices of a dataset
+def get_store(source_path="dataset.csv", directory=store_dir, encoders_path="Encoders.json",
+              scalers_path="Scalers.json", test_size=0.15, validation_size=0.20, chunksize=200000, seed=0):
+    """
+    Function to open the entry of a dataset, building it first if it does not exist.
+
+    :parameter:
+    source_path (String): Path to the output of sql_query.sql (CSV or Parquet).
+    directory (String): Directory of the store.
+    encoders_path (String): Path to the encoders states JSON file.
+    scalers_path (String): Path to the scalers maximum values JSON file.
+    test_size (Float): Fraction of the rows for testing.
+    validation_size (Float): Fraction of the training rows for validation.
+    chunksize (Integer): Number of rows per chunk.
+    seed (Integer): Seed of the split.
+
+    :returns:
+    store (Python dict): Input matrix, label matrix, split indices and metadata (see open_store).
+    """
+
+    return open_store(build_store(source_path, directory, encoders_path, scalers_path, test_size, validation_size,
+                                  chunksize, seed=seed))
+
+
+# Function to select the rows of a split
+def get_split(store, name):
+    """
+    Function to return the input and label matrices of the training, validation or testing set.
+
+    :parameter:
+    store (Python dict): Opened entry of the store.
+    name (String): "train", "validation" or "test".
+
+    :returns:
+    X (CSR matrix): Input matrix of the split.
+    Y (Numpy array): Label matrix of the split.
+    """
+
+    rows = np.asarray(store[name])
+
+    return store["X"][rows], np.asarray(store["Y"][rows])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Feature store of the crime predictor's training matrices.")
+    parser.add_argument("command", choices=["build", "info"], help="Build the entry of a dataset or report it.")
+    parser.add_argument("source", nargs="?", default="dataset.csv", help="Output of sql_query.sql (CSV or Parquet).")
+    parser.add_argument("--directory", default=store_dir, help="Directory of the store.")
+    parser.add_argument("--test-size", type=float, default=0.15, help="Fraction of the rows for testing.")
+    parser.add_argument("--validation-size", type=float, default=0.20,
+                        help="Fraction of the training rows for validation.")
+    parser.add_argument("--chunksize", type=int, default=200000, help="Number of rows per chunk.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the split.")
+    parser.add_argument("--force", action="store_true", help="Rebuild the entry even if it exists.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        path = build_store(args.source, args.directory, test_size=args.test_size,
+                           validation_size=args.validation_size, chunksize=args.chunksize, force=args.force,
+                           seed=args.seed)
+        print(f"Entry {path} ready in {time.perf_counter() - start:.2f} s.")
+    else:
+        key = get_key(args.source, test_size=args.test_size, validation_size=args.validation_size, seed=args.seed)
+        path = os.path.join(args.directory, key)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            print(f"No entry for {args.source} (key {key}).", file=sys.stderr)
+            sys.exit(1)
+        start = time.perf_counter()
+        store = open_store(path)
+        meta = store["meta"]
+        print(f"Entry {path}: {meta['shape'][0]:,} x {meta['shape'][1]:,} with {meta['nnz']:,} non-zeros, "
+              f"splits {meta['sizes']}, {meta['dropped']:,} rows dropped, opened in {time.perf_counter() - start:.3f} s.")
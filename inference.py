@@ -0,0 +1,561 @@
+# NumPy Inference Engine for the Crime Predictor
+
+"""
+Module Brief Description:
+TensorFlow-free inference engine for the multi-layer perceptron serialized in CrimePredictorConfig.json and
+CrimePredictorWeights.h5. As the input array is a one-hot vector with only about 16 non-zero entries, the first Dense
+layer is computed as a gather-and-sum of the kernel rows of the active columns plus the bias, rather than as a dense
+2383x1201 matrix product. The remaining layers run as regular NumPy matrix products.
+
+Quantized float16 or per-channel int8 weights can be exported to a NPZ file and served with QuantizedModel, which
+runs the gather of the first layer directly on the quantized kernel. Their probabilities stay within an absolute
+difference of quantization_tolerances (1e-3 for float16 and 1e-2 for int8) of the float32 engine.
+
+Usage:
+python inference.py --check             # Compares the NumPy engine against the Keras model on random profiles
+python inference.py --quantize int8     # Exports CrimePredictorWeights.int8.npz and reports its accuracy
+"""
+
+# Libraries importation
+import argparse
+import json
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+
+# Activation functions of the Dense layers
+def relu(x):
+    """
+    Function to apply the ReLU activation function in place.
+
+    :parameter:
+    x (Numpy array): Pre-activation values.
+
+    :returns:
+    x (Numpy array): Activated values.
+    """
+
+    return np.maximum(x, 0, out=x)
+
+
+def sigmoid(x):
+    """
+    Function to apply the sigmoid activation function in place, in a numerically stable way.
+
+    :parameter:
+    x (Numpy array): Pre-activation values.
+
+    :returns:
+    x (Numpy array): Activated values.
+    """
+
+    np.negative(x, out=x)
+    np.logaddexp(0, x, out=x)
+    np.negative(x, out=x)
+    return np.exp(x, out=x)
+
+
+def linear(x):
+    """
+    Function to apply the linear (identity) activation function.
+
+    :parameter:
+    x (Numpy array): Pre-activation values.
+
+    :returns:
+    x (Numpy array): Same values.
+    """
+
+    return x
+
+
+activations = {"relu": relu,
+               "sigmoid": sigmoid,
+               "linear": linear}
+
+
+# Function to read the Dense layers from the model's architecture
+def read_architecture(config_path):
+    """
+    Function to retrieve the name, units and activation of the Dense layers of a Keras Sequential model.
+    Dropout layers are skipped, as they are inactive at inference time.
+
+    :parameter:
+    config_path (String): Path to the model's architecture JSON file.
+
+    :returns:
+    dense_layers (List): List of dictionaries with the name, units and activation of each Dense layer.
+    """
+
+    with open(config_path) as json_file:
+        config = json.load(json_file)
+
+    dense_layers = []
+    for layer in config["config"]["layers"]:
+        if layer["class_name"] == "Dense":
+            dense_layers.append({"name": layer["config"]["name"],
+                                 "units": layer["config"]["units"],
+                                 "activation": layer["config"]["activation"]})
+        elif layer["class_name"] not in ("InputLayer", "Dropout"):
+            raise ValueError(f"Unsupported layer for the NumPy engine: {layer['class_name']}")
+
+    return dense_layers
+
+
+# Function to read the weights from the serialized HDF5 file
+def read_weights(weights_path):
+    """
+    Function to retrieve the kernel and bias of every layer from a HDF5 file saved with Keras' save_weights.
+    Both the Keras 2 layout (layer_names/weight_names attributes) and the Keras 3 layout (layers/<name>/vars)
+    are supported.
+
+    :parameter:
+    weights_path (String): Path to the model's weights HDF5 file.
+
+    :returns:
+    weights (Python dict): Dictionary with the list of weight arrays of each layer, keyed by layer name.
+    """
+
+    import h5py
+
+    def decode(name):
+        return name.decode("utf8") if isinstance(name, bytes) else str(name)
+
+    weights = {}
+    with h5py.File(weights_path, "r") as file:
+        if "layer_names" not in file.attrs and "layers" in file:
+            for layer_name, layer_group in file["layers"].items():
+                variables = layer_group["vars"]
+                weights[layer_name] = [np.asarray(variables[key]) for key in sorted(variables, key=int)]
+            return weights
+
+        group = file["model_weights"] if "model_weights" in file else file
+        for layer_name in group.attrs["layer_names"]:
+            layer_name = decode(layer_name)
+            layer_group = group[layer_name]
+            weights[layer_name] = [np.asarray(layer_group[decode(weight_name)])
+                                   for weight_name in layer_group.attrs["weight_names"]]
+
+    return weights
+
+
+# Maximum absolute difference of the probabilities of the quantized engines from the float32 engine
+quantization_tolerances = {"float16": 1e-3, "int8": 1e-2}
+
+
+# Class to make predictions with NumPy only
+class NumpyModel:
+    """
+    Class replicating the predict method of the Keras model with NumPy only.
+
+    :attributes:
+    kernels (List): Kernel matrix of each Dense layer.
+    biases (List): Bias vector of each Dense layer.
+    activations (List): Name of the activation function of each Dense layer.
+    n_inputs (Integer): Width of the input array.
+    n_outputs (Integer): Number of output probabilities.
+    """
+
+    def __init__(self, kernels, biases, activation_names, dtype=np.float32):
+        """
+        :parameter:
+        kernels (List): Kernel matrix of each Dense layer, with shape (n_inputs, units).
+        biases (List): Bias vector of each Dense layer.
+        activation_names (List): Name of the activation function of each Dense layer.
+        dtype (Numpy dtype): Data type used for the computations.
+        """
+
+        self.dtype = dtype
+        self.kernels = [np.ascontiguousarray(kernel, dtype=dtype) for kernel in kernels]
+        self.biases = [np.asarray(bias, dtype=dtype) for bias in biases]
+        self.activations = list(activation_names)
+        self.n_inputs = self.kernels[0].shape[0]
+        self.n_outputs = self.kernels[-1].shape[1]
+
+    @classmethod
+    def from_files(cls, config_path="CrimePredictorConfig.json", weights_path="CrimePredictorWeights.h5"):
+        """
+        Function to load the engine from the same serialized files as the Keras model.
+
+        :parameter:
+        config_path (String): Path to the model's architecture JSON file.
+        weights_path (String): Path to the model's weights HDF5 file.
+
+        :returns:
+        model (NumpyModel): Engine ready for making predictions.
+        """
+
+        dense_layers = read_architecture(config_path)
+        weights = read_weights(weights_path)
+
+        kernels = [weights[layer["name"]][0] for layer in dense_layers]
+        biases = [weights[layer["name"]][1] for layer in dense_layers]
+        activation_names = [layer["activation"] for layer in dense_layers]
+
+        return cls(kernels, biases, activation_names)
+
+    def first_layer(self, X):
+        """
+        Function to compute the pre-activation of the first Dense layer as a gather-and-sum of the kernel rows
+        of the non-zero columns of the input.
+
+        :parameter:
+        X (CSR matrix): Input matrix of shape (n_rows, n_inputs).
+
+        :returns:
+        z (Numpy array): Pre-activation values of shape (n_rows, units).
+        """
+
+        z = np.asarray(X.astype(self.dtype, copy=False) @ self.kernels[0])
+        z += self.biases[0]
+
+        return z
+
+    def forward(self, z):
+        """
+        Function to run the network from the pre-activation of the first layer up to the output probabilities.
+
+        :parameter:
+        z (Numpy array): Pre-activation values of the first Dense layer.
+
+        :returns:
+        y (Numpy array): Output of the last layer.
+        """
+
+        x = activations[self.activations[0]](z)
+        for kernel, bias, activation in zip(self.kernels[1:], self.biases[1:], self.activations[1:]):
+            x = x @ kernel
+            x += bias
+            x = activations[activation](x)
+
+        return x
+
+    def predict_active(self, indices, values):
+        """
+        Function to predict the probabilities of a single profile from its active columns.
+
+        :parameter:
+        indices (Numpy array): Indices of the non-zero columns of the input array.
+        values (Numpy array): Values of the non-zero columns of the input array.
+
+        :returns:
+        y (Numpy array): Output probabilities of shape (1, n_outputs).
+        """
+
+        z = (np.asarray(values, dtype=self.dtype) @ self.kernels[0][indices]).reshape(1, -1)
+        z += self.biases[0]
+
+        return self.forward(z)
+
+    def predict(self, X, batch_size=4096, **kwargs):
+        """
+        Function to predict the probabilities for a batch of input arrays, in the same way as the Keras model.
+
+        :parameter:
+        X (Numpy array or sparse matrix): Input matrix of shape (n_rows, n_inputs).
+        batch_size (Integer): Number of rows computed at once, to bound the memory of the hidden layers.
+
+        :returns:
+        Y (Numpy array): Output probabilities of shape (n_rows, n_outputs).
+        """
+
+        X = X.tocsr() if issparse(X) else csr_matrix(np.atleast_2d(X))
+        n_rows = X.shape[0]
+
+        if n_rows <= batch_size:
+            return self.forward(self.first_layer(X))
+
+        Y = np.empty((n_rows, self.n_outputs), dtype=self.dtype)
+        for start in range(0, n_rows, batch_size):
+            stop = min(start + batch_size, n_rows)
+            Y[start:stop] = self.forward(self.first_layer(X[start:stop]))
+
+        return Y
+
+
+# Function to quantize the weights of the model
+def quantize_weights(model, dtype="int8"):
+    """
+    Function to quantize the kernels of the model to float16, or to int8 with a symmetric scale per output channel.
+    Biases are kept in float32.
+
+    :parameter:
+    model (NumpyModel): Engine with the float32 weights.
+    dtype (String): "float16" or "int8".
+
+    :returns:
+    arrays (Python dict): Quantized kernels, scales (int8 only) and biases, keyed by "kernel_<i>", "scale_<i>" and
+    "bias_<i>".
+    """
+
+    arrays = {}
+    for i, (kernel, bias) in enumerate(zip(model.kernels, model.biases)):
+        if dtype == "float16":
+            arrays[f"kernel_{i}"] = kernel.astype(np.float16)
+        elif dtype == "int8":
+            scale = np.max(np.abs(kernel), axis=0) / 127
+            scale[scale == 0] = 1
+            arrays[f"kernel_{i}"] = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+            arrays[f"scale_{i}"] = scale.astype(np.float32)
+        else:
+            raise ValueError(f"Unsupported quantization: {dtype}")
+        arrays[f"bias_{i}"] = bias.astype(np.float32)
+
+    return arrays
+
+
+# Function to export the quantized weights
+def export_quantized(model, path, dtype="int8"):
+    """
+    Function to serialize the quantized weights of the model into a NPZ file.
+
+    :parameter:
+    model (NumpyModel): Engine with the float32 weights.
+    path (String): Path of the output NPZ file.
+    dtype (String): "float16" or "int8".
+    """
+
+    arrays = quantize_weights(model, dtype)
+
+    np.savez(path, activations=np.array(model.activations), quantization=np.array(dtype), **arrays)
+
+
+# Class to make predictions with quantized weights
+class QuantizedModel(NumpyModel):
+    """
+    Class to make predictions directly on float16 or per-channel int8 weights.
+    The first kernel, which holds about 80% of the weights, stays quantized and only the kernel rows of the active
+    columns are upcast at prediction time; the smaller kernels of the next layers are dequantized once when loading.
+
+    :attributes:
+    first_kernel (Numpy array): Quantized kernel of the first Dense layer.
+    first_scale (Numpy array): Scale per output channel of the first kernel (None for float16).
+    quantization (String): "float16" or "int8".
+    """
+
+    def __init__(self, arrays, activation_names, quantization, dtype=np.float32):
+        """
+        :parameter:
+        arrays (Python dict): Quantized kernels, scales and biases (see quantize_weights).
+        activation_names (List): Name of the activation function of each Dense layer.
+        quantization (String): "float16" or "int8".
+        dtype (Numpy dtype): Data type used for the computations.
+        """
+
+        n_layers = len(activation_names)
+
+        def dequantize(i):
+            kernel = arrays[f"kernel_{i}"].astype(dtype)
+            if f"scale_{i}" in arrays:
+                kernel *= arrays[f"scale_{i}"]
+            return kernel
+
+        self.dtype = dtype
+        self.quantization = quantization
+        self.first_kernel = np.ascontiguousarray(arrays["kernel_0"])
+        self.first_scale = arrays.get("scale_0")
+        self.kernels = [self.first_kernel] + [dequantize(i) for i in range(1, n_layers)]
+        self.biases = [np.asarray(arrays[f"bias_{i}"], dtype=dtype) for i in range(n_layers)]
+        self.activations = list(activation_names)
+        self.n_inputs = self.first_kernel.shape[0]
+        self.n_outputs = self.kernels[-1].shape[1]
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Function to load the engine from a NPZ file written by export_quantized.
+
+        :parameter:
+        path (String): Path to the NPZ file.
+
+        :returns:
+        model (QuantizedModel): Engine ready for making predictions.
+        """
+
+        with np.load(path) as file:
+            arrays = {key: file[key] for key in file.files}
+
+        return cls(arrays, [str(name) for name in arrays.pop("activations")], str(arrays.pop("quantization")))
+
+    def _gather(self, indices, values):
+        """
+        Function to compute the weighted sum of the kernel rows of the active columns, in the scale of the layer.
+        """
+
+        z = values @ self.first_kernel[indices].astype(self.dtype)
+        if self.first_scale is not None:
+            z *= self.first_scale
+
+        return z
+
+    def first_layer(self, X, block_size=256):
+        """
+        Function to compute the pre-activation of the first Dense layer as a gather-and-sum of the quantized kernel
+        rows of the non-zero columns of the input, processing blocks of rows to bound the upcast rows in memory.
+
+        :parameter:
+        X (CSR matrix): Input matrix of shape (n_rows, n_inputs).
+        block_size (Integer): Number of rows gathered at once.
+
+        :returns:
+        z (Numpy array): Pre-activation values of shape (n_rows, units).
+        """
+
+        n_rows = X.shape[0]
+        z = np.zeros((n_rows, self.first_kernel.shape[1]), dtype=self.dtype)
+
+        for start in range(0, n_rows, block_size):
+            stop = min(start + block_size, n_rows)
+            begin, end = X.indptr[start], X.indptr[stop]
+            if begin == end:
+                continue
+
+            rows = self.first_kernel[X.indices[begin:end]].astype(self.dtype)
+            rows *= X.data[begin:end, None].astype(self.dtype, copy=False)
+
+            # Sum of the gathered rows of each non-empty input row
+            counts = np.diff(X.indptr[start:stop + 1])
+            non_empty = np.flatnonzero(counts)
+            z[start + non_empty] = np.add.reduceat(rows, X.indptr[start:stop][non_empty] - begin, axis=0)
+
+        if self.first_scale is not None:
+            z *= self.first_scale
+        z += self.biases[0]
+
+        return z
+
+    def predict_active(self, indices, values):
+        """
+        Function to predict the probabilities of a single profile from its active columns.
+
+        :parameter:
+        indices (Numpy array): Indices of the non-zero columns of the input array.
+        values (Numpy array): Values of the non-zero columns of the input array.
+
+        :returns:
+        y (Numpy array): Output probabilities of shape (1, n_outputs).
+        """
+
+        z = self._gather(indices, np.asarray(values, dtype=self.dtype)).reshape(1, -1)
+        z += self.biases[0]
+
+        return self.forward(z)
+
+
+# Function to compare a quantized engine against the float32 engine
+def accuracy_report(reference_model, quantized_model, X):
+    """
+    Function to compare the 19 output probabilities of a quantized engine against the float32 engine.
+
+    :parameter:
+    reference_model (NumpyModel): Engine with the float32 weights.
+    quantized_model (QuantizedModel): Engine with the quantized weights.
+    X (Numpy array or CSR matrix): Input matrix of the reference profiles.
+
+    :returns:
+    report (Pandas dataframe): Mean and maximum absolute difference, and agreement of the rounded predictions,
+    for each output label.
+    """
+
+    import pandas as pd
+    from catalogues import label_columns
+
+    Y_reference = reference_model.predict(X)
+    Y_quantized = quantized_model.predict(X)
+    diff = np.abs(Y_reference - Y_quantized)
+
+    report = pd.DataFrame({"mean_abs_diff": diff.mean(axis=0),
+                           "max_abs_diff": diff.max(axis=0),
+                           "label_agreement": (Y_reference.round() == Y_quantized.round()).mean(axis=0)},
+                          index=label_columns[:Y_reference.shape[1]])
+
+    return report
+
+
+# Function to compare the NumPy engine against the Keras model
+def check_parity(numpy_model, keras_model, X, atol=1e-5):
+    """
+    Function to compare the output probabilities of the NumPy engine against the ones of the Keras model.
+
+    :parameter:
+    numpy_model (NumpyModel): NumPy engine.
+    keras_model (Keras object): Trained Keras model.
+    X (Numpy array): Dense input matrix.
+    atol (Float): Maximum absolute difference allowed.
+
+    :returns:
+    max_diff (Float): Maximum absolute difference between both sets of probabilities.
+    """
+
+    Y_numpy = numpy_model.predict(X)
+    Y_keras = keras_model.predict(X, verbose=0)
+    max_diff = float(np.max(np.abs(Y_numpy - Y_keras)))
+
+    if max_diff > atol:
+        raise AssertionError(f"NumPy engine differs from the Keras model by {max_diff:.2e} (tolerance {atol:.0e})")
+
+    return max_diff
+
+
+# Function to generate random valid profiles
+def sample_input(layout, n_rows, seed=0):
+    """
+    Function to generate a dense input matrix of random valid profiles.
+
+    :parameter:
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    n_rows (Integer): Number of profiles.
+    seed (Integer): Seed of the random number generator.
+
+    :returns:
+    X (Numpy array): Dense input matrix of shape (n_rows, n_features).
+    """
+
+    rng = np.random.default_rng(seed)
+    profiles = {field: [categories[i] for i in rng.integers(len(categories), size=n_rows)]
+                for field, categories in layout.categories.items()}
+    profiles["people_household"] = rng.integers(1, 31, size=n_rows)
+    profiles["age"] = rng.integers(15, 100, size=n_rows)
+
+    return layout.encode_batch(profiles, sparse=False)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="NumPy inference engine for the crime predictor.")
+    parser.add_argument("--check", action="store_true", help="Compare the engine against the Keras model.")
+    parser.add_argument("--rows", type=int, default=1024, help="Number of random profiles for the check.")
+    parser.add_argument("--atol", type=float, default=1e-5, help="Tolerance for the check.")
+    parser.add_argument("--quantize", choices=["float16", "int8"], help="Export quantized weights.")
+    parser.add_argument("--output", help="Path of the quantized weights (CrimePredictorWeights.<dtype>.npz).")
+    args = parser.parse_args()
+
+    if args.check:
+        from tensorflow.keras.models import model_from_json
+        from encoding import FeatureLayout
+
+        with open('CrimePredictorConfig.json') as json_file:
+            keras_model = model_from_json(json_file.read())
+        keras_model.load_weights('CrimePredictorWeights.h5')
+
+        X = sample_input(FeatureLayout.from_files(), args.rows)
+        max_diff = check_parity(NumpyModel.from_files(), keras_model, X, atol=args.atol)
+        print(f"NumPy engine matches the Keras model on {args.rows} profiles (max abs diff {max_diff:.2e}).")
+
+    if args.quantize:
+        from encoding import FeatureLayout
+
+        output = args.output or f"CrimePredictorWeights.{args.quantize}.npz"
+        reference_model = NumpyModel.from_files()
+        export_quantized(reference_model, output, args.quantize)
+        quantized_model = QuantizedModel.from_file(output)
+
+        X = sample_input(FeatureLayout.from_files(), args.rows)
+        report = accuracy_report(reference_model, quantized_model, X)
+
+        size = sum(kernel.nbytes for kernel in reference_model.kernels)
+        size_quantized = sum(kernel.nbytes for kernel in quantized_model.kernels[:1])
+        print(f"{output} written. First kernel: {reference_model.kernels[0].nbytes / 1e6:.1f} MB -> "
+              f"{size_quantized / 1e6:.1f} MB (all kernels in float32: {size / 1e6:.1f} MB).")
+        print(f"Accuracy on {args.rows} reference profiles:")
+        print(report.to_string(float_format=lambda x: f"{x:.2e}"))
@@ -0,0 +1,460 @@
+# Instrumentation of the Crime Predictor App
+
+"""
+Module Brief Description:
+Lightweight per-stage latency and resource instrumentation of the prediction flow of the app. Stages are timed into
+histograms, and the cached loaders count their hits and misses and time their cold and warm loads separately. The
+metrics can be exported as a JSON snapshot or in the Prometheus text format, either dumped into a file or served by a
+local HTTP endpoint.
+
+Instrumentation is enabled by setting CRIME_PREDICTOR_METRICS=1 before starting the app. When disabled, the decorators
+return the functions unchanged and the timers are a shared no-op context manager, so the overhead is negligible.
+
+Environment variables:
+CRIME_PREDICTOR_METRICS         Enables the instrumentation ("1").
+CRIME_PREDICTOR_METRICS_FILE    File dumped after every prediction (".json" for JSON, otherwise Prometheus text).
+CRIME_PREDICTOR_METRICS_PORT    Port of the local endpoint serving /metrics (Prometheus) and /metrics.json.
+"""
+
+# Libraries importation
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Whether the instrumentation is enabled
+enabled = os.environ.get("CRIME_PREDICTOR_METRICS", "") not in ("", "0", "false", "False")
+
+# Prefix of the exported metric names
+prefix = "crime_predictor"
+
+# Upper bounds of the latency histogram buckets in seconds
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Shared no-op timer used when the instrumentation is disabled
+_null_timer = nullcontext()
+
+# Loader calls in progress in the current thread, to tell cache hits from misses
+_loading = threading.local()
+
+
+# Class to accumulate observations into buckets
+class Histogram:
+    """
+    Class implementing a cumulative histogram with fixed buckets, as in Prometheus.
+
+    :attributes:
+    buckets (Tuple): Upper bounds of the buckets.
+    counts (List): Number of observations in each bucket (the last one is +Inf).
+    sum (Float): Sum of the observations.
+    count (Integer): Number of observations.
+    """
+
+    def __init__(self, buckets=default_buckets):
+        """
+        :parameter:
+        buckets (Tuple): Upper bounds of the buckets.
+        """
+
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Function to add an observation.
+
+        :parameter:
+        value (Float): Observed value.
+        """
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Function to estimate a quantile as the upper bound of the bucket where it falls.
+
+        :parameter:
+        q (Float): Quantile between 0 and 1.
+
+        :returns:
+        value (Float): Upper bound of the bucket, or None if there are no observations.
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+
+        return float("inf")
+
+
+# Class to hold every metric of the process
+class Metrics:
+    """
+    Class holding the histograms and counters of the process, keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, **labels):
+        """
+        Function to add an observation to a histogram.
+
+        :parameter:
+        name (String): Name of the histogram.
+        value (Float): Observed value.
+        labels (Keyword arguments): Labels of the series.
+        """
+
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Function to increase a counter.
+
+        :parameter:
+        name (String): Name of the counter.
+        amount (Integer): Increment.
+        labels (Keyword arguments): Labels of the series.
+        """
+
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def reset(self):
+        """
+        Function to remove every observation.
+        """
+
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """
+        Function to return the current values of every metric.
+
+        :returns:
+        snapshot (Python dict): Histograms (count, sum, mean, estimated p50/p90/p99 and buckets), counters and process
+        resources.
+        """
+
+        with self._lock:
+            histograms = [{"name": name,
+                           "labels": dict(labels),
+                           "count": histogram.count,
+                           "sum": histogram.sum,
+                           "mean": histogram.sum / histogram.count if histogram.count else None,
+                           "p50": histogram.quantile(0.5),
+                           "p90": histogram.quantile(0.9),
+                           "p99": histogram.quantile(0.99),
+                           "buckets": dict(zip([str(bound) for bound in histogram.buckets] + ["+Inf"],
+                                               histogram.counts))}
+                          for (name, labels), histogram in sorted(self.histograms.items())]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+
+        return {"timestamp": time.time(),
+                "uptime_seconds": time.time() - self.started,
+                "histograms": histograms,
+                "counters": counters,
+                "process": get_resources()}
+
+    def prometheus(self):
+        """
+        Function to render the current values of every metric in the Prometheus text exposition format.
+
+        :returns:
+        text (String): Metrics in the Prometheus text format.
+        """
+
+        def render_labels(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self.histograms})
+            for name in names:
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for (series, labels), histogram in sorted(self.histograms.items()):
+                    if series != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{prefix}_{name}_bucket{render_labels(labels, le=le)} {cumulative}")
+                    lines.append(f"{prefix}_{name}_sum{render_labels(labels)} {histogram.sum}")
+                    lines.append(f"{prefix}_{name}_count{render_labels(labels)} {histogram.count}")
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (series, labels), value in sorted(self.counters.items()):
+                    if series == name:
+                        lines.append(f"{prefix}_{name}_total{render_labels(labels)} {value}")
+
+        for name, value in get_resources().items():
+            lines.append(f"# TYPE {prefix}_process_{name} gauge")
+            lines.append(f"{prefix}_process_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Function to write the metrics into a file, as JSON if its extension is ".json", or in the Prometheus text
+        format otherwise. The file is replaced atomically.
+
+        :parameter:
+        path (String): Path of the file.
+        """
+
+        text = json.dumps(self.snapshot(), indent=2) if path.endswith(".json") else self.prometheus()
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+
+# Metrics of the current process
+collector = Metrics()
+
+
+# Function to read the resources used by the process
+def get_resources():
+    """
+    Function to return the CPU time and peak resident memory of the process.
+
+    :returns:
+    resources (Python dict): CPU seconds and peak resident set size in bytes (when available).
+    """
+
+    resources = {"cpu_seconds": time.process_time()}
+    try:
+        import resource
+        import sys
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        resources["max_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+    except ImportError:
+        pass
+
+    return resources
+
+
+# Class to time a block of code
+class Timer:
+    """
+    Context manager observing the elapsed time of a block into a histogram.
+    """
+
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        collector.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+# Function to time a block of code
+def timer(name="stage_seconds", **labels):
+    """
+    Function to return a context manager that times a block of code into a histogram.
+
+    :parameter:
+    name (String): Name of the histogram.
+    labels (Keyword arguments): Labels of the series (e.g., stage="predict").
+
+    :returns:
+    timer (Context manager): Timer, or a no-op context manager when the instrumentation is disabled.
+    """
+
+    if not enabled:
+        return _null_timer
+
+    return Timer(name, labels)
+
+
+# Function to increase a counter
+def increment(name, amount=1, **labels):
+    """
+    Function to increase a counter, if the instrumentation is enabled.
+
+    :parameter:
+    name (String): Name of the counter.
+    amount (Integer): Increment.
+    labels (Keyword arguments): Labels of the series.
+    """
+
+    if enabled:
+        collector.increment(name, amount, **labels)
+
+
+# Decorator to time a function
+def timed(stage):
+    """
+    Decorator to time every call of a function as a stage of the prediction flow.
+
+    :parameter:
+    stage (String): Name of the stage.
+
+    :returns:
+    decorator (Callable): Decorator, which returns the function unchanged when the instrumentation is disabled.
+    """
+
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Timer("stage_seconds", {"stage": stage}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Decorators to instrument the cached loaders
+def track_load(loader):
+    """
+    Decorator for the body of a cached loader, placed below the Streamlit cache decorator, which flags that the call
+    missed the cache.
+
+    :parameter:
+    loader (String): Name of the loader.
+
+    :returns:
+    decorator (Callable): Decorator, which returns the function unchanged when the instrumentation is disabled.
+    """
+
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            misses = getattr(_loading, "misses", None)
+            if misses is not None:
+                misses.add(loader)
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def track_cache(loader):
+    """
+    Decorator for a cached loader, placed above the Streamlit cache decorator, which counts the cache hits and misses
+    and times the cold (miss) and warm (hit) loads separately. The clear method of the cached function is kept.
+
+    :parameter:
+    loader (String): Name of the loader.
+
+    :returns:
+    decorator (Callable): Decorator, which returns the function unchanged when the instrumentation is disabled.
+    """
+
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_loading, "misses", None)
+            _loading.misses = set()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                miss = loader in _loading.misses
+                _loading.misses = outer
+                collector.observe("loader_seconds", elapsed, loader=loader, load="cold" if miss else "warm")
+                collector.increment("loader_cache", loader=loader, result="miss" if miss else "hit")
+
+        if hasattr(function, "clear"):
+            wrapper.clear = function.clear
+
+        return wrapper
+
+    return decorator
+
+
+# Function to serve the metrics on a local endpoint
+def serve(port, host="127.0.0.1"):
+    """
+    Function to serve the metrics of the process in a background thread: /metrics in the Prometheus text format and
+    /metrics.json as a JSON snapshot.
+
+    :parameter:
+    port (Integer): Port to bind.
+    host (String): Host to bind.
+
+    :returns:
+    server (ThreadingHTTPServer): Running server.
+    """
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = collector.prometheus().encode("utf8"), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(collector.snapshot()).encode("utf8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
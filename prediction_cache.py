@@ -0,0 +1,291 @@
+# Prediction Cache for the Crime Predictor
+
+"""
+Module Brief Description:
+Bounded cache of the model's output probabilities keyed by the canonical encoded profile, i.e., the active columns and
+values of the input array. It has an in-process LRU tier and an optional SQLite tier on disk, shared across worker
+processes and restarts. Entries expire after a TTL, both tiers are bounded in size, and every entry is tagged with a
+fingerprint of the model, quantized weights and encoder files and of the version of the feature layout, so that a
+retrained model, new encoders or a new column order invalidate the cache automatically. The fingerprint is the same for
+every backend, so processes serving different backends can share the disk tier, and the app puts its backend in the
+keys. Hits and misses are counted to report the hit ratio.
+"""
+
+# Libraries importation
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Files whose contents determine the predictions
+source_paths = ["CrimePredictorConfig.json",
+                "CrimePredictorWeights.h5",
+                "CrimePredictorWeights.float16.npz",
+                "CrimePredictorWeights.int8.npz",
+                "Encoders.json",
+                "Scalers.json"]
+
+
+# Function to build the canonical key of an input array
+def profile_key(input_array):
+    """
+    Function to return the canonical encoded tuple of a single input array: its active columns and their values.
+
+    :parameter:
+    input_array (Numpy array): Input array of shape (1, n_features).
+
+    :returns:
+    key (Tuple): Tuple with the indices of the non-zero columns followed by their values.
+    """
+
+    row = np.asarray(input_array).reshape(-1)
+    indices = np.flatnonzero(row)
+
+    return tuple(indices.tolist()) + tuple(row[indices].tolist())
+
+
+# Function to fingerprint the model and encoder files
+def get_fingerprint(paths=source_paths):
+    """
+    Function to compute the SHA-256 digest of the contents of the files the predictions depend on and of the version
+    of the feature layout.
+
+    :parameter:
+    paths (List): Paths to the files.
+
+    :returns:
+    fingerprint (String): Hexadecimal digest.
+    """
+
+    from encoding import layout_version
+
+    digest = hashlib.sha256()
+    digest.update(f"layout_version={layout_version}".encode("utf8"))
+    for path in paths:
+        digest.update(path.encode("utf8"))
+        if not os.path.exists(path):
+            digest.update(b"missing")
+            continue
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+
+# Class to cache predictions
+class PredictionCache:
+    """
+    Class implementing a two-tier (memory and SQLite) bounded cache of predictions.
+
+    :attributes:
+    hits (Integer): Lookups served from memory.
+    disk_hits (Integer): Lookups served from the SQLite tier.
+    misses (Integer): Lookups not found in any tier.
+    fingerprint (String): Fingerprint of the model and encoder files of the cached entries.
+    """
+
+    def __init__(self, max_entries=10000, ttl=None, path=None, max_disk_entries=1000000, paths=source_paths,
+                 check_interval=5.0):
+        """
+        :parameter:
+        max_entries (Integer): Maximum number of entries in memory.
+        ttl (Float): Time to live of the entries in seconds (None for no expiration).
+        path (String): Path to the SQLite database of the disk tier (None to disable it).
+        max_disk_entries (Integer): Maximum number of entries on disk.
+        paths (List): Files whose changes invalidate the cache.
+        check_interval (Float): Minimum number of seconds between checks for changes in those files.
+        """
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.paths = list(paths)
+        self.check_interval = check_interval
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = self._stat_sources()
+        self._last_check = time.monotonic()
+        self._inserts = 0
+        self.fingerprint = get_fingerprint(self.paths)
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions ("
+                             "key TEXT PRIMARY KEY, fingerprint TEXT, value BLOB, created REAL, accessed REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)")
+            self._db.execute("DELETE FROM predictions WHERE fingerprint != ?", (self.fingerprint,))
+
+    def _stat_sources(self):
+        """
+        Function to return the size and modification time of the source files.
+        """
+
+        stats = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stats.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stats.append(None)
+
+        return stats
+
+    def _check_sources(self):
+        """
+        Function to invalidate the cache when the model or encoder files have changed.
+        """
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        stats = self._stat_sources()
+        if stats == self._stats:
+            return
+        self._stats = stats
+
+        fingerprint = get_fingerprint(self.paths)
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions WHERE fingerprint != ?", (fingerprint,))
+
+    @staticmethod
+    def _disk_key(key):
+        """
+        Function to serialize a key for the SQLite tier.
+        """
+
+        return hashlib.sha1(repr(key).encode("utf8")).hexdigest()
+
+    def _expired(self, created, now):
+        """
+        Function to check whether an entry created at the given time has expired.
+        """
+
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key):
+        """
+        Function to retrieve the cached probabilities of an encoded profile.
+
+        :parameter:
+        key (Tuple): Canonical encoded profile (see profile_key).
+
+        :returns:
+        value (Numpy array): Cached probabilities, or None if they are not cached.
+        """
+
+        with self._lock:
+            self._check_sources()
+            now = time.time()
+
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                disk_key = self._disk_key(key)
+                row = self._db.execute("SELECT value, created FROM predictions WHERE key = ? AND fingerprint = ?",
+                                       (disk_key, self.fingerprint)).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    self._db.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (now, disk_key))
+                    value = np.frombuffer(row[0], dtype=np.float32).reshape(1, -1)
+                    self._remember(key, value, row[1])
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def _remember(self, key, value, created):
+        """
+        Function to add an entry to the memory tier, evicting the least recently used entries.
+        """
+
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key, value):
+        """
+        Function to cache the probabilities of an encoded profile.
+
+        :parameter:
+        key (Tuple): Canonical encoded profile (see profile_key).
+        value (Numpy array): Output probabilities of the model.
+        """
+
+        value = np.asarray(value, dtype=np.float32).reshape(1, -1)
+
+        with self._lock:
+            now = time.time()
+            self._remember(key, value, now)
+
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                                 (self._disk_key(key), self.fingerprint, value.tobytes(), now, now))
+                self._inserts += 1
+
+                # The disk tier is trimmed every 1,000 inserts to amortize the count
+                if self._inserts % 1000 == 0:
+                    self._evict_disk(now)
+
+    def _evict_disk(self, now):
+        """
+        Function to remove the expired entries and the least recently used entries beyond the disk tier size.
+        """
+
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM predictions WHERE created < ?", (now - self.ttl,))
+        excess = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            self._db.execute("DELETE FROM predictions WHERE key IN "
+                             "(SELECT key FROM predictions ORDER BY accessed LIMIT ?)", (excess,))
+
+    def clear(self):
+        """
+        Function to remove every entry from both tiers.
+        """
+
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+
+    def stats(self):
+        """
+        Function to report the usage of the cache.
+
+        :returns:
+        stats (Python dict): Hits per tier, misses, hit ratio and number of entries in memory.
+        """
+
+        lookups = self.hits + self.disk_hits + self.misses
+
+        return {"hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._memory)}
@@ -0,0 +1,337 @@
+# Catalogue Registry for the Crime Predictor
+
+"""
+Module Brief Description:
+Registry of the vocabularies of every predictor, loaded once and shared by the app, the batch scoring and the training
+tools. It offers constant-time label-to-code, code-to-label and code-to-column lookups, and vectorized versions of them
+for whole Pandas/NumPy columns.
+
+Municipalities are identified by a compact integer ID (state * 1000 + municipality) built from the INEGI codes in
+MunicipalitiesCatalogue.csv. The float key used as category in the training matrix (e.g., 1.1 for state 1 and
+municipality 1) is derived from the ID as in the CrimePredictionMX notebook; as 1.1 and 1.10 are the same float, such
+municipalities share the same column of the input array, exactly as in training, while the registry still tells them
+apart. Municipality labels are only unique within a state, so label lookups are keyed by the state code as well.
+"""
+
+# Libraries importation
+import numpy as np
+import pandas as pd
+from catalogues import field_dicts, state_dict
+from encoding import FeatureLayout, categorical_fields, numerical_fields
+
+# Default path of the INEGI municipalities catalogue
+catalogue_path = "MunicipalitiesCatalogue.csv"
+
+
+# Function to build the compact municipality IDs
+def municipality_ids(states, municipalities):
+    """
+    Function to build the compact integer ID of municipalities from their INEGI state and municipality codes.
+
+    :parameter:
+    states (Integer or array-like): State codes (CVE_ENT).
+    municipalities (Integer or array-like): Municipality codes within the state (CVE_MUN).
+
+    :returns:
+    ids (Integer or Numpy array): Municipality IDs (state * 1000 + municipality).
+    """
+
+    return np.asarray(states, dtype=np.int64) * 1000 + np.asarray(municipalities, dtype=np.int64)
+
+
+# Function to build the float keys of the training matrix
+def model_keys(ids):
+    """
+    Function to return the municipality float key used as category in the training matrix, i.e.,
+    float(str(State) + "." + str(Municipality)) as in the CrimePredictionMX notebook.
+
+    :parameter:
+    ids (Integer or array-like): Municipality IDs.
+
+    :returns:
+    keys (Float or Numpy array): Float keys of the municipalities.
+    """
+
+    ids = np.asarray(ids, dtype=np.int64)
+    keys = np.array([float(f"{i // 1000}.{i % 1000}") for i in ids.reshape(-1)], dtype=np.float64)
+
+    return keys.reshape(ids.shape) if ids.ndim else float(keys[0])
+
+
+# Class to look up the vocabularies of the predictors
+class CatalogueRegistry:
+    """
+    Class holding the bidirectional vocabularies of every categorical predictor and their input array columns.
+
+    :attributes:
+    layout (FeatureLayout): Compiled feature layout of the input array.
+    labels (Python dict): Code-to-label dictionaries, keyed by predictor name.
+    codes (Python dict): Label-to-code dictionaries, keyed by predictor name (keyed by (state, label) for
+    municipalities).
+    municipalities (Pandas dataframe): Municipalities indexed by ID, with their state code, label, float key and column.
+    """
+
+    def __init__(self, layout, catalogue_df, dictionaries=field_dicts):
+        """
+        :parameter:
+        layout (FeatureLayout): Compiled feature layout of the input array.
+        catalogue_df (Pandas dataframe): INEGI catalogue with the CVE_ENT, CVE_MUN and NOM_MUN columns.
+        dictionaries (Python dict): Attribute dictionaries of the categorical predictors other than municipality.
+        """
+
+        self.layout = layout
+        self.labels = {}
+        self.codes = {}
+        self._columns = {}
+
+        # Repeated labels keep their first code, as the reverse lookups of the original app
+        for field, dictionary in dictionaries.items():
+            self.labels[field] = dict(dictionary)
+            self.codes[field] = {label: code for code, label in reversed(list(dictionary.items()))}
+            self._columns[field] = {code: layout.column(field, code) for code in dictionary}
+
+        ids = municipality_ids(catalogue_df["CVE_ENT"], catalogue_df["CVE_MUN"])
+        keys = model_keys(ids)
+        columns = np.array([layout.column("municipality", key) for key in keys], dtype=object)
+        self.municipalities = pd.DataFrame({"state": catalogue_df["CVE_ENT"].to_numpy(dtype=np.int64),
+                                            "municipality": catalogue_df["NOM_MUN"].to_numpy(dtype=object),
+                                            "key": keys,
+                                            "column": np.where(columns == None, -1, columns).astype(np.int64)},
+                                           index=pd.Index(ids, name="id"))
+
+        self.labels["municipality"] = self.municipalities["municipality"].to_dict()
+        self.codes["municipality"] = {(state, label): i for i, state, label
+                                      in zip(ids[::-1], self.municipalities["state"].to_numpy()[::-1],
+                                             self.municipalities["municipality"].to_numpy()[::-1])}
+        self._columns["municipality"] = {i: (None if column < 0 else int(column))
+                                         for i, column in self.municipalities["column"].items()}
+
+        # Dense tables indexed by municipality ID for the vectorized lookups
+        size = int(ids.max()) + 1 if len(ids) else 1
+        self._key_table = np.full(size, np.nan)
+        self._key_table[ids] = keys
+        self._column_table = np.full(size, -1, dtype=np.int64)
+        self._column_table[ids] = self.municipalities["column"].to_numpy()
+
+        first = ~self.municipalities.duplicated(["state", "municipality"]).to_numpy()
+        self._municipality_index = pd.MultiIndex.from_arrays([self.municipalities["state"].to_numpy()[first],
+                                                              self.municipalities["municipality"].to_numpy()[first]])
+        self._municipality_ids = ids[first]
+
+    @classmethod
+    def from_files(cls, path=catalogue_path, layout=None):
+        """
+        Function to build the registry from the INEGI municipalities catalogue and the serialized encoders.
+
+        :parameter:
+        path (String): Path to the municipalities catalogue CSV file.
+        layout (FeatureLayout): Compiled feature layout (built from Encoders.json and Scalers.json if None).
+
+        :returns:
+        registry (CatalogueRegistry): Catalogue registry.
+        """
+
+        catalogue_df = pd.read_csv(path, usecols=["CVE_ENT", "CVE_MUN", "NOM_MUN"])
+
+        return cls(layout if layout is not None else FeatureLayout.from_files(), catalogue_df)
+
+    def encode(self, field, label, state=None):
+        """
+        Function to return the code of a label of a categorical predictor.
+
+        :parameter:
+        field (String): Name of the categorical predictor.
+        label (String): Label of the category.
+        state (Integer): State code, required for municipalities.
+
+        :returns:
+        code (Integer or String): Code of the category (ID for municipalities), or None if the label is unknown.
+        """
+
+        if field == "municipality":
+            return self.codes[field].get((state, label))
+
+        return self.codes[field].get(label)
+
+    def decode(self, field, code):
+        """
+        Function to return the label of a code of a categorical predictor.
+
+        :parameter:
+        field (String): Name of the categorical predictor.
+        code (Integer or String): Code of the category (ID for municipalities).
+
+        :returns:
+        label (String): Label of the category, or None if the code is unknown.
+        """
+
+        return self.labels[field].get(code)
+
+    def column(self, field, code):
+        """
+        Function to return the input array column of a code of a categorical predictor.
+
+        :parameter:
+        field (String): Name of the categorical predictor.
+        code (Integer or String): Code of the category (ID for municipalities).
+
+        :returns:
+        column (Integer): Column index, or None if the category is not a column of the input array.
+        """
+
+        return self._columns[field].get(code)
+
+    def state_municipalities(self, state):
+        """
+        Function to return the municipalities of a state.
+
+        :parameter:
+        state (Integer): State code.
+
+        :returns:
+        municipalities (Python dict): Municipality labels keyed by municipality ID.
+        """
+
+        municipalities_df = self.municipalities
+        selected = municipalities_df[municipalities_df["state"] == state]
+
+        return selected["municipality"].to_dict()
+
+    def municipality_index(self, states=state_dict):
+        """
+        Function to build the per-state index of municipalities used by the municipality select box.
+
+        :parameter:
+        states (Python dict): State labels keyed by state code, as displayed in the app.
+
+        :returns:
+        index (Python dict): For each state label, a dictionary with the alphabetically sorted municipality labels
+        ("labels") and the municipality ID of each label ("codes").
+        """
+
+        index = {}
+        groups = self.municipalities.groupby("state", sort=False)
+        for code, label in states.items():
+            if code not in groups.groups:
+                index[label] = {"labels": [], "codes": {}}
+                continue
+            group = groups.get_group(code)
+            codes = {municipality: i for i, municipality
+                     in zip(group.index[::-1], group["municipality"].to_numpy()[::-1])}
+            index[label] = {"labels": sorted(codes), "codes": codes}
+
+        return index
+
+    def encode_array(self, field, labels, states=None):
+        """
+        Function to map a whole column of labels of a categorical predictor to their codes.
+
+        :parameter:
+        field (String): Name of the categorical predictor.
+        labels (Array-like): Labels of the categories.
+        states (Array-like): State codes of each row, required for municipalities.
+
+        :returns:
+        codes (Numpy array): Code of each label (ID for municipalities), with None (-1 for municipalities) for
+        unknown labels.
+        """
+
+        if field == "municipality":
+            query = pd.MultiIndex.from_arrays([np.asarray(states, dtype=np.int64), np.asarray(labels, dtype=object)])
+            position = self._municipality_index.get_indexer(query)
+            return np.where(position >= 0, self._municipality_ids[position], -1)
+
+        # Labels are looked up once per distinct value
+        codes, uniques = pd.factorize(np.asarray(labels, dtype=object), use_na_sentinel=True)
+        lookup = self.codes[field]
+        mapped = np.array([lookup.get(unique) for unique in uniques] + [None], dtype=object)
+
+        return mapped[codes]
+
+    def columns(self, field, codes):
+        """
+        Function to map a whole column of codes of a categorical predictor to input array columns.
+
+        :parameter:
+        field (String): Name of the categorical predictor.
+        codes (Array-like): Codes of the categories (IDs for municipalities).
+
+        :returns:
+        columns (Numpy array): Column index for each code, with -1 for unknown codes.
+        """
+
+        if field == "municipality":
+            ids = np.asarray(codes, dtype=np.int64)
+            known = (ids >= 0) & (ids < len(self._column_table))
+            return np.where(known, self._column_table[np.where(known, ids, 0)], -1)
+
+        return self.layout.columns(field, codes)
+
+    def model_values(self, ids):
+        """
+        Function to map a whole column of municipality IDs to the float keys of the training matrix.
+
+        :parameter:
+        ids (Array-like): Municipality IDs.
+
+        :returns:
+        keys (Numpy array): Float key of each municipality, with NaN for unknown IDs.
+        """
+
+        ids = np.asarray(ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self._key_table))
+
+        return np.where(known, self._key_table[np.where(known, ids, 0)], np.nan)
+
+    def profile(self, labels):
+        """
+        Function to map the labels of a single profile to the encoded profile expected by the feature layout.
+
+        :parameter:
+        labels (Python dict): Label of every categorical predictor and value of every numerical predictor, keyed by
+        predictor name.
+
+        :returns:
+        profile (Python dict): Encoded value of every predictor, keyed by predictor name.
+        """
+
+        profile = {}
+        for field in categorical_fields:
+            if field == "municipality":
+                state = self.encode("state", labels.get("state"))
+                municipality = self.encode(field, labels.get(field), state)
+                profile[field] = None if municipality is None else float(self._key_table[municipality])
+            else:
+                profile[field] = self.encode(field, labels.get(field))
+
+        for field in numerical_fields:
+            profile[field] = labels[field]
+
+        return profile
+
+    def profiles(self, labels):
+        """
+        Function to map whole columns of labels to the encoded profiles expected by the feature layout.
+
+        :parameter:
+        labels (Pandas dataframe or Python dict): Labels of every categorical predictor and values of every numerical
+        predictor, keyed by predictor name.
+
+        :returns:
+        profiles (Python dict): Encoded values of every predictor, keyed by predictor name.
+        """
+
+        profiles = {}
+        for field in categorical_fields:
+            if field == "municipality":
+                states = self.encode_array("state", labels["state"])
+                states = np.where(states == None, -1, states).astype(np.int64)
+                ids = self.encode_array(field, labels[field], states)
+                profiles[field] = self.model_values(ids)
+            else:
+                profiles[field] = self.encode_array(field, labels[field])
+
+        for field in numerical_fields:
+            profiles[field] = pd.to_numeric(pd.Series(labels[field])).to_numpy(dtype=np.float64)
+
+        return profiles
@@ -0,0 +1,376 @@
+# Hyperparameter Search of the Crime Predictor
+
+"""
+Module Brief Description:
+Parallel search of the hyperparameters that were fixed by hand in the CrimePredictionMX notebook: the units of the
+hidden layers, the dropout rate, the learning rate and the batch size. The training and validation matrices of the
+feature store are written once into OS shared memory (/dev/shm) as uncompressed .npy arrays, which every worker of a
+local process pool memory-maps instead of gathering its own copy of the rows. Each worker trains one trial at a time
+with a fixed number of TensorFlow threads, so the trials running together do not oversubscribe the cores.
+
+Trials are pruned with the median stopping rule: from a minimum epoch on, a trial whose validation loss is worse than
+the median of the previous trials at the same epoch is stopped. The settings, the validation metrics at the best epoch,
+the number of epochs, the status and the wall time of every trial are appended to a CSV results table as soon as it
+finishes, and the trials are reported from the best validation loss down.
+
+Usage:
+python search.py dataset.csv --trials 20 --workers 4 --threads 2 --epochs 30
+python search.py dataset.csv --trials 50 --workers 8 --threads 1 --results SearchResults.csv --seed 0
+"""
+
+# Libraries importation
+import argparse
+import itertools
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from bundle import shm_dir
+
+# Values explored for each hyperparameter
+search_space = {"units": [(1201, 610), (1600, 800), (800, 400), (600, 300), (1201, 610, 305)],
+                "dropout": [0.0, 0.10, 0.20, 0.30],
+                "learning_rate": [0.0003, 0.001, 0.003],
+                "batch_size": [32, 64, 128, 256]}
+
+# Hyperparameters of the notebook, always evaluated as the first trial
+baseline = {"units": (1201, 610), "dropout": 0.10, "learning_rate": 0.001, "batch_size": 32}
+
+# Default path of the results table
+results_path = "SearchResults.csv"
+
+# Splits of the feature store used by the search
+split_names = ["train", "validation"]
+
+# Validation metrics of the results table
+metric_names = ["loss", "precision", "recall", "auc", "f1_score"]
+
+# Opened splits of the current worker process
+_splits = None
+
+
+# Function to draw the trials of a search
+def get_trials(space=search_space, n_trials=20, seed=None):
+    """
+    Function to draw distinct combinations of hyperparameters at random, starting with those of the notebook.
+
+    :parameter:
+    space (Python dict): Values explored for each hyperparameter.
+    n_trials (Integer): Number of trials (at most the number of combinations).
+    seed (Integer): Seed of the random number generator.
+
+    :returns:
+    trials (List): Hyperparameters of each trial.
+    """
+
+    names = list(space)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+    others = [combination for combination in combinations if combination != baseline]
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(others))
+    trials = [dict(baseline)] + [others[i] for i in order]
+
+    return trials[:n_trials]
+
+
+# Function to publish the training and validation matrices into shared memory
+def share_splits(store, directory=shm_dir):
+    """
+    Function to write the rows of the training and validation sets into shared memory once, as CSR and label arrays
+    that the workers memory-map. Each search gets its own new directory, so concurrent searches on the same entry
+    never share (nor delete) each other's arrays.
+
+    :parameter:
+    store (Python dict): Opened entry of the feature store (see feature_store.py).
+    directory (String): Directory of the OS shared memory.
+
+    :returns:
+    path (String): Path to the shared splits, to be removed by the caller once the search ends.
+    """
+
+    from feature_store import get_split
+
+    path = tempfile.mkdtemp(prefix=f"CrimePredictorSearch-{store['meta']['key'][:12]}-", dir=directory)
+    try:
+        for name in split_names:
+            X, Y = get_split(store, name)
+            arrays = {"data": X.data, "indices": X.indices, "indptr": X.indptr, "Y": Y,
+                      "shape": np.asarray(X.shape, dtype=np.int64)}
+            for array_name, array in arrays.items():
+                np.save(os.path.join(path, f"{name}_{array_name}.npy"), array)
+    except BaseException:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    return path
+
+
+# Function to open the shared training and validation matrices
+def open_splits(path):
+    """
+    Function to memory-map the training and validation matrices written by share_splits.
+
+    :parameter:
+    path (String): Path to the shared splits.
+
+    :returns:
+    splits (Python dict): Input matrix (CSR matrix) and label matrix of each split, keyed by split name.
+    """
+
+    from scipy.sparse import csr_matrix
+
+    def load(name):
+        return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+    splits = {}
+    for name in split_names:
+        X = csr_matrix((load(f"{name}_data"), load(f"{name}_indices"), load(f"{name}_indptr")),
+                       shape=tuple(load(f"{name}_shape")))
+        splits[name] = (X, load(f"{name}_Y"))
+
+    return splits
+
+
+# Function to read a metric from the logs of Keras
+def get_metric(logs, name):
+    """
+    Function to read a metric from the logs of an epoch, whatever the numeric suffix given by Keras to its name.
+
+    :parameter:
+    logs (Python dict): Logs of an epoch.
+    name (String): Name of the metric, e.g., "val_loss".
+
+    :returns:
+    value (Float): Value of the metric (averaged over the labels for the F1 score), or NaN if it is missing.
+    """
+
+    for key, value in (logs or {}).items():
+        if re.sub(r"_\d+$", "", key) == name:
+            return float(np.mean(value))
+
+    return float("nan")
+
+
+# Function to apply the median stopping rule
+def should_prune(curves, epoch, value, min_epochs=3, min_trials=2):
+    """
+    Function to decide whether a trial is stopped, because its validation loss at an epoch is worse than the median
+    of the previous trials at the same epoch.
+
+    :parameter:
+    curves (List): Validation loss at each epoch of the previous trials.
+    epoch (Integer): Index of the epoch (from 0).
+    value (Float): Validation loss of the trial at the epoch.
+    min_epochs (Integer): Number of epochs always run.
+    min_trials (Integer): Number of previous trials that reached the epoch needed to prune.
+
+    :returns:
+    prune (Boolean): Whether the trial is stopped.
+    """
+
+    values = [curve[epoch] for curve in curves if len(curve) > epoch]
+    if epoch + 1 < min_epochs or len(values) < min_trials:
+        return False
+
+    return bool(value > np.median(values))
+
+
+# Function to start a worker of the search
+def _init_worker(path, threads):
+    """
+    Function to limit the threads of TensorFlow in a worker process and open the shared splits.
+    """
+
+    global _splits
+
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    _splits = open_splits(path)
+
+
+# Function to run a trial in a worker
+def _run_trial(trial, params, epochs, precision_threshold, curves, min_epochs, seed):
+    """
+    Function to train the model with the hyperparameters of a trial, stopping it early if it is pruned. An error
+    raised before the first epoch ends (e.g., a bug or invalid hyperparameters) is propagated to abort the search,
+    whereas a trial that fails later is recorded as failed with the metrics of its finished epochs.
+
+    :returns:
+    record (Python dict): Hyperparameters, validation metrics at the best epoch, status, wall time and validation
+    loss curve of the trial.
+    """
+
+    import tensorflow as tf
+    from training import fit_model
+
+    record = {"trial": trial,
+              "units": "-".join(str(n_units) for n_units in params["units"]),
+              "dropout": params["dropout"],
+              "learning_rate": params["learning_rate"],
+              "batch_size": params["batch_size"],
+              "status": "completed",
+              "epochs": 0}
+    history = []
+
+    class CallbackPrune(tf.keras.callbacks.Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            history.append({name: get_metric(logs, f"val_{name}") for name in metric_names})
+            if should_prune(curves, epoch, history[-1]["loss"], min_epochs):
+                record["status"] = "pruned"
+                self.model.stop_training = True
+
+    start = time.perf_counter()
+    try:
+        tf.keras.backend.clear_session()
+        if seed is not None:
+            tf.keras.utils.set_random_seed(seed)
+        X_train, Y_train = _splits["train"]
+        X_validation, Y_validation = _splits["validation"]
+        fit_model(X_train, Y_train, X_validation, Y_validation, epochs, precision_threshold, params["batch_size"],
+                  seed, verbose=0, units=params["units"], dropout=params["dropout"],
+                  learning_rate=params["learning_rate"], callbacks=[CallbackPrune()])
+    except Exception as error:
+        if not history:
+            raise
+        record["status"] = "failed"
+        record["error"] = str(error)
+
+    record["epochs"] = len(history)
+    if history:
+        best = min(history, key=lambda metrics: metrics["loss"])
+        record.update({f"val_{name}": value for name, value in best.items()})
+    record["seconds"] = time.perf_counter() - start
+    record["curve"] = [metrics["loss"] for metrics in history]
+
+    return record
+
+
+# Function to append a trial to the results table
+def append_result(record, path=results_path):
+    """
+    Function to append the record of a finished trial to the CSV results table.
+
+    :parameter:
+    record (Python dict): Record of the trial (see _run_trial).
+    path (String): Path to the results table.
+    """
+
+    columns = ["trial", "units", "dropout", "learning_rate", "batch_size", "status", "epochs"] + \
+              [f"val_{name}" for name in metric_names] + ["seconds", "error"]
+    row = pd.DataFrame([record]).reindex(columns=columns)
+    row.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+
+
+# Function to run a search
+def run_search(store, n_trials=20, workers=2, threads=1, epochs=30, precision_threshold=0.95, space=search_space,
+               results=results_path, seed=None, min_epochs=3, directory=shm_dir, verbose=True):
+    """
+    Function to run the trials of a search across a local process pool, with the training and validation matrices
+    shared by all the workers. A new trial is only submitted when a running one finishes, so it is pruned against
+    all the trials finished by then. A trial that fails before its first epoch ends aborts the search with its error.
+
+    :parameter:
+    store (Python dict): Opened entry of the feature store (see feature_store.py).
+    n_trials (Integer): Number of trials.
+    workers (Integer): Number of worker processes.
+    threads (Integer): Number of TensorFlow threads of each worker.
+    epochs (Integer): Maximum number of epochs of each trial.
+    precision_threshold (Float): Precision for stopping a trial early, as in training.fit_model.
+    space (Python dict): Values explored for each hyperparameter.
+    results (String): Path to the CSV results table, to which the trials are appended.
+    seed (Integer): Seed of the trials drawing and of the training of each trial.
+    min_epochs (Integer): Number of epochs always run before a trial can be pruned.
+    directory (String): Directory of the OS shared memory.
+    verbose (Boolean): Whether to report every finished trial on stderr.
+
+    :returns:
+    records (Pandas dataframe): Records of the trials, from the best validation loss down.
+    """
+
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    trials = get_trials(space, n_trials, seed)
+    path = share_splits(store, directory)
+
+    records, curves, running = [], [], {}
+    pending = iter(enumerate(trials))
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(path, threads)) as executor:
+
+            def submit():
+                for trial, params in itertools.islice(pending, 1):
+                    trial_seed = None if seed is None else seed + trial
+                    future = executor.submit(_run_trial, trial, params, epochs, precision_threshold, list(curves),
+                                             min_epochs, trial_seed)
+                    running[future] = trial
+
+            for _ in range(workers):
+                submit()
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    record = future.result()
+                    curve = record.pop("curve")
+                    if curve:
+                        curves.append(curve)
+                    records.append(record)
+                    append_result(record, results)
+                    if verbose:
+                        print(f"Trial {record['trial']} ({record['units']}, dropout {record['dropout']}, "
+                              f"learning rate {record['learning_rate']}, batch {record['batch_size']}): "
+                              f"{record['status']} after {record['epochs']} epochs, val_loss "
+                              f"{record.get('val_loss', float('nan')):.4f}, {record['seconds']:.1f} s "
+                              f"[{len(records)}/{len(trials)} in {time.perf_counter() - start:.0f} s]",
+                              file=sys.stderr)
+                    submit()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    records = pd.DataFrame(records)
+    if "val_loss" in records:
+        records = records.sort_values("val_loss", na_position="last")
+
+    return records.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter search of the crime predictor.")
+    parser.add_argument("source", nargs="?", default="dataset.csv", help="Output of sql_query.sql (CSV or Parquet).")
+    parser.add_argument("--store", default="FeatureStore", help="Directory of the feature store.")
+    parser.add_argument("--trials", type=int, default=20, help="Number of trials.")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes.")
+    parser.add_argument("--threads", type=int, default=None,
+                        help=f"TensorFlow threads of each worker (the {os.cpu_count()} cores split among the workers "
+                             f"by default).")
+    parser.add_argument("--epochs", type=int, default=30, help="Maximum number of epochs of each trial.")
+    parser.add_argument("--precision-threshold", type=float, default=0.95, help="Precision for stopping early.")
+    parser.add_argument("--min-epochs", type=int, default=3, help="Epochs run before a trial can be pruned.")
+    parser.add_argument("--results", default=results_path, help="CSV results table, to which the trials are appended.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the trials and of the training.")
+    args = parser.parse_args()
+
+    from feature_store import get_store
+
+    threads = args.threads or max(1, os.cpu_count() // args.workers)
+    records = run_search(get_store(args.source, args.store), args.trials, args.workers, threads, args.epochs,
+                         args.precision_threshold, results=args.results, seed=args.seed, min_epochs=args.min_epochs)
+
+    print(records.drop(columns=["error"], errors="ignore").to_string(index=False))
+    print(f"Results appended to {args.results}.")
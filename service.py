@@ -0,0 +1,649 @@
+# HTTP Prediction Service for the Crime Predictor
+
+"""
+Module Brief Description:
+Standalone local HTTP JSON endpoint for calling the crime predictor from other services, without the Streamlit UI.
+Requests are parsed by an asyncio server, and the profiles of each request are validated and encoded on their own (an
+unknown label or a missing number is a 400 error of that request only). The encoded rows are put on a queue, where a
+micro-batcher coalesces the rows of concurrent requests into a single batched model call, bounded by a maximum batch
+size and a maximum wait time. Thus, the throughput grows with the concurrency instead of paying one model.predict dispatch per request.
+
+Endpoints:
+POST /predict    Body: a profile, a list of profiles, or {"profiles": [...]}, with the human labels of the app's select
+                 boxes (same columns as batch_scoring.py). Returns the version of the model and, for each profile,
+                 the 19 crime labels of the app and their probabilities:
+                 {"version": ..., "predictions": [[{"crime": ..., "probability": ...}, ...], ...]}.
+GET /health      Returns the status of the service, the version of the model and the batching statistics.
+POST /sensitivity
+                 Body: a single profile, as for /predict. Returns the 19 crime probabilities as age, the number of
+                 persons in the household and the hour of the day sweep their whole ranges, with the other inputs
+                 held: {"version": ..., "crimes": [...], "curves": {"age": {"values": [...],
+                 "probabilities": [[...], ...]}, ...}}.
+POST /uncertainty
+                 Body: as for /predict, optionally as {"profiles": [...], "passes": 200, "level": 0.9,
+                 "budget": 0.25}. Returns the mean and a credible interval of each probability with Monte Carlo
+                 dropout (see uncertainty.py), and the number of passes that fitted in the latency budget:
+                 {"version": ..., "passes": ..., "level": ..., "predictions": [[{"crime": ..., "probability": ...,
+                 "lower": ..., "upper": ...}, ...], ...]}.
+GET /atlas       Query: state (label, the whole country if omitted), profile, hour, crime and top. Returns the
+                 municipalities ranked by probability, read from the precomputed atlas (see atlas.py) without running
+                 the model. The atlas must have been built from the served model or bundle version, and is reopened
+                 when a new bundle is swapped in or the atlas is rebuilt:
+                 {"ranking": [{"id": ..., "state": ..., "municipality": ..., "probability": ...}, ...]}.
+
+Usage:
+python service.py --port 8000 --max-batch-size 256 --max-wait-ms 5
+python service.py --port 8000 --atlas MunicipalityAtlas
+python service.py --port 8000 --bundle CrimePredictor.bundle    # Reloads the bundle when a new version is deployed
+"""
+
+# Libraries importation
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, vstack
+from batch_scoring import Scorer, predict
+from catalogues import crime_labels
+from prediction_cache import PredictionCache
+
+# HTTP reason phrases of the status codes used by the service
+reasons = {200: "OK",
+           400: "Bad Request",
+           404: "Not Found",
+           405: "Method Not Allowed",
+           413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+# Maximum size of a request body in bytes
+max_body_size = 16 * 1024 * 1024
+
+# Maximum number of Monte Carlo dropout passes and default latency budget in seconds of /uncertainty
+max_passes = 1000
+default_budget = 0.25
+
+
+# Function to cast the output probabilities into labelled records
+def get_records(Y):
+    """
+    Function to cast the output array of the model into the labelled probabilities displayed by the app.
+
+    :parameter:
+    Y (Numpy array): Output probabilities of shape (n_profiles, 19).
+
+    :returns:
+    records (List): For each profile, a list of dictionaries with the crime label and its probability.
+    """
+
+    return [[{"crime": crime, "probability": float(probability)} for crime, probability in zip(crime_labels, y)]
+            for y in np.asarray(Y)]
+
+
+# Function to parse the profiles of a request body
+def parse_profiles(body):
+    """
+    Function to retrieve the profiles from the JSON body of a request.
+
+    :parameter:
+    body (Bytes): Request body.
+
+    :returns:
+    profiles (List): List of profiles (Python dicts with the human labels).
+    """
+
+    payload = json.loads(body)
+    if isinstance(payload, dict) and "profiles" in payload:
+        payload = payload["profiles"]
+    profiles = payload if isinstance(payload, list) else [payload]
+
+    if not profiles or not all(isinstance(profile, dict) for profile in profiles):
+        raise ValueError("Expected a profile, a list of profiles or {\"profiles\": [...]}.")
+
+    return profiles
+
+
+# Class to coalesce concurrent requests into batched model calls
+class MicroBatcher:
+    """
+    Class implementing the asyncio queue that groups the profiles of concurrent requests into batches.
+
+    :attributes:
+    max_batch_size (Integer): Maximum number of profiles per model call.
+    max_wait (Float): Maximum time in seconds that the first request of a batch waits for others.
+    requests (Integer): Number of requests served.
+    batches (Integer): Number of model calls.
+    profiles (Integer): Number of profiles scored.
+    """
+
+    def __init__(self, scorer, max_batch_size=256, max_wait=0.005):
+        """
+        :parameter:
+        scorer (Scorer): Scorer with the catalogue registry and the model.
+        max_batch_size (Integer): Maximum number of profiles per model call.
+        max_wait (Float): Maximum time in seconds that the first request of a batch waits for others.
+        """
+
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.requests = 0
+        self.batches = 0
+        self.profiles = 0
+
+        self._queue = None
+        self._task = None
+
+        # The model runs in a single background thread, so the event loop keeps accepting requests meanwhile
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        """
+        Function to start the batching loop in the running event loop.
+        """
+
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Function to stop the batching loop.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    def encode(self, profiles, layout=None):
+        """
+        Function to validate and encode the profiles of a request.
+
+        :parameter:
+        profiles (List): List of profiles (Python dicts with the human labels).
+        layout (FeatureLayout): Feature layout of the input array (the current one if None).
+
+        :returns:
+        X (CSR matrix): Input matrix of the profiles.
+        layout (FeatureLayout): Feature layout used.
+        """
+
+        layout = self.scorer.layout if layout is None else layout
+        X = layout.encode_batch(self.scorer.encode(pd.DataFrame(profiles), strict=True), sparse=True, dtype=np.float32)
+
+        return X, layout
+
+    async def submit(self, profiles):
+        """
+        Function to encode the profiles of a request, queue their rows and wait for their probabilities. An invalid
+        profile raises its error here, before anything is queued.
+
+        :parameter:
+        profiles (List): List of profiles (Python dicts with the human labels).
+
+        :returns:
+        Y (Numpy array): Output probabilities of shape (n_profiles, 19).
+        version (String): Version of the model that scored them.
+        """
+
+        X, layout = self.encode(profiles)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((X, layout, profiles, future))
+
+        return await future
+
+    async def run(self, function, *args):
+        """
+        Function to run a call in the thread of the model, outside of the batches.
+
+        :parameter:
+        function (Callable): Function to run.
+        args (Tuple): Arguments of the function.
+
+        :returns:
+        result (Object): Result of the function.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _score(self, items):
+        """
+        Function to score the encoded rows of a batch of requests with a single model call, using the same version of
+        the model and feature layout for the whole batch. The rows of a request encoded with a layout swapped out
+        meanwhile are encoded again, and a request that is no longer valid fails alone.
+
+        :returns:
+        Y (Numpy array): Output probabilities of all the rows.
+        version (String): Version of the model.
+        errors (List): Error of each request, or None.
+        """
+
+        model, layout, version = self.scorer.snapshot()
+
+        blocks, errors = [], []
+        for X, item_layout, profiles, _ in items:
+            error = None
+            if item_layout is not layout:
+                try:
+                    X, _ = self.encode(profiles, layout)
+                except (KeyError, TypeError, ValueError) as exception:
+                    X, error = csr_matrix((0, layout.n_features), dtype=np.float32), exception
+            blocks.append(X)
+            errors.append(error)
+
+        return predict(model, vstack(blocks, format="csr")), version, errors
+
+    async def _run(self):
+        """
+        Function implementing the batching loop: the first queued request opens a batch, which is closed when it
+        reaches the maximum batch size or when the maximum wait time has elapsed.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            items = [await self._queue.get()]
+            size = items[0][0].shape[0]
+            deadline = loop.time() + self.max_wait
+
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(),
+                                                                                                 timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                items.append(item)
+                size += item[0].shape[0]
+
+            try:
+                Y, version, errors = await loop.run_in_executor(self._executor, self._score, items)
+            except Exception as error:
+                for *_, future in items:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            self.requests += len(items)
+            self.batches += 1
+            self.profiles += len(Y)
+
+            start = 0
+            for (_, _, profiles, future), error in zip(items, errors):
+                if error is not None:
+                    if not future.done():
+                        future.set_exception(error)
+                    continue
+                if not future.done():
+                    future.set_result((Y[start:start + len(profiles)], version))
+                start += len(profiles)
+
+    def stats(self):
+        """
+        Function to report the batching statistics.
+
+        :returns:
+        stats (Python dict): Requests, batches, profiles and mean number of profiles per model call.
+        """
+
+        return {"requests": self.requests,
+                "batches": self.batches,
+                "profiles": self.profiles,
+                "mean_batch_size": self.profiles / self.batches if self.batches else 0.0}
+
+
+# Class implementing the HTTP server
+class PredictionService:
+    """
+    Class implementing a minimal HTTP/1.1 JSON server on top of asyncio streams, with keep-alive connections.
+    """
+
+    def __init__(self, batcher, host="127.0.0.1", port=8000, atlas_dir=None, atlas_paths=None):
+        """
+        :parameter:
+        batcher (MicroBatcher): Micro-batcher of the model calls.
+        host (String): Host to bind.
+        port (Integer): Port to bind.
+        atlas_dir (String): Directory of the municipality risk atlas served by /atlas (the endpoint is disabled if
+        None).
+        atlas_paths (Python dict): Paths to the files whose changes make the atlas out of date (see atlas.py).
+        """
+
+        self.batcher = batcher
+        self.atlas_dir = atlas_dir
+        self.atlas_paths = atlas_paths
+        self.atlas = None
+        self._atlas_key = None
+        self.sensitivity_cache = PredictionCache(max_entries=1000)
+        self.host = host
+        self.port = port
+        self.started = time.time()
+        self._server = None
+
+    async def start(self):
+        """
+        Function to start listening for connections.
+        """
+
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Function to stop the server and the batcher.
+        """
+
+        self._server.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        """
+        Function to start the server and serve requests until cancelled.
+        """
+
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        """
+        Function to write a JSON response.
+        """
+
+        body = json.dumps(payload).encode("utf8")
+        head = (f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        """
+        Function to serve the requests of a connection.
+        """
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request line."}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and (version == "HTTP/1.1" or headers.get("connection", "").lower() == "keep-alive"))
+
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "Invalid Content-Length header."}, False)
+                    break
+                if length > max_body_size:
+                    await self._respond(writer, 413, {"error": "Request body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self._route(method, path, body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        """
+        Function to dispatch a request to its endpoint.
+
+        :returns:
+        status (Integer): HTTP status code.
+        payload (Python dict): JSON payload of the response.
+        """
+
+        url = urlsplit(path)
+        path = url.path
+
+        if path == "/atlas":
+            if method != "GET":
+                return 405, {"error": "Use GET."}
+            return self._atlas({name: values[-1] for name, values in parse_qs(url.query).items()})
+
+        if path == "/sensitivity":
+            if method != "POST":
+                return 405, {"error": "Use POST."}
+            return await self._sensitivity(body)
+
+        if path == "/uncertainty":
+            if method != "POST":
+                return 405, {"error": "Use POST."}
+            return await self._uncertainty(body)
+
+        if path == "/health":
+            if method != "GET":
+                return 405, {"error": "Use GET."}
+            status = {"status": "ok", "uptime": time.time() - self.started, "version": self.batcher.scorer.version}
+            if self.batcher.scorer.watcher is not None:
+                status.update(self.batcher.scorer.watcher.stats())
+            return 200, {**status, **self.batcher.stats()}
+
+        if path != "/predict":
+            return 404, {"error": f"Unknown endpoint: {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST."}
+
+        try:
+            profiles = parse_profiles(body)
+        except ValueError as error:
+            return 400, {"error": str(error)}
+
+        try:
+            Y, version = await self.batcher.submit(profiles)
+        except KeyError as error:
+            return 400, {"error": str(error.args[0]) if error.args else "Missing field."}
+        except (TypeError, ValueError) as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": str(error)}
+
+        return 200, {"version": version, "predictions": get_records(Y)}
+
+    async def _sensitivity(self, body):
+        """
+        Function to compute the sensitivity curves of a profile, cached per encoded profile.
+
+        :parameter:
+        body (Bytes): Request body.
+
+        :returns:
+        status (Integer): HTTP status code.
+        payload (Python dict): JSON payload of the response.
+        """
+
+        from explain import sensitivity
+
+        scorer = self.batcher.scorer
+
+        def curves(profile):
+            model, layout, version = scorer.snapshot()
+            X, _ = self.batcher.encode([profile], layout)
+            return sensitivity(model, layout, X, cache=self.sensitivity_cache, version=version), version
+
+        try:
+            profiles = parse_profiles(body)
+            if len(profiles) != 1:
+                raise ValueError("Expected a single profile.")
+            points, version = await self.batcher.run(curves, profiles[0])
+        except KeyError as error:
+            return 400, {"error": str(error.args[0]) if error.args else "Missing field."}
+        except (TypeError, ValueError) as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": str(error)}
+
+        payload = {"version": version, "crimes": crime_labels, "curves": {}}
+        for field, curve in points.groupby("field", sort=False):
+            payload["curves"][field] = {"values": curve["value"].tolist(),
+                                        "probabilities": curve.iloc[:, 3:].to_numpy(dtype=np.float64).tolist()}
+
+        return 200, payload
+
+    async def _uncertainty(self, body):
+        """
+        Function to compute the uncertainty bands of the probabilities of one or several profiles with Monte Carlo
+        dropout, all the passes of all the profiles being run as a single batch.
+
+        :parameter:
+        body (Bytes): Request body.
+
+        :returns:
+        status (Integer): HTTP status code.
+        payload (Python dict): JSON payload of the response.
+        """
+
+        from uncertainty import mc_predict
+
+        scorer = self.batcher.scorer
+
+        def bands(profiles, n_passes, level, budget):
+            model, layout, version = scorer.snapshot()
+            X, _ = self.batcher.encode(profiles, layout)
+            return mc_predict(model, X, n_passes, level, budget, scorer.dropout_rates()), version
+
+        try:
+            profiles = parse_profiles(body)
+            options = json.loads(body)
+            options = options if isinstance(options, dict) and "profiles" in options else {}
+            n_passes = int(options.get("passes", 200))
+            level = float(options.get("level", 0.9))
+            budget = float(options.get("budget", default_budget))
+            if not 2 <= n_passes <= max_passes or not 0 < level < 1:
+                raise ValueError(f"Expected 2 <= passes <= {max_passes} and 0 < level < 1.")
+            (mean, lower, upper, n_passes), version = await self.batcher.run(bands, profiles, n_passes, level,
+                                                                             budget)
+        except KeyError as error:
+            return 400, {"error": str(error.args[0]) if error.args else "Missing field."}
+        except (TypeError, ValueError) as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": str(error)}
+
+        predictions = [[{**record, "lower": float(low), "upper": float(high)}
+                        for record, low, high in zip(records, lows, highs)]
+                       for records, lows, highs in zip(get_records(mean), lower, upper)]
+
+        return 200, {"version": version, "passes": n_passes, "level": level, "predictions": predictions}
+
+    def current_atlas(self):
+        """
+        Function to return the atlas built from the served model, reopened once another bundle is swapped in or the
+        atlas is rebuilt.
+
+        :returns:
+        atlas (MunicipalityAtlas): Municipality risk atlas, or None if it is disabled, not built or out of date.
+        """
+
+        if self.atlas_dir is None:
+            return None
+
+        from atlas import atlas_sources, get_atlas_key, load_atlas
+
+        scorer = self.batcher.scorer
+        bundle = scorer.watcher.current() if scorer.watcher is not None else None
+        key = get_atlas_key(self.atlas_dir, bundle.hash if bundle is not None else None)
+        if key != self._atlas_key:
+            registry = (bundle.registry() if bundle is not None else None) or scorer.registry
+            self.atlas = load_atlas(registry, self.atlas_dir, self.atlas_paths or atlas_sources, key[0])
+            self._atlas_key = key
+
+        return self.atlas
+
+    def _atlas(self, query):
+        """
+        Function to rank the municipalities of a state with the precomputed atlas.
+
+        :parameter:
+        query (Python dict): Query string parameters.
+
+        :returns:
+        status (Integer): HTTP status code.
+        payload (Python dict): JSON payload of the response.
+        """
+
+        atlas = self.current_atlas()
+        if atlas is None:
+            return 404, {"error": "The municipality atlas is missing or out of date; run 'python atlas.py build'."}
+
+        try:
+            state = query.get("state")
+            if state is not None:
+                state = self.batcher.scorer.registry.encode("state", state)
+                if state is None:
+                    raise KeyError(f"Unknown state: {query['state']}")
+            top = int(query["top"]) if "top" in query else None
+            ranking = atlas.rank(query.get("profile", atlas.profiles[0]),
+                                      query.get("hour", "Not specified"),
+                                      query.get("crime", "Overall"),
+                                      state, top)
+        except KeyError as error:
+            return 400, {"error": str(error.args[0]) if error.args else "Unknown parameter."}
+        except ValueError as error:
+            return 400, {"error": str(error)}
+
+        return 200, {"ranking": ranking.to_dict(orient="records")}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Local HTTP prediction service of the crime predictor.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind.")
+    parser.add_argument("--max-batch-size", type=int, default=256, help="Maximum number of profiles per model call.")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="Maximum time in milliseconds that a request waits for others to join its batch.")
+    parser.add_argument("--backend", choices=["numpy", "keras"], default="numpy", help="Inference backend.")
+    parser.add_argument("--config", default="CrimePredictorConfig.json", help="Model's architecture JSON file.")
+    parser.add_argument("--weights", default="CrimePredictorWeights.h5", help="Model's weights HDF5 file.")
+    parser.add_argument("--bundle", default=None,
+                        help="Model bundle reloaded when it changes (see bundle.py), instead of --config/--weights.")
+    parser.add_argument("--atlas", default="MunicipalityAtlas", help="Directory of the municipality atlas.")
+    args = parser.parse_args()
+
+    from atlas import atlas_sources
+
+    scorer = Scorer(args.backend, args.config, args.weights, args.bundle)
+    service = PredictionService(MicroBatcher(scorer, args.max_batch_size, args.max_wait_ms / 1000),
+                                args.host, args.port, args.atlas,
+                                {**atlas_sources, "config": args.config, "weights": args.weights})
+    if service.current_atlas() is None:
+        print(f"The municipality atlas in {args.atlas} is missing or out of date; /atlas answers 404 until it is "
+              "built.")
+
+    print(f"Serving the crime predictor on http://{args.host}:{args.port}/predict")
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
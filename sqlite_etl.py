@@ -0,0 +1,290 @@
+# Embedded SQLite ETL for the ENVIPE Dataset
+
+"""
+Module Brief Description:
+Local alternative to the MySQL server for building dataset.csv. The tables of sql_script.sql are created in an embedded
+SQLite database, the cleaned CSV files (see clean_csv.py) are bulk-loaded with batched inserts in a single transaction
+per table, secondary indexes are created on the join columns of sql_query.sql, and the query is run and its result
+streamed into a CSV file, so the dataset can be rebuilt on any machine without a database service.
+
+The statements of sql_script.sql and sql_query.sql are reused as they are, except for the translation of the MySQL
+IF(condition, a, b) function into CASE WHEN condition THEN a ELSE b END. As with MySQL's LOAD DATA, empty fields of
+integer columns are loaded as 0.
+
+Usage:
+python sqlite_etl.py --data-dir . --database PSDB.sqlite --output dataset.csv
+python sqlite_etl.py --database PSDB.sqlite --output dataset.csv --skip-load
+"""
+
+# Libraries importation
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+from itertools import islice
+
+# Default paths of the SQL scripts
+script_path = "sql_script.sql"
+query_path = "sql_query.sql"
+
+# Cleaned CSV file of each table, as loaded by sql_script.sql
+table_files = {"TVivienda": "adj_conjunto_de_datos_TVivienda_ENVIPE_2022.csv",
+               "THogar": "adj_conjunto_de_datos_THogar_ENVIPE_2022.csv",
+               "TSDem": "adj_conjunto_de_datos_TSDem_ENVIPE_2022.csv",
+               "TMod_Vic": "adj_conjunto_de_datos_TMod_Vic_ENVIPE_2022.csv",
+               "TPer_Vic1": "adj_conjunto_de_datos_TPer_Vic1_ENVIPE_2022.csv",
+               "TPer_Vic2": "adj_conjunto_de_datos_TPer_Vic2_ENVIPE_2022.csv"}
+
+
+# Function to retrieve the table definitions of sql_script.sql
+def read_table_statements(path=script_path):
+    """
+    Function to retrieve the CREATE TABLE statements of the MySQL script, which SQLite accepts as they are.
+
+    :parameter:
+    path (String): Path to the SQL script.
+
+    :returns:
+    statements (Python dict): CREATE TABLE statement of each table, keyed by table name.
+    """
+
+    with open(path, encoding="utf-8") as file:
+        script = file.read()
+
+    statements = {}
+    for match in re.finditer(r"CREATE TABLE\s+(\w+)\s*\((.*?)\);", script, flags=re.S):
+        statements[match.group(1)] = match.group(0)
+
+    return statements
+
+
+# Function to translate the query into SQLite
+def read_query(path=query_path):
+    """
+    Function to read sql_query.sql and translate its MySQL-specific functions into SQLite.
+
+    :parameter:
+    path (String): Path to the SQL query.
+
+    :returns:
+    query (String): SQLite query.
+    """
+
+    with open(path, encoding="utf-8") as file:
+        query = file.read()
+
+    return re.sub(r"\bIF\(([^,()]+),([^,()]+),([^,()]+)\)", r"CASE WHEN \1 THEN \2 ELSE \3 END", query)
+
+
+# Function to retrieve the join columns of the query
+def get_join_columns(query):
+    """
+    Function to retrieve the columns used in the join conditions of a query.
+
+    :parameter:
+    query (String): SQL query.
+
+    :returns:
+    columns (List): (table, column) tuples, in order of appearance and without repetitions.
+    """
+
+    columns = []
+    for match in re.finditer(r"\bON\s+(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)", query, flags=re.I):
+        for column in ((match.group(1), match.group(2)), (match.group(3), match.group(4))):
+            if column not in columns:
+                columns.append(column)
+
+    return columns
+
+
+# Function to connect to the database
+def connect(path):
+    """
+    Function to open the SQLite database with settings for bulk loading: the data can be rebuilt from the CSV files,
+    so no rollback journal nor synchronous writes are kept.
+
+    :parameter:
+    path (String): Path to the SQLite database.
+
+    :returns:
+    connection (SQLite connection): Connection to the database.
+    """
+
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA temp_store = MEMORY")
+    connection.execute("PRAGMA cache_size = -262144")
+
+    return connection
+
+
+# Function to load a CSV file into a table
+def load_table(connection, table, statement, path, batch_size=50000):
+    """
+    Function to create a table and bulk-load a cleaned CSV file into it with batched inserts in a single transaction.
+
+    :parameter:
+    connection (SQLite connection): Connection to the database.
+    table (String): Name of the table.
+    statement (String): CREATE TABLE statement of the table.
+    path (String): Path to the cleaned CSV file.
+    batch_size (Integer): Number of rows per batch of inserts.
+
+    :returns:
+    rows (Integer): Number of rows loaded.
+    """
+
+    with connection:
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+        connection.execute(statement)
+
+    # Empty fields of integer columns are loaded as 0 by the insert itself, as in LOAD DATA
+    schema = connection.execute(f"PRAGMA table_info({table})").fetchall()
+    values = ["COALESCE(NULLIF(?, ''), 0)" if "INT" in column[2].upper() else "?" for column in schema]
+    insert = f"INSERT INTO {table} VALUES ({', '.join(values)})"
+
+    rows = 0
+    with connection, open(path, encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        while True:
+            batch = list(islice(reader, batch_size))
+            if not batch:
+                break
+            connection.executemany(insert, batch)
+            rows += len(batch)
+
+    return rows
+
+
+# Function to create the indexes of the join columns
+def create_indexes(connection, join_columns):
+    """
+    Function to create secondary indexes on the join columns that are not already the primary key of their table, and
+    to gather the statistics used by the query planner.
+
+    :parameter:
+    connection (SQLite connection): Connection to the database.
+    join_columns (List): (table, column) tuples.
+
+    :returns:
+    indexes (List): Names of the created indexes.
+    """
+
+    indexes = []
+    with connection:
+        for table, column in join_columns:
+            schema = connection.execute(f"PRAGMA table_info({table})").fetchall()
+            primary_key = [row[1] for row in schema if row[5]]
+            if primary_key == [column]:
+                continue
+            name = f"idx_{table}_{column}".lower()
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})")
+            indexes.append(name)
+        connection.execute("ANALYZE")
+
+    return indexes
+
+
+# Function to stream the result of a query into a CSV file
+def export_query(connection, query, output_path, batch_size=50000):
+    """
+    Function to run a query and stream its result into a CSV file, fetching a bounded number of rows at a time.
+
+    :parameter:
+    connection (SQLite connection): Connection to the database.
+    query (String): SQL query.
+    output_path (String): Path to the CSV file.
+    batch_size (Integer): Number of rows fetched at a time.
+
+    :returns:
+    rows (Integer): Number of rows written.
+    """
+
+    cursor = connection.execute(query)
+
+    rows = 0
+    tmp_path = output_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file, lineterminator="\n")
+            writer.writerow([column[0] for column in cursor.description])
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                writer.writerows(batch)
+                rows += len(batch)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return rows
+
+
+# Function to build the dataset
+def build_dataset(data_dir=".", database="PSDB.sqlite", output_path="dataset.csv", skip_load=False,
+                  batch_size=50000, verbose=True):
+    """
+    Function to load the cleaned CSV files into SQLite, index the join columns and export the result of sql_query.sql.
+
+    :parameter:
+    data_dir (String): Directory of the cleaned CSV files.
+    database (String): Path to the SQLite database.
+    output_path (String): Path to the CSV file for the dataset.
+    skip_load (Boolean): Whether to reuse the tables already loaded in the database.
+    batch_size (Integer): Number of rows per batch of inserts and of fetched rows.
+    verbose (Boolean): Whether to report the progress on stderr.
+
+    :returns:
+    stats (Python dict): Rows loaded per table, indexes created, rows exported and elapsed seconds per step.
+    """
+
+    stats = {"tables": {}, "seconds": {}}
+    query = read_query()
+    connection = connect(database)
+
+    try:
+        if not skip_load:
+            start = time.perf_counter()
+            statements = read_table_statements()
+            for table, file_name in table_files.items():
+                stats["tables"][table] = load_table(connection, table, statements[table],
+                                                    os.path.join(data_dir, file_name), batch_size)
+                if verbose:
+                    print(f"{table}: {stats['tables'][table]:,} rows loaded", file=sys.stderr)
+            stats["seconds"]["load"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            stats["indexes"] = create_indexes(connection, get_join_columns(query))
+            stats["seconds"]["index"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stats["rows"] = export_query(connection, query, output_path, batch_size)
+        stats["seconds"]["query"] = time.perf_counter() - start
+    finally:
+        connection.close()
+
+    return stats
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="SQLite ETL of the ENVIPE dataset.")
+    parser.add_argument("--data-dir", default=".", help="Directory of the cleaned CSV files.")
+    parser.add_argument("--database", default="PSDB.sqlite", help="SQLite database file.")
+    parser.add_argument("--output", default="dataset.csv", help="CSV file for the dataset.")
+    parser.add_argument("--batch-size", type=int, default=50000, help="Number of rows per batch.")
+    parser.add_argument("--skip-load", action="store_true", help="Reuse the tables already loaded in the database.")
+    parser.add_argument("--quiet", action="store_true", help="Do not report the progress.")
+    args = parser.parse_args()
+
+    stats = build_dataset(args.data_dir, args.database, args.output, args.skip_load, args.batch_size,
+                          not args.quiet)
+    steps = ", ".join(f"{step} {seconds:.1f} s" for step, seconds in stats["seconds"].items())
+    print(f"Exported {stats['rows']:,} rows into {args.output} ({steps}).")
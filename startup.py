@@ -0,0 +1,244 @@
+# Startup Artifact and Cold-Start Budget for the Crime Predictor App
+
+"""
+Module Brief Description:
+Prebuilt binary artifact with everything the app needs before its first paint: the compiled feature layout and the
+catalogue registry with the per-state index of municipalities. Loading a single pickle replaces parsing
+MunicipalitiesCatalogue.csv, Encoders.json and Scalers.json at import time. The artifact records a fingerprint of its
+source files, of the code of the pickled classes (encoding.py and registry.py) and of the version of the feature layout,
+and is ignored by the app whenever any of them changes.
+
+Usage:
+python startup.py build     # Builds StartupArtifact.pkl from the source files
+python startup.py report    # Reports the import time and first paint of the app against a budget
+"""
+
+# Libraries importation
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+# Default paths
+artifact_path = "StartupArtifact.pkl"
+source_paths = {"catalogue": "MunicipalitiesCatalogue.csv",
+                "encoders": "Encoders.json",
+                "scalers": "Scalers.json"}
+
+# Modules whose code defines the pickled layout and registry, next to this file
+code_modules = ["encoding", "registry"]
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Modules imported at the top of app.py, i.e., before the first paint
+startup_modules = ["numpy", "pandas", "streamlit", "encoding", "catalogues", "registry", "startup", "prediction_cache",
+                   "metrics"]
+
+# Modules imported lazily, only when the Predict page needs them
+lazy_modules = ["plotly.express", "scipy.sparse", "inference", "tensorflow"]
+
+# Default cold-start budget in seconds
+import_budget = 2.0
+first_paint_budget = 2.5
+
+
+# Function to fingerprint the source files of the artifact
+def get_fingerprint(paths=source_paths):
+    """
+    Function to compute the SHA-256 digest of the contents of the source files, the code of the feature layout and
+    catalogue registry, and the version of the feature layout.
+
+    :parameter:
+    paths (Python dict): Paths to the source files.
+
+    :returns:
+    fingerprint (String): Hexadecimal digest.
+    """
+
+    from encoding import layout_version
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"layout_version": layout_version}).encode("utf8"))
+    for name in sorted(paths):
+        with open(paths[name], "rb") as file:
+            digest.update(name.encode("utf8"))
+            digest.update(file.read())
+    for module in code_modules:
+        with open(os.path.join(code_dir, module + ".py"), "rb") as file:
+            digest.update(module.encode("utf8"))
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+
+# Function to build the startup artifact
+def build_artifact(path=artifact_path, paths=source_paths):
+    """
+    Function to build and serialize the startup artifact from the JSON files.
+
+    :parameter:
+    path (String): Path of the output pickle file.
+    paths (Python dict): Paths to the source files.
+
+    :returns:
+    artifact (Python dict): Dictionary with the fingerprint, feature layout, catalogue registry and per-state index of
+    municipalities.
+    """
+
+    from encoding import FeatureLayout
+    from registry import CatalogueRegistry
+
+    layout = FeatureLayout.from_files(paths["encoders"], paths["scalers"])
+    registry = CatalogueRegistry.from_files(paths["catalogue"], layout)
+
+    artifact = {"fingerprint": get_fingerprint(paths),
+                "layout": layout,
+                "registry": registry,
+                "municipality_index": registry.municipality_index()}
+
+    # Atomic write, so that a running app never reads a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(artifact, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    return artifact
+
+
+# Function to load the startup artifact
+def load_artifact(path=artifact_path, paths=source_paths):
+    """
+    Function to load the startup artifact, provided that it is up to date with its source files.
+
+    :parameter:
+    path (String): Path to the pickle file.
+    paths (Python dict): Paths to the source files.
+
+    :returns:
+    artifact (Python dict): Startup artifact, or None if it is missing or stale.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "rb") as file:
+            artifact = pickle.load(file)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+    if artifact.get("fingerprint") != get_fingerprint(paths):
+        return None
+
+    return artifact
+
+
+# Function to time a snippet in a fresh interpreter
+def time_in_subprocess(code, setup="", cwd=None):
+    """
+    Function to measure the wall time of a Python snippet in a fresh interpreter, as in a container cold start.
+
+    :parameter:
+    code (String): Python code to execute.
+    setup (String): Python code to execute before starting the timer.
+    cwd (String): Working directory.
+
+    :returns:
+    seconds (Float): Elapsed time in seconds, or None if the snippet failed.
+    """
+
+    snippet = ("import time\n"
+               f"{setup}\n"
+               "_start = time.perf_counter()\n"
+               f"{code}\n"
+               "print(time.perf_counter() - _start)\n")
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=cwd, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        return None
+
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+# Function to report the cold-start budget
+def report(import_limit=import_budget, first_paint_limit=first_paint_budget, cwd=None):
+    """
+    Function to measure the import time of the app's modules and the time until the first paint of the app, and to
+    compare them against the budget. The first paint is measured as all the work app.py does at module level before
+    its first element is rendered: the startup imports plus loading the catalogues, the feature layout and the
+    catalogue registry (from the artifact when it is available and up to date, otherwise from the source files).
+
+    :parameter:
+    import_limit (Float): Budget in seconds for the modules imported before the first paint.
+    first_paint_limit (Float): Budget in seconds for the first paint of the app.
+    cwd (String): Directory of the app.
+
+    :returns:
+    results (Python dict): Measured times in seconds and whether the budget was met.
+    """
+
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+
+    results = {"modules": {}}
+    for module in startup_modules + lazy_modules:
+        results["modules"][module] = time_in_subprocess(f"import {module}", cwd=cwd)
+
+    imports = "\n".join(f"import {module}" for module in startup_modules)
+    results["startup_imports"] = time_in_subprocess(imports, cwd=cwd)
+    results["artifact_load"] = time_in_subprocess("assert startup.load_artifact() is not None",
+                                                  setup=imports + "\nimport startup", cwd=cwd)
+    results["json_load"] = time_in_subprocess("registry.CatalogueRegistry.from_files().municipality_index()",
+                                              setup=imports + "\nimport startup", cwd=cwd)
+    results["first_paint"] = time_in_subprocess(imports + "\n"
+                                                "import startup\n"
+                                                "if startup.load_artifact() is None:\n"
+                                                "    registry.CatalogueRegistry.from_files().municipality_index()",
+                                                cwd=cwd)
+
+    results["within_budget"] = (results["startup_imports"] is not None
+                                and results["first_paint"] is not None
+                                and results["startup_imports"] <= import_limit
+                                and results["first_paint"] <= first_paint_limit)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Startup artifact and cold-start budget for the crime predictor app.")
+    parser.add_argument("command", choices=["build", "report"])
+    parser.add_argument("--output", default=artifact_path, help="Path of the startup artifact.")
+    parser.add_argument("--import-budget", type=float, default=import_budget,
+                        help="Budget in seconds for the modules imported before the first paint.")
+    parser.add_argument("--first-paint-budget", type=float, default=first_paint_budget,
+                        help="Budget in seconds for the first paint of the app.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        build_artifact(args.output)
+        print(f"{args.output} built in {time.perf_counter() - start:.2f} s.")
+
+    else:
+        results = report(args.import_budget, args.first_paint_budget)
+
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            def fmt(seconds):
+                return "failed" if seconds is None else f"{seconds * 1000:8.1f} ms"
+
+            for module, seconds in results["modules"].items():
+                lazy = " (lazy)" if module in lazy_modules else ""
+                print(f"import {module:<16}{fmt(seconds)}{lazy}")
+            print(f"{'startup imports':<23}{fmt(results['startup_imports'])}  budget {args.import_budget * 1000:.0f} ms")
+            print(f"{'artifact load':<23}{fmt(results['artifact_load'])}")
+            print(f"{'source files load':<23}{fmt(results['json_load'])}")
+            print(f"{'first paint':<23}{fmt(results['first_paint'])}  budget {args.first_paint_budget * 1000:.0f} ms")
+            print("Within budget." if results["within_budget"] else "Over budget.")
+
+        sys.exit(0 if results["within_budget"] else 1)
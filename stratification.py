@@ -0,0 +1,279 @@
+# Iterative Stratification of the Crime Predictor's Labels
+
+"""
+Module Brief Description:
+Drop-in replacement of the iterative_train_test_split function of skmultilearn used in the CrimePredictionMX notebook.
+It implements the same second-order iterative stratification for multi-label data (Sechidis et al., 2011; Szymański
+and Kajdanowicz, 2017), but works on the label matrix only and returns row indices instead of copies of the feature
+matrices.
+
+The pairs of labels of every row are kept in a sparse row-by-combination matrix. At each step, the combination with the
+fewest unassigned rows is taken, and its rows are assigned one by one to the split that most lacks that combination
+(ties broken by the overall size still lacking, then at random). The demands of all the other combinations are then
+updated at once with a sparse product, instead of removing each row from Python lists of every combination it holds.
+The rows without any label fill the remaining sizes of the splits in random order.
+
+The indices are cached on disk, keyed by the SHA-256 hash of the label matrix and the split settings, so repeated runs
+on the same dataset reuse identical splits instantly.
+
+Usage:
+python stratification.py dataset.csv --test-size 0.15 --validation-size 0.20 --seed 0
+python stratification.py dataset.csv --compare    # Also times skmultilearn and reports the label balance of both
+"""
+
+# Libraries importation
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+# Default directory of the cached split indices
+split_cache_dir = os.path.join("FeatureStore", "splits")
+
+
+# Function to build the label combinations of every row
+def get_combinations(Y, order=2, chunksize=100000):
+    """
+    Function to build the sparse matrix of the label combinations (single labels and pairs of labels for the second
+    order) held by every row, keeping only the combinations present in the data.
+
+    :parameter:
+    Y (Numpy array): Label matrix (missing labels count as negative).
+    order (Integer): Order of the combinations, 1 or 2.
+    chunksize (Integer): Number of rows processed at once.
+
+    :returns:
+    C (CSR matrix): Boolean matrix of shape (n_rows, n_combinations).
+    combinations (List): Labels of each combination.
+    """
+
+    Y = np.nan_to_num(np.asarray(Y, dtype=np.float64)) > 0
+    combinations = list(itertools.combinations_with_replacement(range(Y.shape[1]), order))
+    first = np.array([combination[0] for combination in combinations])
+    last = np.array([combination[-1] for combination in combinations])
+
+    C = vstack([csr_matrix(Y[start:start + chunksize, first] & Y[start:start + chunksize, last])
+                for start in range(0, max(len(Y), 1), chunksize)], format="csr")
+    present = np.flatnonzero(np.asarray(C.sum(axis=0)).reshape(-1))
+
+    return C[:, present].tocsr(), [combinations[i] for i in present]
+
+
+# Function to stratify the rows into several splits
+def iterative_stratification(Y, proportions, order=2, seed=None):
+    """
+    Function to assign every row to a split with the iterative stratification for multi-label data.
+
+    :parameter:
+    Y (Numpy array): Label matrix (missing labels count as negative).
+    proportions (List): Fraction of the rows of each split.
+    order (Integer): Order of the label combinations, 1 or 2.
+    seed (Integer): Seed of the tie breaks and of the rows without labels.
+
+    :returns:
+    splits (Numpy array): Split of each row.
+    """
+
+    rng = np.random.default_rng(seed)
+    proportions = np.asarray(proportions, dtype=np.float64)
+    n_rows = len(Y)
+    n_splits = len(proportions)
+
+    C, _ = get_combinations(Y, order)
+    C_columns = C.tocsc()
+
+    # Rows still lacking in each split, overall and for every combination
+    desired = proportions * n_rows
+    desired_combinations = np.asarray(C.sum(axis=0)).reshape(-1, 1) * proportions
+    remaining = np.asarray(C.sum(axis=0), dtype=np.float64).reshape(-1)
+
+    splits = np.full(n_rows, -1, dtype=np.int64)
+    while (remaining > 0).any():
+        combination = int(np.argmin(np.where(remaining > 0, remaining, np.inf)))
+
+        # Unassigned rows of the combination, from the last one as in skmultilearn
+        rows = C_columns.indices[C_columns.indptr[combination]:C_columns.indptr[combination + 1]]
+        rows = np.sort(rows[splits[rows] < 0])[::-1]
+
+        lacking = desired_combinations[combination].tolist()
+        sizes = desired.tolist()
+        chosen = np.empty(len(rows), dtype=np.int64)
+        for i in range(len(rows)):
+            candidates = [j for j in range(n_splits) if lacking[j] == max(lacking)]
+            if len(candidates) > 1:
+                largest = max(sizes[j] for j in candidates)
+                candidates = [j for j in candidates if sizes[j] == largest]
+            split = candidates[0] if len(candidates) == 1 else candidates[rng.integers(len(candidates))]
+            lacking[split] -= 1
+            sizes[split] -= 1
+            chosen[i] = split
+
+        # Demands of all the combinations held by the assigned rows
+        splits[rows] = chosen
+        assigned = csr_matrix((np.ones(len(rows)), (np.arange(len(rows)), chosen)), shape=(len(rows), n_splits))
+        desired_combinations -= (C[rows].T @ assigned).toarray()
+        desired -= np.bincount(chosen, minlength=n_splits)
+        remaining -= np.asarray(C[rows].sum(axis=0)).reshape(-1)
+
+    # Rows without labels fill the remaining sizes in random order
+    rows = rng.permutation(np.flatnonzero(splits < 0))
+    slots = np.repeat(np.arange(n_splits), np.ceil(np.clip(desired, 0, None)).astype(np.int64))
+    slots = rng.permutation(slots)[:len(rows)]
+    if len(slots) < len(rows):
+        slots = np.concatenate([slots, rng.choice(n_splits, len(rows) - len(slots), p=proportions)])
+    splits[rows] = slots
+
+    return splits
+
+
+# Function to split the rows into training and testing sets
+def iterative_train_test_split(Y, test_size=0.15, order=2, seed=None):
+    """
+    Function to split the rows into a training and a testing set with the iterative stratification, as the function
+    of skmultilearn but returning row indices.
+
+    :parameter:
+    Y (Numpy array): Label matrix (missing labels count as negative).
+    test_size (Float): Fraction of the rows for testing.
+    order (Integer): Order of the label combinations, 1 or 2.
+    seed (Integer): Seed of the random number generator.
+
+    :returns:
+    train (Numpy array): Row indices of the training set.
+    test (Numpy array): Row indices of the testing set.
+    """
+
+    splits = iterative_stratification(Y, [test_size, 1 - test_size], order, seed)
+
+    return np.flatnonzero(splits == 1), np.flatnonzero(splits == 0)
+
+
+# Function to compute the key of the split indices
+def get_key(Y, test_size=0.15, validation_size=0.20, order=2, seed=0):
+    """
+    Function to compute the SHA-256 key of the label matrix and the split settings.
+
+    :parameter:
+    Y (Numpy array): Label matrix.
+    test_size (Float): Fraction of the rows for testing.
+    validation_size (Float): Fraction of the training rows for validation.
+    order (Integer): Order of the label combinations.
+    seed (Integer): Seed of the random number generator.
+
+    :returns:
+    key (String): Hexadecimal digest.
+    """
+
+    Y = np.ascontiguousarray(np.nan_to_num(np.asarray(Y, dtype=np.float64)) > 0)
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"shape": Y.shape, "test_size": test_size, "validation_size": validation_size,
+                              "order": order, "seed": seed}).encode("utf8"))
+    digest.update(np.packbits(Y).tobytes())
+
+    return digest.hexdigest()
+
+
+# Function to split the rows into the training, validation and testing sets
+def get_split_indices(Y, test_size=0.15, validation_size=0.20, order=2, seed=0, directory=split_cache_dir):
+    """
+    Function to split the rows as in the notebook, first the testing set and then the validation set out of the
+    remaining rows, reusing the indices cached for the same label matrix and settings.
+
+    :parameter:
+    Y (Numpy array): Label matrix (missing labels count as negative).
+    test_size (Float): Fraction of the rows for testing.
+    validation_size (Float): Fraction of the training rows for validation.
+    order (Integer): Order of the label combinations.
+    seed (Integer): Seed of the random number generator.
+    directory (String): Directory of the cached indices (no cache if None).
+
+    :returns:
+    train (Numpy array): Row indices of the training set.
+    validation (Numpy array): Row indices of the validation set.
+    test (Numpy array): Row indices of the testing set.
+    """
+
+    path = None
+    if directory is not None:
+        path = os.path.join(directory, get_key(Y, test_size, validation_size, order, seed) + ".npz")
+        if os.path.exists(path):
+            with np.load(path) as cached:
+                return cached["train"], cached["validation"], cached["test"]
+
+    Y = np.asarray(Y)
+    train_validation, test = iterative_train_test_split(Y, test_size, order, seed)
+    train, validation = iterative_train_test_split(Y[train_validation], validation_size, order,
+                                                   None if seed is None else seed + 1)
+    train, validation = train_validation[train], train_validation[validation]
+
+    if path is not None:
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, train=train, validation=validation, test=test)
+        os.replace(tmp_path, path)
+
+    return train, validation, test
+
+
+# Function to report the label balance of the splits
+def get_balance(Y, splits):
+    """
+    Function to compare the positive rate of every label in each split against the whole dataset.
+
+    :parameter:
+    Y (Numpy array): Label matrix (missing labels count as negative).
+    splits (Python dict): Row indices of each split, keyed by split name.
+
+    :returns:
+    balance (Pandas dataframe): Number of rows and largest absolute deviation of the positive rates of each split.
+    """
+
+    import pandas as pd
+
+    Y = np.nan_to_num(np.asarray(Y, dtype=np.float64)) > 0
+    rates = Y.mean(axis=0)
+
+    return pd.DataFrame({name: {"rows": len(rows), "max_deviation": float(np.abs(Y[rows].mean(axis=0) - rates).max())}
+                         for name, rows in splits.items()}).T
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Iterative stratification of the crime predictor's labels.")
+    parser.add_argument("source", nargs="?", default="dataset.csv", help="Output of sql_query.sql (CSV or Parquet).")
+    parser.add_argument("--test-size", type=float, default=0.15, help="Fraction of the rows for testing.")
+    parser.add_argument("--validation-size", type=float, default=0.20,
+                        help="Fraction of the training rows for validation.")
+    parser.add_argument("--order", type=int, choices=[1, 2], default=2, help="Order of the label combinations.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator.")
+    parser.add_argument("--directory", default=split_cache_dir, help="Directory of the cached indices.")
+    parser.add_argument("--compare", action="store_true", help="Also split with skmultilearn and compare.")
+    args = parser.parse_args()
+
+    from catalogues import label_columns
+    from dataset import read_dataset
+
+    Y = np.concatenate([chunk[label_columns].to_numpy(dtype=np.float32) for chunk in read_dataset(args.source)])
+
+    start = time.perf_counter()
+    train, validation, test = get_split_indices(Y, args.test_size, args.validation_size, args.order, args.seed,
+                                                args.directory)
+    print(f"Split {len(Y):,} rows in {time.perf_counter() - start:.2f} s.")
+    print(get_balance(Y, {"train": train, "validation": validation, "test": test}).to_string())
+
+    if args.compare:
+        from skmultilearn.model_selection import iterative_train_test_split as skmultilearn_split
+
+        start = time.perf_counter()
+        Y_labels = np.nan_to_num(Y.astype(np.float64))
+        rows = np.arange(len(Y)).reshape(-1, 1)
+        train_validation, Y_train_validation, test, _ = skmultilearn_split(rows, Y_labels, test_size=args.test_size)
+        train, _, validation, _ = skmultilearn_split(train_validation, Y_train_validation,
+                                                     test_size=args.validation_size)
+        print(f"skmultilearn split {len(Y):,} rows in {time.perf_counter() - start:.2f} s.")
+        print(get_balance(Y, {"train": train[:, 0], "validation": validation[:, 0], "test": test[:, 0]}).to_string())
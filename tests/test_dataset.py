@@ -0,0 +1,46 @@
+# Regression Tests of the Dataset Builder
+
+"""
+Module Brief Description:
+Checks that the vectorized and chunked preparation of dataset.py gives the same predictors and labels as the
+row-by-row code of the CrimePredictionMX notebook, on a synthetic output of sql_query.sql with missing and unexpected
+answers.
+
+Usage:
+python -m pytest -q tests
+"""
+
+# Libraries importation
+import os
+import pandas as pd
+import pytest
+from catalogues import label_columns
+from dataset import feature_columns, notebook_reference, prepare_chunk, sample_source, verify
+
+# Repository root, where the municipalities catalogue is
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def source(monkeypatch):
+    monkeypatch.chdir(root)
+    return sample_source(2000)
+
+
+def test_verify(source):
+    seconds = verify(None, 2000)
+    assert set(seconds) == {"reference", "vectorized"}
+
+
+@pytest.mark.parametrize("chunksize", [2000, 700])
+def test_prepare_chunk(source, chunksize):
+    X_reference, Y_reference = notebook_reference(source)
+    prepared = pd.concat([prepare_chunk(source.iloc[i:i + chunksize]) for i in range(0, len(source), chunksize)],
+                         ignore_index=True)
+
+    assert list(prepared.columns) == feature_columns + label_columns
+    pd.testing.assert_frame_equal(prepared[feature_columns].astype(object).where(prepared[feature_columns].notna()),
+                                  X_reference.astype(object).where(X_reference.notna()),
+                                  check_dtype=False, check_exact=True)
+    pd.testing.assert_frame_equal(prepared[label_columns], Y_reference.astype("Float64").astype(float),
+                                  check_dtype=False, check_exact=True)
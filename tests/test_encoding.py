@@ -0,0 +1,92 @@
+# Regression Tests of the Compiled Feature Layout
+
+"""
+Module Brief Description:
+Checks that the compiled feature layout reproduces the training matrix of the CrimePredictionMX notebook (X_sc) that
+the shipped weights were trained on: the notebook rows are encoded with the OneHotEncoder and MaxAbsScaler
+ColumnTransformers of the notebook (cells 165 to 177) and compared against FeatureLayout.
+
+Usage:
+python -m pytest -q tests
+"""
+
+# Libraries importation
+import json
+import os
+import numpy as np
+import pytest
+from encoding import FeatureLayout, categorical_fields
+
+# Repository root, where the serialized encoders and scalers are
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# First rows of X in the notebook (cell 155), with the columns in the order of new_order
+notebook_columns = ["housing_class", "kinship", "education", "activity", "job", "sex", "metro_area", "month", "state",
+                    "municipality", "hour", "place", "category", "social_class", "people_household", "age"]
+notebook_rows = [[1, 1, 8, 1, 2, 2, 14, 11, 1, 1.1, 2, 1, "U", 4, 1, 28],
+                 [1, 1, 8, 6, 0, 2, 14, 11, 1, 1.1, 1, 9, "U", 3, 2, 73]]
+
+# First and last three columns of the same rows of X_sc, as printed in the notebook (cell 179)
+notebook_edges = [[0.05263158, 0.28571429, 1.0, 0.0, 0.0, 1.0],
+                  [0.10526316, 0.74489796, 1.0, 0.0, 1.0, 0.0]]
+
+
+@pytest.fixture(scope="module")
+def layout():
+    return FeatureLayout.from_files(os.path.join(root, "Encoders.json"), os.path.join(root, "Scalers.json"))
+
+
+# Function to encode rows with the pipeline of the notebook
+def get_notebook_matrix(rows):
+    """
+    Function to encode rows with the ColumnTransformers of the notebook, the MaxAbs scalers being fitted on a row
+    holding the maximum values of Scalers.json.
+    """
+
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import MaxAbsScaler, OneHotEncoder
+
+    with open(os.path.join(root, "Encoders.json")) as file:
+        encoders = json.load(file)
+    with open(os.path.join(root, "Scalers.json")) as file:
+        scalers = json.load(file)
+
+    ct = ColumnTransformer([(f"encoder_{field}", OneHotEncoder(categories=encoders[field], handle_unknown="ignore"),
+                             [i]) for i, field in enumerate(categorical_fields)], remainder="passthrough")
+    ct_sc = ColumnTransformer([("scaler_people_household", MaxAbsScaler(), [2381]),
+                               ("scaler_age", MaxAbsScaler(), [2382])], remainder="passthrough")
+
+    maximum_row = list(rows[0][:-2]) + [scalers["people_housing"], scalers["age"]]
+    X = np.array(list(rows) + [maximum_row], dtype=object)
+    X_sc = ct_sc.fit_transform(ct.fit_transform(X))
+    X_sc = X_sc.toarray() if hasattr(X_sc, "toarray") else np.asarray(X_sc)
+
+    return X_sc[:len(rows)].astype(np.float64)
+
+
+def get_profiles(rows):
+    return {field: [row[i] for row in rows] for i, field in enumerate(notebook_columns)}
+
+
+def test_numerical_columns_first(layout):
+    assert layout.offsets["people_household"] == 0
+    assert layout.offsets["age"] == 1
+    assert layout.offsets[categorical_fields[0]] == 2
+    assert layout.n_features == 2383
+
+
+def test_notebook_printed_values(layout):
+    X = layout.encode_batch(get_profiles(notebook_rows), sparse=False)
+    edges = np.hstack([X[:, :3], X[:, -3:]])
+    np.testing.assert_allclose(edges, notebook_edges, atol=1e-8)
+
+
+def test_notebook_pipeline(layout):
+    pytest.importorskip("sklearn")
+    expected = get_notebook_matrix(notebook_rows)
+
+    np.testing.assert_allclose(layout.encode_batch(get_profiles(notebook_rows), sparse=False), expected)
+    for i, row in enumerate(notebook_rows):
+        profile = dict(zip(notebook_columns, row))
+        np.testing.assert_allclose(layout.encode(profile)[0], expected[i])
+        np.testing.assert_allclose(layout.encode(profile, sparse=True).toarray()[0], expected[i])
@@ -0,0 +1,78 @@
+# Regression Tests of the NumPy Inference Engine
+
+"""
+Module Brief Description:
+Checks that the TensorFlow-free engine reproduces the predictions of the Keras model on sparse and dense input
+matrices, and that the quantized float16 and int8 engines stay within their tolerances of the float32 engine. A small
+random Sequential model with the layer names of CrimePredictorConfig.json is serialized in the same way as the
+shipped model, so the trained weights are not needed.
+
+Usage:
+python -m pytest -q tests
+"""
+
+# Libraries importation
+import os
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from encoding import FeatureLayout
+from inference import (NumpyModel, QuantizedModel, check_parity, export_quantized, quantization_tolerances,
+                       sample_input)
+
+# Repository root, where the serialized encoders and scalers are
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def layout():
+    return FeatureLayout.from_files(os.path.join(root, "Encoders.json"), os.path.join(root, "Scalers.json"))
+
+
+@pytest.fixture(scope="module")
+def X(layout):
+    return sample_input(layout, 256)
+
+
+@pytest.fixture(scope="module")
+def keras_model(layout):
+    keras = pytest.importorskip("tensorflow").keras
+    keras.utils.set_random_seed(0)
+
+    # Same layers as CrimePredictorConfig.json, with fewer hidden units
+    return keras.Sequential([keras.Input(shape=(layout.n_features,)),
+                             keras.layers.Dense(64, activation="relu", name="dense"),
+                             keras.layers.Dropout(0.1, name="dropout"),
+                             keras.layers.Dense(32, activation="relu", name="dense_1"),
+                             keras.layers.Dropout(0.1, name="dropout_1"),
+                             keras.layers.Dense(19, activation="sigmoid", name="dense_2")])
+
+
+@pytest.fixture(scope="module")
+def numpy_model(keras_model, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("model")
+    with open(directory / "CrimePredictorConfig.json", "w") as json_file:
+        json_file.write(keras_model.to_json())
+    keras_model.save_weights(str(directory / "CrimePredictorWeights.weights.h5"))
+
+    return NumpyModel.from_files(str(directory / "CrimePredictorConfig.json"),
+                                 str(directory / "CrimePredictorWeights.weights.h5"))
+
+
+def test_dense_parity(numpy_model, keras_model, X):
+    assert check_parity(numpy_model, keras_model, X, atol=1e-5) <= 1e-5
+
+
+def test_sparse_parity(numpy_model, keras_model, X):
+    np.testing.assert_allclose(numpy_model.predict(csr_matrix(X)), keras_model.predict(X, verbose=0), rtol=0,
+                               atol=1e-5)
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_quantized_tolerance(numpy_model, X, quantization, tmp_path):
+    export_quantized(numpy_model, str(tmp_path / f"weights.{quantization}.npz"), quantization)
+    quantized_model = QuantizedModel.from_file(str(tmp_path / f"weights.{quantization}.npz"))
+
+    assert quantized_model.quantization == quantization
+    np.testing.assert_allclose(quantized_model.predict(csr_matrix(X)), numpy_model.predict(X), rtol=0,
+                               atol=quantization_tolerances[quantization])
@@ -0,0 +1,110 @@
+# Regression Tests of the Scoring Entry Points
+
+"""
+Module Brief Description:
+Checks that a profile is encoded into the same input array by the app (one profile at a time, with the month and place
+it does not ask for) and by the batch scorer (whole columns, with the missing month and place columns filled with
+their default labels), and that a file is scored chunk by chunk into a single Parquet output, with its invalid rows
+reported instead of scored.
+
+Usage:
+python -m pytest -q tests
+"""
+
+# Libraries importation
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from batch_scoring import ChunkWriter, Scorer, read_chunks
+from catalogues import default_labels, label_columns
+from encoding import FeatureLayout
+from inference import NumpyModel
+from registry import CatalogueRegistry
+
+# Repository root, where the catalogue and the serialized encoders and scalers are
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Profile with the labels of the app's select boxes
+profile = {"sex": "Female",
+           "age": 30,
+           "education": "Bachelor or professional",
+           "activity": "Worker",
+           "job": "Employee or worker",
+           "social_class": "Higher middle income",
+           "category": "Urban",
+           "housing_class": "Apartment in building",
+           "people_household": 3,
+           "kinship": "Spouse",
+           "state": "Jalisco",
+           "metro_area": "Guadalajara",
+           "municipality": "Zapopan",
+           "hour": "Night"}
+
+
+@pytest.fixture(scope="module")
+def registry():
+    layout = FeatureLayout.from_files(os.path.join(root, "Encoders.json"), os.path.join(root, "Scalers.json"))
+    return CatalogueRegistry.from_files(os.path.join(root, "MunicipalitiesCatalogue.csv"), layout)
+
+
+def test_default_labels_are_encoded(registry):
+    encoded = registry.profile({**profile, **default_labels})
+    assert encoded["month"] is not None and encoded["place"] is not None
+
+
+def test_app_and_batch_vectors(registry):
+    # Input array of the app (see app.get_input_array)
+    app_array = registry.layout.encode(registry.profile({**profile, **default_labels}))
+
+    # Input array of the batch scorer, without loading the model
+    scorer = Scorer.__new__(Scorer)
+    scorer.registry = registry
+    batch_array = registry.layout.encode_batch(scorer.encode(pd.DataFrame([profile]), strict=True), sparse=False)
+
+    np.testing.assert_array_equal(app_array, batch_array)
+
+
+@pytest.fixture(scope="module")
+def scorer(registry):
+    # Scorer with a small random model, without loading the trained one
+    rng = np.random.default_rng(0)
+    n_inputs = registry.layout.n_features
+    model = NumpyModel([rng.normal(size=(n_inputs, 8)), rng.normal(size=(8, len(label_columns)))],
+                       [rng.normal(size=8), rng.normal(size=len(label_columns))], ["relu", "sigmoid"])
+
+    scorer = Scorer.__new__(Scorer)
+    scorer.registry = registry
+    scorer.watcher = None
+    scorer._model, scorer._layout, scorer._version = model, registry.layout, None
+    return scorer
+
+
+def test_multi_chunk_parquet(scorer, tmp_path):
+    # Integer ages in the first chunk, and a blank age and an unknown municipality in the second one
+    profiles = pd.DataFrame([profile] * 6)
+    profiles["age"] = profiles["age"].astype(object)
+    profiles.loc[4, "age"] = None
+    profiles.loc[5, "municipality"] = "Zapopann"
+    profiles.to_csv(tmp_path / "profiles.csv", index=False)
+
+    writer = ChunkWriter(str(tmp_path / "scores.parquet"))
+    for chunk in read_chunks(str(tmp_path / "profiles.csv"), 3):
+        writer.write(scorer.score(chunk))
+    writer.close()
+
+    scores = pd.read_parquet(tmp_path / "scores.parquet")
+    assert len(scores) == 6
+    assert scores["error"].isna().tolist() == [True] * 4 + [False] * 2
+    assert scores["error"].tolist()[4:] == ["Missing or invalid age: nan", "Unknown municipality label: Zapopann"]
+    assert scores.loc[:3, label_columns].notna().all().all()
+    assert scores.loc[4:, label_columns].isna().all().all()
+
+    # Valid rows get the same scores in any chunk
+    np.testing.assert_allclose(scores.loc[:3, label_columns].to_numpy(),
+                               np.repeat(scores.loc[:0, label_columns].to_numpy(), 4, axis=0))
+
+
+def test_strict_encoding(scorer):
+    with pytest.raises(ValueError, match="Unknown municipality label: Zapopann"):
+        scorer.encode(pd.DataFrame([{**profile, "municipality": "Zapopann"}]), strict=True)
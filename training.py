@@ -0,0 +1,268 @@
+# Training of the Crime Predictor
+
+"""
+Module Brief Description:
+Reusable version of the model creation and fitting of the CrimePredictionMX notebook, with a sparse-aware input
+pipeline. Instead of feeding the whole one-hot matrix to Keras (or densifying it with toarray() for evaluation), the
+CSR matrix is streamed in shuffled batches through tf.data as tf.SparseTensor, which the first Dense layer multiplies
+directly. Only the ~16 non-zeros of each row are kept in memory, so larger multi-year ENVIPE datasets train within a
+fixed RAM budget. The trained weights are saved into a copy of the model with a dense input, so CrimePredictorConfig.json
+and CrimePredictorWeights.h5 have the same layout as the notebook's and are loaded as is by app.py.
+
+Usage:
+python training.py dataset.csv --epochs 100 --batch-size 32
+"""
+
+# Libraries importation
+import argparse
+import sys
+import time
+import numpy as np
+
+
+# Function to convert a batch of CSR rows into a sparse tensor
+def to_sparse_tensor(X):
+    """
+    Function to convert a CSR matrix into a tf.SparseTensor without densifying it.
+
+    :parameter:
+    X (CSR matrix): Input matrix.
+
+    :returns:
+    sparse_tensor (tf.SparseTensor): Sparse tensor of the same shape, in row-major order.
+    """
+
+    import tensorflow as tf
+
+    rows = np.repeat(np.arange(X.shape[0], dtype=np.int64), np.diff(X.indptr))
+    indices = np.column_stack([rows, np.asarray(X.indices, dtype=np.int64)])
+    sparse_tensor = tf.SparseTensor(indices, np.asarray(X.data, dtype=np.float32), X.shape)
+
+    return sparse_tensor if X.has_sorted_indices else tf.sparse.reorder(sparse_tensor)
+
+
+# Function to build the input pipeline
+def get_dataset(X, Y=None, batch_size=32, shuffle=True, seed=None):
+    """
+    Function to build a tf.data pipeline streaming batches of CSR rows as tf.SparseTensor. The rows are reshuffled at
+    every epoch, and the next batches are prepared while the current one is being trained on.
+
+    :parameter:
+    X (CSR matrix): Input matrix (memory-mapped arrays are supported, see feature_store.py).
+    Y (Numpy array): Label matrix (None for prediction).
+    batch_size (Integer): Number of rows per batch.
+    shuffle (Boolean): Whether to shuffle the rows at every epoch.
+    seed (Integer): Seed of the shuffling.
+
+    :returns:
+    dataset (tf.data.Dataset): Dataset of (inputs, labels) batches, or of inputs only if Y is None.
+    """
+
+    import tensorflow as tf
+
+    n_rows, n_features = X.shape
+    rng = np.random.default_rng(seed)
+
+    def batches():
+        # Shuffled rows are gathered in ascending order, which keeps the reads of memory-mapped arrays local
+        order = rng.permutation(n_rows) if shuffle else None
+        for start in range(0, n_rows, batch_size):
+            rows = np.sort(order[start:start + batch_size]) if shuffle else slice(start, start + batch_size)
+            inputs = to_sparse_tensor(X[rows])
+            if Y is None:
+                yield inputs
+            else:
+                yield inputs, np.asarray(Y[rows], dtype=np.float32)
+
+    inputs_spec = tf.SparseTensorSpec(shape=[None, n_features], dtype=tf.float32)
+    if Y is None:
+        signature = inputs_spec
+    else:
+        signature = (inputs_spec, tf.TensorSpec(shape=[None, Y.shape[1]], dtype=tf.float32))
+
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=signature)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(-(-n_rows // batch_size)))
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+# Function to create the model
+def create_model(n_inputs, n_outputs, sparse=True, units=(1201, 610), dropout=0.10, learning_rate=0.001):
+    """
+    Function to create the multi-layer perceptron for multi-label classification of the notebook.
+
+    :parameter:
+    n_inputs (Integer): Dimension of the input matrix.
+    n_outputs (Integer): Dimension of the output nodes.
+    sparse (Boolean): Whether the model takes tf.SparseTensor inputs.
+    units (Tuple): Number of units of each hidden layer.
+    dropout (Float): Dropout rate after each hidden layer.
+    learning_rate (Float): Learning rate of the Adam optimizer.
+
+    :returns:
+    model (Keras object): Compiled model.
+    """
+
+    import tensorflow as tf
+    import tensorflow_addons as tfa
+    from tensorflow.keras import Input
+    from tensorflow.keras.layers import Dense, Dropout
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.optimizers import Adam
+
+    # Initialization of the NN
+    model = Sequential()
+    model.add(Input(shape=(n_inputs,), sparse=sparse))
+
+    # Multi Layer Perceptron
+    model.add(Dense(units[0], kernel_initializer='he_uniform', activation='relu'))
+    model.add(Dropout(dropout))
+    for n_units in units[1:]:
+        model.add(Dense(n_units, activation='relu'))
+        model.add(Dropout(dropout))
+    model.add(Dense(n_outputs, activation='sigmoid'))
+
+    # Model compilation
+    model.compile(loss='binary_crossentropy',
+                  optimizer=Adam(learning_rate=learning_rate),
+                  metrics=[tfa.metrics.F1Score(num_classes=n_outputs, threshold=0.5),
+                           tf.keras.metrics.Precision(),
+                           tf.keras.metrics.Recall(),
+                           tf.keras.metrics.AUC(),
+                           tf.keras.metrics.Accuracy()])
+
+    return model
+
+
+# Function to fit the model
+def fit_model(X_train, Y_train, X_validation, Y_validation, epochs=100, precision_threshold=0.95, batch_size=32,
+              seed=None, verbose=2, units=(1201, 610), dropout=0.10, learning_rate=0.001, callbacks=None):
+    """
+    Function to fit the multi-label classification model on sparse batches. As in the notebook, the training stops
+    early when the precision reaches the provided threshold, or when the validation loss stops improving.
+
+    :parameter:
+    X_train (CSR matrix): Predictors set for training.
+    Y_train (Numpy array): Labels set for training.
+    X_validation (CSR matrix): Predictors set for validation.
+    Y_validation (Numpy array): Labels set for validation.
+    epochs (Integer): Number of epochs for training.
+    precision_threshold (Float): Precision threshold for triggering the callback for early stop.
+    batch_size (Integer): Number of rows per batch.
+    seed (Integer): Seed of the shuffling.
+    verbose (Integer): Verbosity mode of Keras.
+    units (Tuple): Number of units of each hidden layer.
+    dropout (Float): Dropout rate after each hidden layer.
+    learning_rate (Float): Learning rate of the Adam optimizer.
+    callbacks (List): Additional Keras callbacks, e.g., for pruning the trials of a search (see search.py).
+
+    :returns:
+    model (Keras object): Trained model.
+    history (Keras object): Log with the details of the training.
+    """
+
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import EarlyStopping
+
+    model = create_model(X_train.shape[1], Y_train.shape[1], units=units, dropout=dropout,
+                         learning_rate=learning_rate)
+
+    class CallbackStop(tf.keras.callbacks.Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            if (logs or {}).get('precision', 0) > precision_threshold:
+                print(f'The precision threshold of {precision_threshold:.0%} has been reached. Stop Training.')
+                self.model.stop_training = True
+
+    callback_es = EarlyStopping(monitor='val_loss',
+                                mode='min',
+                                verbose=1,
+                                patience=5,
+                                start_from_epoch=5,
+                                restore_best_weights=False)
+
+    history = model.fit(get_dataset(X_train, Y_train, batch_size, shuffle=True, seed=seed),
+                        validation_data=get_dataset(X_validation, Y_validation, batch_size, shuffle=False),
+                        epochs=epochs,
+                        shuffle=False,
+                        callbacks=[CallbackStop(), callback_es] + list(callbacks or []),
+                        verbose=verbose)
+
+    return model, history
+
+
+# Function to predict on a sparse matrix
+def predict_model(model, X, batch_size=1024):
+    """
+    Function to predict the probabilities of a CSR matrix in sparse batches, without densifying it.
+
+    :parameter:
+    model (Keras object): Model taking tf.SparseTensor inputs.
+    X (CSR matrix): Input matrix.
+    batch_size (Integer): Number of rows per batch.
+
+    :returns:
+    Y_probs (Numpy array): Probabilities of shape (n_rows, n_outputs).
+    """
+
+    return model.predict(get_dataset(X, batch_size=batch_size, shuffle=False), verbose=0)
+
+
+# Function to save the trained model
+def save_model(model, config_path="CrimePredictorConfig.json", weights_path="CrimePredictorWeights.h5"):
+    """
+    Function to save the model's architecture and weights, as in the notebook. A model with sparse inputs is first
+    copied into the same model with a dense input, which is the architecture expected by app.py.
+
+    :parameter:
+    model (Keras object): Trained model.
+    config_path (String): Path to the model's architecture JSON file.
+    weights_path (String): Path to the model's weights HDF5 file (Keras 3 requires the ".weights.h5" extension).
+    """
+
+    from tensorflow.keras.layers import Dense, Dropout
+
+    dense_layers = [layer for layer in model.layers if isinstance(layer, Dense)]
+    dropout_layers = [layer for layer in model.layers if isinstance(layer, Dropout)]
+    dense_model = create_model(dense_layers[0].kernel.shape[0], dense_layers[-1].units, sparse=False,
+                               units=tuple(layer.units for layer in dense_layers[:-1]),
+                               dropout=dropout_layers[0].rate if dropout_layers else 0.0)
+    dense_model.set_weights(model.get_weights())
+    model = dense_model
+
+    with open(config_path, "w") as json_file:
+        json_file.write(model.to_json())
+
+    model.save_weights(weights_path)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Training of the crime predictor on sparse batches.")
+    parser.add_argument("source", nargs="?", default="dataset.csv", help="Output of sql_query.sql (CSV or Parquet).")
+    parser.add_argument("--store", default="FeatureStore", help="Directory of the feature store.")
+    parser.add_argument("--epochs", type=int, default=100, help="Number of epochs for training.")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of rows per batch.")
+    parser.add_argument("--precision-threshold", type=float, default=0.95, help="Precision for stopping early.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the shuffling.")
+    parser.add_argument("--config", default="CrimePredictorConfig.json", help="Output architecture JSON file.")
+    parser.add_argument("--weights", default=None,
+                        help="Output weights HDF5 file (CrimePredictorWeights.h5, or .weights.h5 with Keras 3).")
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    from feature_store import get_split, get_store
+
+    start = time.perf_counter()
+    store = get_store(args.source, args.store)
+    X_train, Y_train = get_split(store, "train")
+    X_validation, Y_validation = get_split(store, "validation")
+    print(f"Training matrices ready in {time.perf_counter() - start:.1f} s.", file=sys.stderr)
+
+    tf.keras.backend.clear_session()
+    model, history = fit_model(X_train, Y_train, X_validation, Y_validation, args.epochs, args.precision_threshold,
+                               args.batch_size, args.seed)
+
+    weights_path = args.weights or ("CrimePredictorWeights.h5" if int(tf.keras.__version__.split(".")[0]) < 3
+                                    else "CrimePredictorWeights.weights.h5")
+    save_model(model, args.config, weights_path)
+    print(f"Model saved into {args.config} and {weights_path}.")
@@ -0,0 +1,232 @@
+# Monte Carlo Dropout Uncertainty of the Crime Predictor
+
+"""
+Module Brief Description:
+Uncertainty bands of the 19 crime probabilities with Monte Carlo dropout: the model is run several times with its two
+Dropout(0.1) layers kept active, and the mean and a credible interval of every probability are taken over the passes.
+
+Instead of one predict call per pass, the passes run as a single tiled batch. With the NumPy engines, the first-layer
+pre-activation of each profile is computed once (the dropout comes after it), tiled once per pass, and the dropout
+masks of all the passes are drawn beforehand and applied to the whole batch. The number of passes can be capped by a
+latency budget: a pilot batch of passes is timed, and only as many passes as fit in the rest of the budget are added.
+
+Usage:
+python uncertainty.py --profile profile.json --passes 100 --level 0.9    # Profile with the app's human labels
+python uncertainty.py --profile profile.json --passes 500 --budget 0.2   # At most 0.2 s
+"""
+
+# Libraries importation
+import argparse
+import json
+import time
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from catalogues import crime_labels, default_labels
+from inference import activations
+
+# Dropout rate after each Dense layer of the notebook's model, used when no architecture is given
+dropout_rates = [0.10, 0.10, 0.0]
+
+# Maximum number of rows (passes x profiles) of a tiled batch, to bound the memory of the hidden layers
+max_batch_rows = 16384
+
+
+# Function to read the dropout rates from the model's architecture
+def read_dropout_rates(architecture):
+    """
+    Function to retrieve the rate of the Dropout layer that follows each Dense layer of a Keras Sequential model.
+
+    :parameter:
+    architecture (String): Model's architecture JSON, e.g., the content of CrimePredictorConfig.json.
+
+    :returns:
+    rates (List): Dropout rate after each Dense layer (0 if there is none).
+    """
+
+    rates = []
+    for layer in json.loads(architecture)["config"]["layers"]:
+        if layer["class_name"] == "Dense":
+            rates.append(0.0)
+        elif layer["class_name"] == "Dropout" and rates:
+            rates[-1] = float(layer["config"]["rate"])
+
+    return rates
+
+
+# Function to draw the dropout masks of a batch
+def get_masks(rng, n_rows, units, rates, dtype=np.float32):
+    """
+    Function to draw the dropout masks of every hidden layer for a whole batch at once. As in Keras, the kept units
+    are scaled by 1 / (1 - rate).
+
+    :parameter:
+    rng (Numpy Generator): Random number generator.
+    n_rows (Integer): Number of rows of the batch.
+    units (List): Number of units of each Dense layer.
+    rates (List): Dropout rate after each Dense layer.
+    dtype (Numpy dtype): Data type of the masks.
+
+    :returns:
+    masks (List): Mask of shape (n_rows, units) of each Dense layer, or None if it has no dropout.
+    """
+
+    masks = []
+    for n_units, rate in zip(units, rates):
+        if rate <= 0:
+            masks.append(None)
+            continue
+        mask = rng.random((n_rows, n_units), dtype=np.float32) >= rate
+        masks.append(mask.astype(dtype) / dtype(1 - rate))
+
+    return masks
+
+
+# Function to run the network with dropout masks
+def forward_dropout(model, z, masks):
+    """
+    Function to run the NumPy engine from the pre-activation of the first layer up to the output probabilities, with
+    the dropout masks applied after the activation of each layer.
+
+    :parameter:
+    model (NumpyModel or QuantizedModel): Trained model.
+    z (Numpy array): Pre-activation values of the first Dense layer, of shape (n_rows, units).
+    masks (List): Dropout masks of each Dense layer (see get_masks).
+
+    :returns:
+    y (Numpy array): Output of the last layer.
+    """
+
+    x = z
+    for i, (kernel, bias, activation) in enumerate(zip(model.kernels, model.biases, model.activations)):
+        if i:
+            x = x @ kernel
+            x += bias
+        x = activations[activation](x)
+        if i < len(masks) and masks[i] is not None:
+            x *= masks[i]
+
+    return x
+
+
+# Function to sample the probabilities with dropout
+def sample_probabilities(model, X, n_passes, rates=dropout_rates, rng=None):
+    """
+    Function to predict the probabilities of a batch of profiles several times with dropout active, running all the
+    passes as tiled batches.
+
+    :parameter:
+    model (NumpyModel, QuantizedModel or Keras object): Trained model.
+    X (Numpy array or sparse matrix): Input matrix of shape (n_rows, n_features).
+    n_passes (Integer): Number of stochastic passes.
+    rates (List): Dropout rate after each Dense layer (the Keras model uses its own Dropout layers).
+    rng (Numpy Generator): Random number generator of the masks.
+
+    :returns:
+    samples (Numpy array): Probabilities of shape (n_passes, n_rows, 19).
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+    X = X.tocsr() if issparse(X) else csr_matrix(np.atleast_2d(X))
+    n_rows = X.shape[0]
+    rows_per_batch = max(1, max_batch_rows // n_passes)
+
+    samples = np.empty((n_passes, n_rows, len(crime_labels)), dtype=np.float32)
+    for start in range(0, n_rows, rows_per_batch):
+        stop = min(start + rows_per_batch, n_rows)
+
+        if hasattr(model, "first_layer"):
+            z = np.tile(model.first_layer(X[start:stop]), (n_passes, 1))
+            masks = get_masks(rng, len(z), [kernel.shape[1] for kernel in model.kernels], rates, model.dtype)
+            Y = forward_dropout(model, z, masks)
+        else:
+            X_tiled = np.tile(X[start:stop].toarray(), (n_passes, 1))
+            Y = np.asarray(model(X_tiled, training=True))
+
+        samples[:, start:stop] = Y.reshape(n_passes, stop - start, -1)
+
+    return samples
+
+
+# Function to predict the probabilities with their uncertainty bands
+def mc_predict(model, X, n_passes=50, level=0.9, budget=None, rates=dropout_rates, seed=None, pilot_passes=8):
+    """
+    Function to compute the mean and a credible interval of every crime probability with Monte Carlo dropout.
+
+    :parameter:
+    model (NumpyModel, QuantizedModel or Keras object): Trained model.
+    X (Numpy array or sparse matrix): Input matrix of shape (n_rows, n_features).
+    n_passes (Integer): Maximum number of stochastic passes.
+    level (Float): Probability mass of the credible interval.
+    budget (Float): Latency budget in seconds, which caps the number of passes (no cap if None).
+    rates (List): Dropout rate after each Dense layer.
+    seed (Integer): Seed of the dropout masks.
+    pilot_passes (Integer): Number of passes timed to estimate the cost of a pass when a budget is set.
+
+    :returns:
+    mean (Numpy array): Mean probabilities of shape (n_rows, 19).
+    lower (Numpy array): Lower bounds of the credible intervals, of shape (n_rows, 19).
+    upper (Numpy array): Upper bounds of the credible intervals, of shape (n_rows, 19).
+    n_passes (Integer): Number of passes actually run.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    if budget is None or n_passes <= pilot_passes:
+        samples = sample_probabilities(model, X, n_passes, rates, rng)
+    else:
+        start = time.perf_counter()
+        samples = sample_probabilities(model, X, pilot_passes, rates, rng)
+        elapsed = time.perf_counter() - start
+        extra_passes = min(n_passes - pilot_passes, int((budget - elapsed) * pilot_passes / max(elapsed, 1e-9)))
+        if extra_passes > 0:
+            samples = np.concatenate([samples, sample_probabilities(model, X, extra_passes, rates, rng)])
+
+    alpha = (1 - level) / 2
+    lower, upper = np.quantile(samples, [alpha, 1 - alpha], axis=0)
+
+    return samples.mean(axis=0), lower, upper, len(samples)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Monte Carlo dropout uncertainty of the crime predictor.")
+    parser.add_argument("--profile", required=True, help="JSON file with the human labels of a profile.")
+    parser.add_argument("--passes", type=int, default=50, help="Maximum number of stochastic passes.")
+    parser.add_argument("--level", type=float, default=0.9, help="Probability mass of the credible intervals.")
+    parser.add_argument("--budget", type=float, default=None, help="Latency budget in seconds.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the dropout masks.")
+    parser.add_argument("--backend", choices=["numpy", "keras", "float16", "int8"], default="numpy",
+                        help="Inference backend.")
+    parser.add_argument("--config", default="CrimePredictorConfig.json", help="Model's architecture JSON file.")
+    parser.add_argument("--weights", default="CrimePredictorWeights.h5", help="Model's weights HDF5 file.")
+    args = parser.parse_args()
+
+    from registry import CatalogueRegistry
+
+    registry = CatalogueRegistry.from_files()
+    with open(args.profile) as file:
+        labels = json.load(file)
+    labels = {**default_labels, **labels}
+    with open(args.config) as file:
+        rates = read_dropout_rates(file.read())
+
+    from batch_scoring import predict
+
+    if args.backend in ("float16", "int8"):
+        from inference import QuantizedModel
+        model = QuantizedModel.from_file(f"CrimePredictorWeights.{args.backend}.npz")
+    else:
+        from batch_scoring import load_model
+        model = load_model(args.backend, args.config, args.weights)
+
+    input_array = registry.layout.encode(registry.profile(labels), sparse=True)
+    y = predict(model, input_array).reshape(-1)
+
+    start = time.perf_counter()
+    mean, lower, upper, n_passes = mc_predict(model, input_array, args.passes, args.level, args.budget, rates,
+                                              args.seed)
+    seconds = time.perf_counter() - start
+
+    for crime, point, m, low, high in zip(crime_labels, y, mean[0], lower[0], upper[0]):
+        print(f"{crime:<45} {point:7.2%}  mean {m:7.2%}  [{low:7.2%}, {high:7.2%}]")
+    print(f"{n_passes} passes with a {args.level:.0%} interval computed in {seconds:.3f} s.")